@@ -6,14 +6,26 @@ initializing a terminal view
 import os
 import threading
 import time
+import uuid
 
 import sublime
 import sublime_plugin
 
+from . import asciicast
+from . import emulator_worker
 from . import sublime_terminal_buffer
 from . import linux_pty
+from . import profiler
+from . import resize
+from . import scrollback
+from . import session_recorder
+from . import shell_pool
+from . import snapshot
 from . import utils
 
+# Seconds between saving snapshots of a terminal view that has new output
+SNAPSHOT_INTERVAL = 30
+
 
 class TerminalViewOpen(sublime_plugin.WindowCommand):
     """
@@ -52,12 +64,37 @@ class TerminalViewOpen(sublime_plugin.WindowCommand):
         self.window.new_file().run_command("terminal_view_core", args=args)
 
 
+class TerminalViewPlayAsciicast(sublime_plugin.WindowCommand):
+    """
+    Command for playing back an asciicast v2 recording in a new terminal view
+    """
+    def run(self, path=None, speed=1.0, title="Terminal (asciicast)"):
+        """
+        Open a new terminal view playing back a recording
+
+        Args:
+            path (str, optional): The asciicast v2 file. Asked for if omitted.
+            speed (float, optional): Playback speed multiplier. Defaults to 1.
+            title (str, optional): Terminal view title.
+        """
+        if path is None:
+            def on_done(path):
+                self.run(path, speed, title)
+
+            self.window.show_input_panel("asciicast file:", "", on_done, None, None)
+            return
+
+        args = {"cmd": "", "title": title, "cwd": None, "syntax": None,
+                "asciicast_file": os.path.expanduser(path), "speed": speed}
+        self.window.new_file().run_command("terminal_view_core", args=args)
+
+
 class TerminalViewCore(sublime_plugin.TextCommand):
     """
     Main command to glue all parts together for a single instance of a terminal
     view. For each sublime view an instance of this class exists.
     """
-    def run(self, _, cmd, title, cwd, syntax):
+    def run(self, _, cmd, title, cwd, syntax, asciicast_file=None, speed=1.0, snapshot_id=None):
         """
         Initialize the view, in which this command is called, as a terminal
         view.
@@ -66,6 +103,12 @@ class TerminalViewCore(sublime_plugin.TextCommand):
             cmd (str): Command to execute as shell (e.g. 'bash -l').
             title (str): Terminal view title.
             cwd (str): The working directory to start in.
+            asciicast_file (str, optional): Play back this asciicast v2
+                                            recording instead of starting
+                                            a shell.
+            speed (float, optional): Speed multiplier for the playback.
+            snapshot_id (str, optional): Restore the snapshot with this id
+                                         (see terminal_view_persist_sessions).
         """
         self._cmd = cmd
         self._cwd = cwd
@@ -77,21 +120,46 @@ class TerminalViewCore(sublime_plugin.TextCommand):
                                                                               syntax)
         self._terminal_buffer.set_keypress_callback(self.terminal_view_keypress_callback)
         self._terminal_buffer_is_open = True
-        self._terminal_rows = 0
-        self._terminal_columns = 0
-
-        # Start the underlying shell
-        self._shell = linux_pty.LinuxPty(self._cmd.split(), self._cwd)
-        self._shell_is_running = True
+        self._resize_debouncer = resize.ResizeDebouncer()
+
+        # The shell is started by the update thread so starting many terminal
+        # views (e.g. when restoring sessions) does not block the UI thread
+        self._shell = None
+        self._shell_is_running = False
+        self._recorder = None
+
+        # A recording is played back at its own size (see AsciicastPlayer)
+        self._playback = asciicast_file is not None
+
+        settings = sublime.load_settings('TerminalView.sublime-settings')
+        self._worker_python = settings.get("terminal_view_worker_python", "")
+        self._worker = None
+        self._snapshot_path = None
+        if asciicast_file is None and settings.get("terminal_view_persist_sessions", False):
+            if snapshot_id is None:
+                snapshot_id = uuid.uuid4().hex
+            self._snapshot_path = os.path.join(_snapshot_dir(), snapshot_id + ".tvsnap")
+        self._snapshot_time = time.time()
+        self._snapshot_needed = False
 
         # Save the command args in view settings so it can restarted when ST3 is
         # restarted (or when changing back to a project that had a terminal view
         # open)
         args = {"cmd": cmd, "title": title, "cwd": cwd, "syntax": syntax}
+        if asciicast_file is not None:
+            args["asciicast_file"] = asciicast_file
+            args["speed"] = speed
+        if self._snapshot_path is not None:
+            args["snapshot_id"] = snapshot_id
         self.view.settings().set("terminal_view_core_args", args)
 
-        # Start the main loop
-        threading.Thread(target=self._main_update_loop).start()
+        # Start the shell and the main loop
+        record_settings = None
+        if settings.get("terminal_view_record_sessions", False):
+            record_settings = (settings.get("terminal_view_record_dir", ""),
+                               settings.get("terminal_view_record_format", "tvrec"))
+        threading.Thread(target=self._start_session,
+                         args=(asciicast_file, speed, record_settings)).start()
 
     def terminal_view_keypress_callback(self, key, ctrl=False, alt=False, shift=False, meta=False):
         """
@@ -104,8 +172,122 @@ class TerminalViewCore(sublime_plugin.TextCommand):
             shift (boolean, optional)
             meta (boolean, optional)
         """
+        if self._shell is None:
+            # The shell has not been started yet
+            return
+
+        self._terminal_buffer.metrics().input_sent()
         self._shell.send_keypress(key, ctrl, alt, shift, meta)
 
+    def _start_session(self, asciicast_file, speed, record_settings):
+        """
+        Start the underlying shell (or the playback of a recording) and run the
+        main loop. Runs in its own thread.
+        """
+        try:
+            if asciicast_file is not None:
+                shell = asciicast.AsciicastPlayer(asciicast_file, speed,
+                                                  self._terminal_buffer.update_terminal_size)
+            elif self._worker_python:
+                shell = self._start_worker()
+            else:
+                if self._snapshot_path is not None:
+                    self._restore_snapshot()
+                shell = _start_shell(self._cmd, self._cwd)
+        except (OSError, ValueError) as e:
+            self._abort_session(asciicast_file or self._cmd, e)
+            return
+
+        self._shell = shell
+        self._shell_is_running = True
+
+        # Optionally record the session for offline replay
+        if asciicast_file is None and record_settings is not None:
+            if self._worker is not None:
+                self._console_logger.log("Sessions running in a worker process are not recorded")
+            else:
+                self._start_recording(*record_settings)
+
+        self._main_update_loop()
+
+    def _abort_session(self, name, error):
+        """
+        Report that the shell (or the playback) could not be started and close
+        the view, which would not react to anything without it
+        """
+        self._console_logger.log("Failed to start %s: %s", name, error)
+        message = "Terminal View: Failed to start \"%s\":\n\n%s" % (name, error)
+        sublime.set_timeout(lambda: sublime.error_message(message), 0)
+
+        if self._snapshot_path is not None:
+            snapshot.remove_snapshot(self._snapshot_path)
+        if self._terminal_buffer_is_open:
+            self._terminal_buffer.close()
+            self._terminal_buffer_is_open = False
+        self._terminal_buffer.release_history()
+        _closed_views.discard(self.view.id())
+
+    def _start_worker(self):
+        """
+        Start the shell and the terminal emulator in a worker process (see
+        terminal_view_worker_python). The worker restores the snapshot itself.
+        """
+        snapshot_path = self._snapshot_path
+        if snapshot_path is not None and not os.path.exists(snapshot_path):
+            snapshot_path = None
+
+        worker = emulator_worker.WorkerClient(self._cmd.split(), self._cwd, self._worker_python,
+                                              self._terminal_buffer.emulator_options(),
+                                              snapshot_path)
+        self._terminal_buffer.set_emulator(worker.emulator())
+        self._console_logger.log("Started terminal worker process with %s", self._worker_python)
+        self._worker = worker
+        return worker
+
+    def _restore_snapshot(self):
+        """
+        Restore the output of the previous session of this view if a
+        snapshot of it was saved
+        """
+        start = time.time()
+        try:
+            restored = self._terminal_buffer.load_snapshot(self._snapshot_path)
+        except (OSError, ValueError) as e:
+            self._console_logger.log("Failed to restore snapshot %s: %s", self._snapshot_path, e)
+            return
+
+        if restored:
+            self._console_logger.log("Restored snapshot %s in %.1f ms", self._snapshot_path,
+                                     (time.time() - start) * 1000)
+
+    def _save_snapshot(self):
+        try:
+            self._terminal_buffer.save_snapshot(self._snapshot_path)
+        except OSError as e:
+            self._console_logger.log("Failed to save snapshot %s: %s", self._snapshot_path, e)
+        self._snapshot_time = time.time()
+        self._snapshot_needed = False
+
+    def _start_recording(self, record_dir, record_format):
+        """
+        Start recording the session to a new file in the given directory,
+        either in the internal format ("tvrec") or as asciicast v2 ("asciicast")
+        """
+        if not record_dir:
+            record_dir = os.path.join(sublime.cache_path(), "TerminalView", "recordings")
+        os.makedirs(record_dir, exist_ok=True)
+
+        name = "session_%s_%i" % (time.strftime("%Y%m%d_%H%M%S"), self.view.id())
+        if record_format == "asciicast":
+            path = os.path.join(record_dir, name + ".cast")
+            (lines, columns) = self._terminal_buffer.terminal_size()
+            self._recorder = asciicast.AsciicastWriter(path, columns, lines)
+        else:
+            path = os.path.join(record_dir, name + ".tvrec")
+            self._recorder = session_recorder.SessionRecorder(path)
+        self._shell.set_recorder(self._recorder)
+        self._console_logger.log("Recording session to %s", self._recorder.path())
+
     def _main_update_loop(self):
         """
         This is the main update function. It attempts to run at a certain number
@@ -114,9 +296,25 @@ class TerminalViewCore(sublime_plugin.TextCommand):
         # 30 frames per second should be responsive enough
         ideal_delta = 1.0 / 30.0
         current = time.time()
+        view_metrics = self._terminal_buffer.metrics()
+        loop_profiler = None
         while True:
+            if loop_profiler is None and self.view.terminal_view_profile is not None:
+                loop_profiler = profiler.UpdateLoopProfiler(self.view.terminal_view_profile)
+                self.view.terminal_view_profile = None
+
+            if loop_profiler is not None:
+                loop_profiler.start()
+
             self._poll_shell_output()
             success = self._terminal_buffer.update_view()
+
+            if loop_profiler is not None:
+                loop_profiler.stop()
+                if loop_profiler.finished():
+                    self._show_profile(loop_profiler)
+                    loop_profiler = None
+
             if not success:
                 # Leave view open as we should only get an update if we are
                 # reloading the plugin
@@ -128,46 +326,98 @@ class TerminalViewCore(sublime_plugin.TextCommand):
                 self._stop()
                 break
 
+            # Sublime Text does not tell plugins when it exits so the snapshot
+            # is saved regularly
+            if self._snapshot_needed and time.time() - self._snapshot_time > SNAPSHOT_INTERVAL:
+                self._save_snapshot()
+
             previous = current
             current = time.time()
             actual_delta = current - previous
+            if actual_delta > 2 * ideal_delta:
+                # Count the frames that should have been shown in the meantime
+                view_metrics.count("frames_dropped", int(actual_delta / ideal_delta) - 1)
             time_left = ideal_delta - actual_delta
             if time_left > 0.0:
                 time.sleep(time_left)
 
+    def _show_profile(self, loop_profiler):
+        """
+        Save the results of profiling the update loop and show a summary in a
+        new scratch view
+        """
+        profile_dir = os.path.join(sublime.cache_path(), "TerminalView", "profiles")
+        os.makedirs(profile_dir, exist_ok=True)
+        name = "profile_%s_%i.pstats" % (time.strftime("%Y%m%d_%H%M%S"), self.view.id())
+        summary = loop_profiler.dump(os.path.join(profile_dir, name))
+
+        def show_summary():
+            view = self.view.window().new_file()
+            view.set_name("Terminal View Profile")
+            view.set_scratch(True)
+            view.run_command("append", {"characters": summary})
+
+        sublime.set_timeout(show_summary, 0)
+
     def _poll_shell_output(self):
         """
         Poll the output of the shell
         """
         max_read_size = 4096
+        trace = self.view.terminal_view_trace
+        if trace is not None:
+            trace_start = trace.now()
         data = self._shell.receive_output(max_read_size)
+        if trace is not None:
+            trace.add("read", trace_start, len(data or b""))
         if data is not None:
-            self._console_logger.log("Got %u bytes of data from shell" % (len(data), ))
+            self._console_logger.log("Got %u bytes of data from shell", len(data))
             self._terminal_buffer.insert_data(data)
+            self._snapshot_needed = self._snapshot_path is not None
+        elif self._worker is not None:
+            # The output is parsed by the worker
+            if trace is not None:
+                trace_start = trace.now()
+            received = self._worker.poll()
+            (nb_bytes, parse_ms) = self._worker.emulator().take_output()
+            if trace is not None:
+                trace.add("worker_poll", trace_start, nb_bytes)
+            if nb_bytes:
+                self._terminal_buffer.output_parsed_elsewhere(nb_bytes, parse_ms)
+            if received:
+                self._snapshot_needed = self._snapshot_path is not None
 
     def _resize_screen_if_needed(self):
         """
         Check if the terminal view was resized. If so update the screen size of
-        the terminal and notify the shell.
+        the terminal and notify the shell once the size has settled.
         """
-        (rows, cols) = self._terminal_buffer.view_size()
-        row_diff = abs(self._terminal_rows - rows)
-        col_diff = abs(self._terminal_columns - cols)
+        if self._playback:
+            return
 
-        if row_diff or col_diff:
-            log = "Changing screen size from (%i, %i) to (%i, %i)" % \
-                  (self._terminal_rows, self._terminal_columns, rows, cols)
-            self._console_logger.log(log)
+        previous_size = self._resize_debouncer.size()
+        size = self._resize_debouncer.update(self._terminal_buffer.view_size)
+        if size is not None:
+            (rows, cols) = size
+            self._console_logger.log("Changing screen size from %s to (%i, %i)",
+                                     previous_size, rows, cols)
 
-            self._terminal_rows = rows
-            self._terminal_columns = cols
-            self._shell.update_screen_size(self._terminal_rows, self._terminal_columns)
-            self._terminal_buffer.update_terminal_size(self._terminal_rows, self._terminal_columns)
+            self._shell.update_screen_size(rows, cols)
+            self._terminal_buffer.update_terminal_size(rows, cols)
 
     def _stop(self, close_view=True):
         """
         Stop the terminal and close everything down.
         """
+        closed_by_user = self.view.id() in _closed_views
+        if self._snapshot_path is not None:
+            if self._shell.is_running() and not closed_by_user:
+                # The view is closed for a project switch or the plugin is
+                # reloaded so the session is restored later
+                self._save_snapshot()
+            else:
+                snapshot.remove_snapshot(self._snapshot_path)
+
         if self._terminal_buffer_is_open and close_view:
             self._terminal_buffer.close()
             self._terminal_buffer_is_open = False
@@ -176,26 +426,121 @@ class TerminalViewCore(sublime_plugin.TextCommand):
             self._shell.stop()
             self._shell_is_running = False
 
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
+        self._terminal_buffer.release_history()
+        _closed_views.discard(self.view.id())
+
+
+# Shells started ahead of time (see terminal_view_shell_pool_size)
+_shell_pool = None
+
+
+def _start_shell(cmd, cwd):
+    if _shell_pool is not None:
+        shell = _shell_pool.acquire(cmd, cwd)
+        if shell is not None:
+            return shell
+
+    return linux_pty.LinuxPty(cmd.split(), cwd)
+
+
+def _snapshot_dir():
+    return os.path.join(sublime.cache_path(), "TerminalView", "snapshots")
+
 
 def plugin_loaded():
+    global _shell_pool
+    settings = sublime.load_settings('TerminalView.sublime-settings')
+    snapshot.remove_old_snapshots(_snapshot_dir())
+    scrollback.remove_spill_files(sublime_terminal_buffer.history_spill_dir(settings))
+
+    pool_size = settings.get("terminal_view_shell_pool_size", 0)
+    if pool_size > 0:
+        pool_commands = settings.get("terminal_view_shell_pool_commands", ["/bin/bash -l"])
+        _shell_pool = shell_pool.ShellPool(pool_size, pool_commands)
+        for cmd in pool_commands:
+            _shell_pool.prewarm(cmd)
+
     # When the plugin gets loaded everything should be dead so wait a bit to
     # make sure views are ready, then try to restart all sessions.
     sublime.set_timeout(restart_all_terminal_view_sessions, 100)
 
 
+def plugin_unloaded():
+    global _shell_pool
+    if _shell_pool is not None:
+        _shell_pool.close()
+        _shell_pool = None
+
+
 def restart_all_terminal_view_sessions():
-    win = sublime.active_window()
-    for view in win.views():
-        restart_terminal_view_session(view)
+    """
+    Restart the sessions of the terminal views in all windows. Views that are
+    visible are restarted right away, the others when they are first activated
+    (see TerminalViewRestoreListener).
+    """
+    for win in sublime.windows():
+        visible = _visible_views(win)
+        for view in visible:
+            restart_terminal_view_session(view)
+
+        for view in win.views():
+            if view not in visible:
+                _defer_restart(view)
 
 
 class ProjectSwitchWatcher(sublime_plugin.EventListener):
     def on_load(self, view):
         # On load is called on old terminal views when switching between projects
-        restart_terminal_view_session(view)
+        window = view.window()
+        if window is None or view in _visible_views(window):
+            restart_terminal_view_session(view)
+        else:
+            _defer_restart(view)
+
+
+class TerminalViewRestoreListener(sublime_plugin.EventListener):
+    def on_activated(self, view):
+        if view.id() in _pending_restarts:
+            restart_terminal_view_session(view)
+
+
+class TerminalViewCloseListener(sublime_plugin.EventListener):
+    def on_pre_close(self, view):
+        # Views are also closed when their window is closed or the project
+        # is switched, their sessions are restored later. A view closed while
+        # its window stays open is closed by the user and its snapshot is
+        # removed (see TerminalViewCore._stop).
+        if not view.settings().has("terminal_view_core_args"):
+            return
+
+        window = view.window()
+        if window is not None and window.id() in [win.id() for win in sublime.windows()]:
+            _closed_views.add(view.id())
+
+
+# Ids of terminal views whose session is restarted once they are activated
+_pending_restarts = set()
+
+# Ids of terminal views closed by the user
+_closed_views = set()
+
+
+def _visible_views(window):
+    views = [window.active_view_in_group(group) for group in range(window.num_groups())]
+    return [view for view in views if view is not None]
+
+
+def _defer_restart(view):
+    if view.settings().has("terminal_view_core_args"):
+        _pending_restarts.add(view.id())
 
 
 def restart_terminal_view_session(view):
+    _pending_restarts.discard(view.id())
     settings = view.settings()
     if settings.has("terminal_view_core_args"):
         view.run_command("terminal_view_clear")
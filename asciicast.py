@@ -0,0 +1,215 @@
+"""
+Export and import of terminal sessions in the asciicast v2 format (JSON lines,
+see https://docs.asciinema.org/manual/asciicast/v2/). Files are always
+processed line by line so large recordings are never loaded into memory.
+"""
+import codecs
+import json
+import time
+
+# Size of the write buffer of the recording file
+_WRITE_BUFFER_SIZE = 65536
+
+
+class AsciicastWriter():
+    """
+    Records a terminal session as an asciicast v2 file. Has the same interface
+    as session_recorder.SessionRecorder so it can be attached to a LinuxPty.
+    """
+    def __init__(self, path, width=80, height=24, env=None):
+        self._path = path
+        self._file = open(path, "w", encoding="utf-8", buffering=_WRITE_BUFFER_SIZE)
+        self._start = time.monotonic()
+
+        # Output chunks may end in the middle of a UTF-8 sequence
+        self._output_decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._input_decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+        header = {
+            "version": 2,
+            "width": width,
+            "height": height,
+            "timestamp": int(time.time()),
+            "env": env or {"TERM": "linux"},
+        }
+        self._file.write(json.dumps(header) + "\n")
+
+    def path(self):
+        return self._path
+
+    def record_output(self, data):
+        self._write("o", self._output_decoder.decode(data))
+
+    def record_input(self, data):
+        self._write("i", self._input_decoder.decode(data))
+
+    def record_resize(self, lines, columns):
+        self._write("r", "%ix%i" % (columns, lines))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, event, data):
+        if self._file is None or not data:
+            return
+
+        timestamp = round(time.monotonic() - self._start, 6)
+        self._file.write(json.dumps([timestamp, event, data]) + "\n")
+
+
+def read_asciicast_header(path):
+    """
+    Read the header of an asciicast v2 file.
+
+    Returns:
+        dict: The header, with at least the width and height of the terminal.
+    """
+    with open(path, encoding="utf-8") as cast_file:
+        return _read_header(cast_file, path)
+
+
+def read_asciicast(path):
+    """
+    Read the events of an asciicast v2 file one line at a time.
+
+    Yields:
+        tuple: (timestamp, event type, data) for each event in the file.
+    """
+    with open(path, encoding="utf-8") as cast_file:
+        _read_header(cast_file, path)
+        for line in cast_file:
+            line = line.strip()
+            if not line:
+                continue
+
+            (timestamp, event, data) = json.loads(line)
+            yield (timestamp, event, data)
+
+
+def _read_header(cast_file, path):
+    header = json.loads(cast_file.readline() or "{}")
+    if header.get("version") != 2 or "width" not in header or "height" not in header:
+        raise ValueError("%s is not an asciicast v2 file" % path)
+    return header
+
+
+def _parse_size(data):
+    # Size of a resize event as (lines, columns)
+    (columns, lines) = data.split("x")
+    return (int(lines), int(columns))
+
+
+def replay_asciicast(path, terminal, realtime=False, speed=1.0, on_output=None):
+    """
+    Replay the output of an asciicast v2 file into a terminal emulator,
+    resized to the size of the recording.
+
+    Args:
+        path (str): asciicast v2 file.
+        terminal: Object with feed(data) and resize(lines, columns) methods,
+                  e.g. a PyteTerminalEmulator.
+        realtime (bool, optional): Replay with the original timing instead of
+                                   as fast as possible.
+        speed (float, optional): Speed multiplier when replaying in realtime.
+        on_output (callable, optional): Called after each output event has
+                                        been fed, e.g. to render a frame.
+
+    Returns:
+        tuple: (number of output events, number of output bytes)
+    """
+    header = read_asciicast_header(path)
+    terminal.resize(header["height"], header["width"])
+
+    nb_events = 0
+    nb_bytes = 0
+    start = time.monotonic()
+    for (timestamp, event, data) in read_asciicast(path):
+        if realtime:
+            delay = timestamp / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        if event == "o":
+            data = data.encode("utf-8")
+            terminal.feed(data)
+            nb_events = nb_events + 1
+            nb_bytes = nb_bytes + len(data)
+            if on_output is not None:
+                on_output()
+        elif event == "r":
+            terminal.resize(*_parse_size(data))
+
+    return (nb_events, nb_bytes)
+
+
+class AsciicastPlayer():
+    """
+    Plays back an asciicast v2 file in place of a shell. Implements the parts
+    of the LinuxPty interface used by the terminal view so a recording can be
+    shown in a terminal view. Output events are returned by receive_output
+    once they are due according to the speed multiplier.
+
+    The terminal is kept at the size of the recording: on_resize(lines,
+    columns) is called with the size in the header right away and with the
+    size of each resize event once the output before it has been returned.
+    """
+    def __init__(self, path, speed=1.0, on_resize=None):
+        header = read_asciicast_header(path)
+        self._events = read_asciicast(path)
+        self._speed = speed if speed > 0 else 1.0
+        self._on_resize = on_resize
+        self._pending = None
+        self._start = time.monotonic()
+        self._running = True
+        self._resize(header["height"], header["width"])
+
+    def stop(self):
+        self._events.close()
+        self._running = False
+
+    def is_running(self):
+        # Keep running after the last event so the view stays open
+        return self._running
+
+    def receive_output(self, max_read_size, timeout=0):
+        """
+        Get the output of all events that are due, limited to roughly
+        max_read_size bytes
+        """
+        elapsed = (time.monotonic() - self._start) * self._speed
+        output = b""
+        while len(output) < max_read_size:
+            event = self._next_event()
+            if event is None or event[0] > elapsed:
+                break
+
+            if event[1] == "r" and output:
+                # Resize once the output before the event has been shown
+                break
+
+            self._pending = None
+            if event[1] == "o":
+                output = output + event[2].encode("utf-8")
+            elif event[1] == "r":
+                self._resize(*_parse_size(event[2]))
+
+        return output or None
+
+    def update_screen_size(self, lines, columns):
+        # The size of the recording can not be changed, see on_resize
+        pass
+
+    def send_keypress(self, key, ctrl=False, alt=False, shift=False, meta=False):
+        # Input is ignored during playback
+        pass
+
+    def _resize(self, lines, columns):
+        if self._on_resize is not None:
+            self._on_resize(lines, columns)
+
+    def _next_event(self):
+        if self._pending is None:
+            self._pending = next(self._events, None)
+        return self._pending
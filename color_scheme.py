@@ -0,0 +1,374 @@
+"""
+Terminal colors and the color scheme scopes used to show them.
+
+Colors are stored in the screen buffer as packed integers: 0 is the default
+color, indexed colors (the 16 basic colors and the 256 color palette) have
+the INDEXED flag set and the palette index in the low byte and 24 bit colors
+have the RGB flag set and the color in the low 24 bits (0xRRGGBB).
+
+The shipped color scheme has scopes for all pairs of the 16 basic colors.
+Scopes for other combinations (including bold text) are generated lazily by
+ColorSchemeGenerator as they appear in the terminal.
+"""
+import os
+import threading
+import time
+
+# Packed color encoding
+DEFAULT = 0
+INDEXED = 1 << 24
+RGB = 2 << 24
+
+# The colors used when the default color is set
+DEFAULT_BG = INDEXED | 0
+DEFAULT_FG = INDEXED | 7
+
+# Names of the 16 basic colors, the first 8 match the scope names of the
+# original color scheme
+BASIC_COLOR_NAMES = ["black", "red", "green", "brown", "blue", "magenta", "cyan", "white",
+                     "brightblack", "brightred", "brightgreen", "brightbrown", "brightblue",
+                     "brightmagenta", "brightcyan", "brightwhite"]
+
+# The basic colors have slightly different shades as background and
+# foreground colors
+BASIC_BG_COLORS = ["#000001", "#a54242", "#8c9440", "#de935f", "#5f819d", "#85678f", "#5e8d87",
+                   "#c5c8c6"]
+BASIC_FG_COLORS = ["#282a2e", "#cc6666", "#b5bd68", "#f0c674", "#81a2be", "#b294bb", "#8abeb7",
+                   "#ffffff"]
+BRIGHT_COLORS = ["#666666", "#d54e53", "#b9ca4a", "#e7c547", "#7aa6da", "#c397d8", "#70c0b1",
+                 "#eaeaea"]
+
+# Levels of the 6x6x6 color cube of the 256 color palette
+_CUBE_LEVELS = (0, 95, 135, 175, 215, 255)
+
+
+def indexed(index):
+    return INDEXED | (index & 0xff)
+
+
+def rgb(red, green, blue):
+    return RGB | ((red & 0xff) << 16) | ((green & 0xff) << 8) | (blue & 0xff)
+
+
+def to_rgb(color, background=False):
+    """
+    Get the (red, green, blue) value of a packed color
+    """
+    if color == DEFAULT:
+        color = DEFAULT_BG if background else DEFAULT_FG
+
+    value = color & 0xffffff
+    if color & RGB:
+        return (value >> 16, (value >> 8) & 0xff, value & 0xff)
+
+    if value < 8:
+        hex_color = BASIC_BG_COLORS[value] if background else BASIC_FG_COLORS[value]
+        return _parse_hex(hex_color)
+    elif value < 16:
+        return _parse_hex(BRIGHT_COLORS[value - 8])
+    elif value < 232:
+        value = value - 16
+        return (_CUBE_LEVELS[value // 36], _CUBE_LEVELS[(value // 6) % 6], _CUBE_LEVELS[value % 6])
+
+    level = 8 + (value - 232) * 10
+    return (level, level, level)
+
+
+def to_hex(color, background=False):
+    return "#%02x%02x%02x" % to_rgb(color, background)
+
+
+# Number of basic colors with scopes in the original color scheme, which user
+# color schemes are copied from
+ORIGINAL_SCHEME_COLORS = 8
+
+# Nearest basic color of all colors seen so far
+_nearest_basic_colors = {}
+
+
+def nearest_basic_color(color, background=False, nb_colors=16):
+    """
+    Get the basic color (palette index 0 to nb_colors - 1) closest to a packed
+    color. With 8 colors the bright colors are shown as their normal color.
+    """
+    if is_basic_color(color):
+        if color != DEFAULT and color & 0xff >= nb_colors:
+            return color - 8
+        return color
+
+    key = (color, background, nb_colors)
+    if key not in _nearest_basic_colors:
+        (red, green, blue) = to_rgb(color, background)
+        distances = []
+        for index in range(nb_colors):
+            (r, g, b) = to_rgb(INDEXED | index, background)
+            distances.append(((red - r) ** 2 + (green - g) ** 2 + (blue - b) ** 2, index))
+        _nearest_basic_colors[key] = INDEXED | min(distances)[1]
+
+    return _nearest_basic_colors[key]
+
+
+def color_name(color, background=False):
+    """
+    Get the name of a basic color as used in scope names
+    """
+    if color == DEFAULT:
+        color = DEFAULT_BG if background else DEFAULT_FG
+
+    return BASIC_COLOR_NAMES[color & 0xff]
+
+
+def scope_name(bg, fg, nb_colors=16):
+    """
+    Get the scope of a background and foreground color pair. Colors outside
+    the first nb_colors basic colors are shown as the closest basic color.
+    """
+    bg = nearest_basic_color(bg, True, nb_colors)
+    fg = nearest_basic_color(fg, False, nb_colors)
+    return "terminalview.%s_%s" % (color_name(bg, True), color_name(fg))
+
+
+def is_basic_color(color):
+    return color == DEFAULT or (color & INDEXED and color & 0xff < 16)
+
+
+def generate_color_scheme(pairs, combinations=()):
+    """
+    Generate a tmTheme color scheme with scopes for the given (bg, fg) pairs
+    of basic colors and (bg, fg, bold) combinations of any colors
+    """
+    scopes = []
+    for (bg, fg) in pairs:
+        scopes.append(_SCOPE_TEMPLATE % (scope_name(bg, fg), to_hex(bg, True), to_hex(fg), ""))
+
+    for (bg, fg, bold) in combinations:
+        font_style = _FONT_STYLE_TEMPLATE % "bold" if bold else ""
+        scopes.append(_SCOPE_TEMPLATE % (generated_scope_name(bg, fg, bold), to_hex(bg, True),
+                                         to_hex(fg), font_style))
+
+    return _SCHEME_TEMPLATE % "".join(scopes)
+
+
+def generated_scope_name(bg, fg, bold=False):
+    """
+    Get the scope of a color combination generated by ColorSchemeGenerator
+    """
+    scope = "terminalview.%s_%s" % (_color_id(bg, True), _color_id(fg))
+    if bold:
+        scope = scope + "_bold"
+    return scope
+
+
+class BasicColorScopes():
+    """
+    Scopes of the basic color pairs available in any TerminalView color scheme
+    (used when a user color scheme is installed). User schemes are copied from
+    the original scheme, which only has scopes for the 8 normal colors, so
+    bright colors are shown as their normal color, other colors as the
+    closest normal color and bold is ignored.
+    """
+    def __init__(self):
+        self._scopes = {}
+
+    def scope(self, bg, fg, bold=False):
+        key = (bg, fg)
+        scope = self._scopes.get(key)
+        if scope is None:
+            scope = scope_name(bg, fg, ORIGINAL_SCHEME_COLORS)
+            self._scopes[key] = scope
+        return scope
+
+    def flush_if_needed(self, schedule):
+        pass
+
+
+class ColorSchemeGenerator():
+    """
+    Color scheme with scopes generated on demand. Scope names are cached per
+    (bg, fg, bold) combination. New combinations are collected and written to
+    the scheme file in batches, at most once per flush_interval seconds,
+    since Sublime Text reloads the color scheme every time the file changes.
+    """
+    def __init__(self, path, flush_interval=1.0):
+        self._path = path
+        self._flush_interval = flush_interval
+        self._scopes = {}
+        self._combinations = []
+        self._nb_written = -1
+        self._last_flush = 0
+        self._flush_scheduled = False
+        self._lock = threading.Lock()
+
+    def path(self):
+        return self._path
+
+    def scope(self, bg, fg, bold=False):
+        """
+        Get the scope for a color combination, generating it if needed
+        """
+        key = (bg, fg, bold)
+        scope = self._scopes.get(key)
+        if scope is None:
+            scope = self._add_scope(key)
+        return scope
+
+    def pending(self):
+        """
+        Number of generated scopes not written to the scheme file yet
+        """
+        return len(self._combinations) - max(self._nb_written, 0)
+
+    def flush_if_needed(self, schedule):
+        """
+        Schedule a write of the scheme file with schedule(callback) if there
+        are new scopes and the last write was long enough ago
+        """
+        if self._flush_scheduled or len(self._combinations) == self._nb_written:
+            return
+
+        if time.monotonic() - self._last_flush < self._flush_interval:
+            return
+
+        self._flush_scheduled = True
+        schedule(self.flush)
+
+    def flush(self):
+        """
+        Write the scheme file with all scopes generated so far
+        """
+        with self._lock:
+            combinations = list(self._combinations)
+
+        try:
+            if len(combinations) != self._nb_written:
+                content = generate_color_scheme(basic_color_pairs(), combinations)
+                os.makedirs(os.path.dirname(self._path), exist_ok=True)
+
+                # Replace the file in one go so a half written scheme is never
+                # loaded
+                temp_path = self._path + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as scheme_file:
+                    scheme_file.write(content)
+                os.replace(temp_path, self._path)
+                self._nb_written = len(combinations)
+        finally:
+            self._last_flush = time.monotonic()
+            self._flush_scheduled = False
+
+    def _add_scope(self, key):
+        (bg, fg, bold) = key
+        if not bold and is_basic_color(bg) and is_basic_color(fg):
+            # Already in the scheme
+            scope = scope_name(bg, fg)
+        else:
+            scope = generated_scope_name(bg, fg, bold)
+            with self._lock:
+                self._combinations.append(key)
+
+        self._scopes[key] = scope
+        return scope
+
+
+def basic_color_pairs():
+    return [(INDEXED | bg, INDEXED | fg) for bg in range(16) for fg in range(16)]
+
+
+def _color_id(color, background=False):
+    if is_basic_color(color):
+        return color_name(color, background)
+    elif color & RGB:
+        return "x%06x" % (color & 0xffffff)
+
+    return "i%i" % (color & 0xff)
+
+
+def _parse_hex(hex_color):
+    return (int(hex_color[1:3], 16), int(hex_color[3:5], 16), int(hex_color[5:7], 16))
+
+
+_SCOPE_TEMPLATE = """
+      <dict>
+         <key>scope</key>
+         <string>%s</string>
+         <key>settings</key>
+         <dict>
+            <key>background</key>
+            <string>%s</string>
+            <key>foreground</key>
+            <string>%s</string>%s
+         </dict>
+      </dict>
+"""
+
+_FONT_STYLE_TEMPLATE = """
+            <key>fontStyle</key>
+            <string>%s</string>"""
+
+_SCHEME_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<plist version="1.0">
+<dict>
+   <key>name</key>
+   <string>TerminalView</string>
+   <key>settings</key>
+   <array>
+      <dict>
+         <key>settings</key>
+         <dict>
+            <key>background</key>
+            <string>#000000</string>
+
+            <key>foreground</key>
+            <string>#000000</string>
+
+            <key>caret</key>
+            <string>#ffffff</string>
+
+            <key>lineHighlight</key>
+            <string>#000000</string>
+            <key>invisibles</key>
+            <string>#ffffff</string>
+
+            <key>selection</key>
+            <string>#ffffff40</string>
+            <key>selectionBorder</key>
+            <string>#ffffff80</string>
+            <key>inactiveSelection</key>
+            <string>#ffffff40</string>
+
+            <key>shadow</key>
+            <string>#00000080</string>
+            <key>shadowWidth</key>
+            <string>0</string>
+         </dict>
+      </dict>
+
+      <!-- This dict is added as a hack to override the default foreground
+           The chosen foreground above thus only applies to rulers -->
+      <dict>
+          <key>name</key>
+          <string>Text and Source Base Colors</string>
+          <key>scope</key>
+          <string>text, source</string>
+          <key>settings</key>
+          <dict>
+              <key>foreground</key>
+              <string>#ffffff</string>
+          </dict>
+      </dict>
+
+      <!-- Below are all the dynamic colors which are set at runtime based on
+           the content of the terminal. This part is generated by
+           color_scheme.generate_color_scheme, change the colors in
+           color_scheme.py and regenerate it with:
+             python3 -m TerminalView.color_scheme > TerminalView.hidden-tmTheme -->
+%s
+   </array>
+   <key>uuid</key>
+   <string>02313454-df49-4e6c-a03f-26378a7a2131</string>
+</dict>
+</plist>
+"""
+
+
+if __name__ == "__main__":
+    print(generate_color_scheme(basic_color_pairs()), end="")
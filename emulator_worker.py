@@ -0,0 +1,533 @@
+"""
+Runs the shell and the terminal emulator of a terminal view in a separate
+Python process, so parsing the output of busy terminals does not compete for
+the GIL of the plugin host and several terminals can use several cores.
+
+The worker writes the visible rows to a screen grid in shared memory (see
+screen_grid) and publishes frames with the cursor, the history sizes, the
+grid and the amount of output parsed for the frame over a pipe. On the
+plugin side WorkerClient takes the place of the shell and RemoteEmulator the
+place of the PyteTerminalEmulator. RemoteEmulator reads the rows whose
+generation in the grid changed since they were shown, so the view is updated
+exactly as from a local emulator without the text of the rows going through
+the pipe.
+
+Messages are a type byte and a size followed by a payload encoded with
+marshal version 2, which Python 3.3 (Sublime Text 3) can read and write.
+"""
+import io
+import json
+import marshal
+import os
+import select
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from . import screen_grid
+
+# Message types sent to the worker
+MSG_KEYPRESS = 1
+MSG_RESIZE = 2
+MSG_SCROLL = 3
+MSG_SEARCH = 4
+MSG_SCROLL_TO_LINE = 5
+MSG_SAVE_STATE = 6
+MSG_STOP = 7
+
+# Message types sent by the worker
+MSG_FRAME = 64
+MSG_RESPONSE = 65
+MSG_EXIT = 66
+
+_MESSAGE_HEADER = struct.Struct("<BI")
+_MARSHAL_VERSION = 2
+
+# Minimum number of seconds between frames published by the worker
+FRAME_INTERVAL = 1.0 / 60.0
+
+# Seconds to wait for the worker to answer a request
+REQUEST_TIMEOUT = 5.0
+
+# Seconds to wait for the answer to a search or scroll to a match, which are
+# requested from the UI thread
+INTERACTIVE_REQUEST_TIMEOUT = 0.5
+
+_SCROLL_COMMANDS = ("prev_line", "next_line", "prev_page", "next_page")
+
+
+class WorkerClient():
+    """
+    Starts a worker process running cmd in a terminal emulator and talks to
+    it. Provides the methods of LinuxPty used by a terminal view. The
+    emulator side is available as emulator().
+
+    Args:
+        cmd (list): Shell command line.
+        cwd (str): Working directory of the shell.
+        python (str): Python 3 executable to run the worker with.
+        options (dict): Arguments of the PyteTerminalEmulator (lines,
+                        columns, history, ratio, compress, spill_dir,
+                        memory_limit).
+        snapshot (str, optional): Snapshot to restore before starting the
+                                  shell.
+    """
+    def __init__(self, cmd, cwd, python, options, snapshot=None):
+        config = dict(options, cmd=cmd, cwd=cwd, snapshot=snapshot)
+        # The worker imports this package from the directory it is installed
+        # in, which is also its working directory as that comes first in the
+        # module search path
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        packages_dir = os.path.dirname(package_dir)
+        env = os.environ.copy()
+        env["PYTHONPATH"] = packages_dir
+        module = "%s.emulator_worker" % os.path.basename(package_dir)
+        self._process = subprocess.Popen([python, "-m", module, json.dumps(config)],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         cwd=packages_dir, env=env, close_fds=True,
+                                         start_new_session=True)
+        self._reader = _MessageReader(self._process.stdout.fileno())
+        self._emulator = RemoteEmulator(self)
+        self._exited = False
+        self._late_responses = 0
+        self._lock = threading.Lock()
+
+    def emulator(self):
+        return self._emulator
+
+    def poll(self):
+        """
+        Apply the frames published by the worker since the last poll.
+
+        Returns:
+            bool: True if a frame was received.
+        """
+        received = False
+        with self._lock:
+            while not self._exited and _readable(self._reader.fileno(), 0):
+                for (msg_type, payload) in self._reader.read():
+                    received = self._handle(msg_type, payload) or received
+                self._exited = self._exited or self._reader.closed
+
+        return received
+
+    def receive_output(self, max_read_size, timeout=0):
+        # The output is parsed by the worker, see poll
+        return None
+
+    def set_recorder(self, recorder):
+        # Recording is not supported as the output never reaches the plugin
+        pass
+
+    def send_keypress(self, key, ctrl=False, alt=False, shift=False, meta=False):
+        self.send(MSG_KEYPRESS, (key, ctrl, alt, shift, meta))
+
+    def update_screen_size(self, lines, columns):
+        # The worker resizes the shell together with the screen (see
+        # RemoteEmulator.resize)
+        pass
+
+    def is_running(self):
+        return not self._exited and self._process.poll() is None
+
+    def stop(self):
+        if self.is_running():
+            self.send(MSG_STOP)
+            try:
+                self._process.wait(1.0)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        self._exited = True
+        self._process.stdin.close()
+        self._process.stdout.close()
+
+    def send(self, msg_type, payload=None):
+        try:
+            _write_message(self._process.stdin.fileno(), msg_type, payload)
+        except (OSError, ValueError):
+            # The worker is gone, which is noticed by is_running
+            self._exited = True
+
+    def request(self, msg_type, payload=None, timeout=REQUEST_TIMEOUT):
+        """
+        Send a request and wait for the response of the worker. Frames that
+        arrive in the meantime are applied.
+
+        Returns:
+            The response.
+
+        Raises:
+            TimeoutError: The worker did not answer within timeout seconds.
+                          The late response is ignored when it arrives.
+            OSError: The worker exited before answering.
+        """
+        with self._lock:
+            self.send(msg_type, payload)
+            deadline = time.time() + timeout
+            while not self._exited:
+                if not _readable(self._reader.fileno(), max(deadline - time.time(), 0)):
+                    self._late_responses += 1
+                    raise TimeoutError("The terminal worker did not answer within %.1f s" %
+                                       timeout)
+
+                response = None
+                for (received_type, received_payload) in self._reader.read():
+                    if received_type == MSG_RESPONSE and self._late_responses == 0:
+                        response = (received_payload, )
+                    else:
+                        self._handle(received_type, received_payload)
+                self._exited = self._exited or self._reader.closed
+                if response is not None:
+                    return response[0]
+
+        raise OSError("The terminal worker exited")
+
+    def _handle(self, msg_type, payload):
+        if msg_type == MSG_FRAME:
+            self._emulator.apply_frame(payload)
+            return True
+
+        if msg_type == MSG_RESPONSE:
+            # Answer to a request that timed out
+            self._late_responses = max(self._late_responses - 1, 0)
+        elif msg_type == MSG_EXIT:
+            self._exited = True
+        return False
+
+
+class RemoteEmulator():
+    """
+    Stand-in for PyteTerminalEmulator on the plugin side of a worker. Reads
+    the rows from the screen grid of the worker and remembers the generation
+    of the rows the view has been updated with.
+    """
+    def __init__(self, client):
+        self._client = client
+        self._grid = None
+        self._nb_lines = 0
+        self._shown = []
+        self._read = {}
+        self._removed = set()
+        self._cursor = (0, 0)
+        self._history = (0, 0, 0)
+        self._output = (0, 0)
+
+    def apply_frame(self, frame):
+        (nb_lines, cursor, history, grid_path, (nb_bytes, parse_ms)) = frame
+        self._cursor = cursor
+        self._history = history
+        self._output = (self._output[0] + nb_bytes, self._output[1] + parse_ms)
+        if self._grid is None or self._grid.path != grid_path:
+            self._open_grid(grid_path)
+
+    def _open_grid(self, path):
+        try:
+            grid = screen_grid.open_grid(path)
+        except (OSError, ValueError):
+            # The worker replaced the grid already, a later frame has the
+            # new one
+            return
+
+        # Both processes have the grid open now
+        grid.unlink()
+        if self._grid is not None:
+            self._grid.close()
+        self._removed.update(range(grid.lines, self._nb_lines))
+        self._removed.difference_update(range(grid.lines))
+        self._grid = grid
+        self._nb_lines = grid.lines
+        self._shown = [None] * grid.lines
+        self._read = {}
+
+    def feed(self, data):
+        raise RuntimeError("The output of a shell in a terminal worker is parsed by the worker "
+                           "and cannot be fed to its RemoteEmulator")
+
+    def resize(self, lines, cols):
+        self._client.send(MSG_RESIZE, (lines, cols))
+
+    def prev_line(self):
+        self._client.send(MSG_SCROLL, "prev_line")
+
+    def next_line(self):
+        self._client.send(MSG_SCROLL, "next_line")
+
+    def prev_page(self):
+        self._client.send(MSG_SCROLL, "prev_page")
+
+    def next_page(self):
+        self._client.send(MSG_SCROLL, "next_page")
+
+    def reflow_history(self, max_lines=None):
+        # The worker reflows the history itself
+        return False
+
+    def search(self, query, before=None):
+        """
+        Search in the worker, see PyteTerminalEmulator.search. Raises
+        TimeoutError if the worker is too busy to answer in time.
+        """
+        return self._client.request(MSG_SEARCH, (query, before), INTERACTIVE_REQUEST_TIMEOUT)
+
+    def scroll_to_line(self, line):
+        return self._client.request(MSG_SCROLL_TO_LINE, line, INTERACTIVE_REQUEST_TIMEOUT)
+
+    def dirty_lines(self, lines=None):
+        dirty_lines = dict((line, None) for line in self._removed)
+        if self._grid is None:
+            return dirty_lines
+
+        for line in self._grid.changed_rows(self._shown):
+            if lines is None or line in lines:
+                (self._read[line], dirty_lines[line]) = self._grid.read_text(line)
+
+        return dirty_lines
+
+    def clear_dirty(self, lines=None):
+        if lines is None:
+            lines = list(self._read) + list(self._removed)
+        for line in lines:
+            self._removed.discard(line)
+            if line in self._read:
+                self._shown[line] = self._read.pop(line)
+
+    def cursor(self):
+        return self._cursor
+
+    def color_map(self, lines):
+        color_map = {}
+        for line in lines:
+            if self._grid is not None and line < self._grid.lines:
+                line_colors = self._grid.read_color_map(line)[1]
+                if line_colors:
+                    color_map[line] = line_colors
+
+        return color_map
+
+    def take_output(self):
+        """
+        Get the output the worker parsed for the frames applied since the last
+        call, for the metrics that are recorded when output is fed to a local
+        emulator.
+
+        Returns:
+            tuple: Number of bytes read from the shell and the milliseconds
+                   spent parsing them.
+        """
+        output = self._output
+        self._output = (0, 0)
+        return output
+
+    def history_size(self):
+        return self._history[0]
+
+    def history_memory_usage(self):
+        return self._history[1]
+
+    def history_disk_usage(self):
+        return self._history[2]
+
+    def save_state(self, stream):
+        stream.write(self._client.request(MSG_SAVE_STATE))
+
+    def close(self):
+        if self._grid is not None:
+            self._grid.close()
+            self._grid = None
+
+
+def run_worker(config, in_fd, out_fd):
+    """
+    Worker side: run the shell and the emulator, handle the messages from
+    in_fd and publish frames to out_fd until the shell exits or MSG_STOP is
+    received.
+    """
+    from . import linux_pty
+    from . import snapshot
+    from . import terminal_emulator
+
+    lines = config["lines"]
+    columns = config["columns"]
+    emulator = terminal_emulator.PyteTerminalEmulator(columns, lines, config["history"],
+                                                      config["ratio"], config["compress"],
+                                                      history_spill_dir=config["spill_dir"],
+                                                      history_memory_limit=config["memory_limit"])
+    if config["snapshot"]:
+        try:
+            snapshot.load_snapshot(config["snapshot"], emulator)
+        except (OSError, ValueError) as e:
+            print("Failed to restore snapshot %s: %s" % (config["snapshot"], e), file=sys.stderr)
+        emulator.resize(lines, columns)
+
+    shell = linux_pty.LinuxPty(config["cmd"], config["cwd"], lines, columns)
+    reader = _MessageReader(in_fd)
+    publisher = _FramePublisher(emulator)
+    last_frame = 0
+    # Output read and seconds spent parsing it since the last frame
+    nb_read = 0
+    parse_time = 0
+    # Whether the screen may have changed since the last frame. While it has
+    # not the worker sleeps until there is output or a message.
+    pending = True
+    try:
+        while shell.is_running() and not reader.closed:
+            timeout = None
+            if pending:
+                timeout = max(last_frame + FRAME_INTERVAL - time.time(), 0)
+            (ready, _, _) = select.select([in_fd, shell.fileno()], [], [], timeout)
+            if in_fd in ready:
+                for (msg_type, payload) in reader.read():
+                    if msg_type == MSG_STOP:
+                        return
+                    _handle_request(msg_type, payload, shell, emulator, out_fd)
+                pending = True
+
+            if shell.fileno() in ready:
+                data = shell.receive_output(65536)
+                if data is not None:
+                    start = time.perf_counter()
+                    emulator.feed(data)
+                    parse_time = parse_time + time.perf_counter() - start
+                    nb_read = nb_read + len(data)
+                pending = True
+
+            if pending and time.time() - last_frame >= FRAME_INTERVAL:
+                pending = emulator.reflow_history()
+                publisher.publish(out_fd, (nb_read, parse_time * 1000.))
+                last_frame = time.time()
+                nb_read = 0
+                parse_time = 0
+        publisher.publish(out_fd, (nb_read, parse_time * 1000.))
+        _write_message(out_fd, MSG_EXIT)
+    finally:
+        shell.stop()
+        emulator.close()
+        publisher.close()
+
+
+def _handle_request(msg_type, payload, shell, emulator, out_fd):
+    if msg_type == MSG_KEYPRESS:
+        (key, ctrl, alt, shift, meta) = payload
+        shell.send_keypress(key, ctrl, alt, shift, meta)
+    elif msg_type == MSG_RESIZE:
+        (lines, columns) = payload
+        shell.update_screen_size(lines, columns)
+        emulator.resize(lines, columns)
+    elif msg_type == MSG_SCROLL and payload in _SCROLL_COMMANDS:
+        getattr(emulator, payload)()
+    elif msg_type == MSG_SEARCH:
+        (query, before) = payload
+        _write_message(out_fd, MSG_RESPONSE, emulator.search(query, before))
+    elif msg_type == MSG_SCROLL_TO_LINE:
+        _write_message(out_fd, MSG_RESPONSE, emulator.scroll_to_line(payload))
+    elif msg_type == MSG_SAVE_STATE:
+        stream = io.BytesIO()
+        emulator.save_state(stream)
+        _write_message(out_fd, MSG_RESPONSE, stream.getvalue())
+
+
+class _FramePublisher():
+    # Writes the rows that changed since the last frame to the grid, which is
+    # replaced when the screen is resized, and announces them with a frame
+    def __init__(self, emulator):
+        self._emulator = emulator
+        self._grid = None
+        self._last = None
+
+    def publish(self, out_fd, output=(0, 0)):
+        # output is the number of bytes read and the milliseconds spent
+        # parsing them since the last frame
+        emulator = self._emulator
+        (lines, columns) = emulator.screen_size()
+        grid = self._grid
+        if grid is None or (grid.lines, grid.columns) != (lines, columns):
+            self._grid = screen_grid.create_grid(lines, columns)
+            nb_written = emulator.write_grid(self._grid, all_lines=True)
+            if grid is not None:
+                _remove_grid(grid)
+        else:
+            nb_written = emulator.write_grid(grid)
+
+        state = (lines, emulator.cursor(),
+                 (emulator.history_size(), emulator.history_memory_usage(),
+                  emulator.history_disk_usage()),
+                 self._grid.path)
+        if nb_written or state != self._last or output[0]:
+            self._last = state
+            _write_message(out_fd, MSG_FRAME, state + (output, ))
+
+    def close(self):
+        if self._grid is not None:
+            _remove_grid(self._grid)
+            self._grid = None
+
+
+def _remove_grid(grid):
+    # Usually the plugin removed the file already when it opened the grid
+    grid.unlink()
+    grid.close()
+
+
+class _MessageReader():
+    # Splits the data read from a pipe into messages
+    def __init__(self, fd):
+        self._fd = fd
+        self._buffer = bytearray()
+        self.closed = False
+
+    def fileno(self):
+        return self._fd
+
+    def read(self):
+        """
+        Read the available data (blocks if there is none).
+
+        Returns:
+            list: The (type, payload) of the messages completed by the data.
+        """
+        data = os.read(self._fd, 65536)
+        if not data:
+            self.closed = True
+            return []
+
+        self._buffer.extend(data)
+        messages = []
+        position = 0
+        while len(self._buffer) - position >= _MESSAGE_HEADER.size:
+            (msg_type, size) = _MESSAGE_HEADER.unpack_from(self._buffer, position)
+            end = position + _MESSAGE_HEADER.size + size
+            if end > len(self._buffer):
+                break
+            payload = marshal.loads(bytes(self._buffer[end - size:end]))
+            messages.append((msg_type, payload))
+            position = end
+
+        del self._buffer[:position]
+        return messages
+
+
+def _write_message(fd, msg_type, payload=None):
+    data = marshal.dumps(payload, _MARSHAL_VERSION)
+    data = _MESSAGE_HEADER.pack(msg_type, len(data)) + data
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def _readable(fd, timeout):
+    (ready, _, _) = select.select([fd], [], [], timeout)
+    return bool(ready)
+
+
+def main():
+    # The messages go over stdout so anything printed goes to stderr
+    out_fd = os.dup(sys.stdout.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    run_worker(json.loads(sys.argv[1]), sys.stdin.fileno(), out_fd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Fixed size in-memory trace of the spans of work done by a terminal view, for
+diagnosing latency spikes. The trace can be dumped in the Chrome trace event
+format and opened in chrome://tracing or Perfetto.
+"""
+import collections
+import json
+import os
+import threading
+import time
+
+
+class EventTrace():
+    """
+    Ring buffer holding the last `capacity` spans. Each span has a name, a
+    monotonic start time, a duration and a size (bytes, lines or regions
+    depending on the span).
+    """
+    def __init__(self, capacity):
+        self._events = collections.deque(maxlen=capacity)
+
+    def __len__(self):
+        return len(self._events)
+
+    def now(self):
+        """
+        Get the start time of a span
+        """
+        return time.perf_counter()
+
+    def add(self, name, start, size=0):
+        """
+        Add a span that started at `start` (from now()) and ends now
+        """
+        end = time.perf_counter()
+        self._events.append((name, start, end - start, size, threading.get_ident()))
+
+    def events(self):
+        return list(self._events)
+
+    def clear(self):
+        self._events.clear()
+
+    def to_chrome_trace(self):
+        """
+        Convert the spans to a dict in the Chrome trace event format
+        """
+        pid = os.getpid()
+        trace_events = []
+        for (name, start, duration, size, thread_id) in self.events():
+            trace_events.append({
+                "name": name,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": thread_id,
+                "args": {"size": size},
+            })
+
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def dump(self, path):
+        """
+        Write the spans to a Chrome trace event JSON file
+        """
+        with open(path, "w") as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
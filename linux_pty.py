@@ -4,6 +4,7 @@ Wrapper module around a Linux PTY which can be used to start an underlying shell
 
 import os
 import select
+import shlex
 import subprocess
 import struct
 import signal
@@ -14,21 +15,58 @@ try:
 except ImportError:
     pass
 
+# Ways of starting the shell process
+SPAWN_POPEN = "popen"
+SPAWN_POSIX_SPAWN = "posix_spawn"
+
+# posix_spawn is only available from Python 3.8
+DEFAULT_SPAWN_BACKEND = SPAWN_POSIX_SPAWN if hasattr(os, "posix_spawn") else SPAWN_POPEN
+
+# Environment of the shells, built once (see shell_env)
+_shell_env = None
+
+
+def shell_env():
+    """
+    Get the environment shells are started with. It is a copy of the
+    environment of the plugin host made on first use and shared by all shells.
+    """
+    global _shell_env
+    if _shell_env is None:
+        env = os.environ.copy()
+        env["TERM"] = "linux"
+        _shell_env = env
+
+    return _shell_env
+
 
 class LinuxPty():
     """
     Linux PTY class that starts an underlying and provides methods for
     communicating with it
     """
-    def __init__(self, cmd, cwd):
+    def __init__(self, cmd, cwd, lines=None, columns=None, backend=DEFAULT_SPAWN_BACKEND):
         self._cmd = cmd
-        self._env = os.environ.copy()
-        self._env["TERM"] = "linux"
         (self._pty, self._pts) = os.openpty()
-        self._process = subprocess.Popen(self._cmd, stdin=self._pts,
-                                         stdout=self._pts, stderr=self._pts, shell=False,
-                                         env=self._env, close_fds=True, start_new_session=True,
-                                         cwd=cwd)
+        if lines is not None and columns is not None:
+            # Start with the right size so the shell does not have to redraw
+            self._set_window_size(lines, columns)
+
+        if backend == SPAWN_POSIX_SPAWN:
+            self._process = _posix_spawn(self._cmd, cwd, self._pts, shell_env())
+        else:
+            self._process = subprocess.Popen(self._cmd, stdin=self._pts,
+                                             stdout=self._pts, stderr=self._pts, shell=False,
+                                             env=shell_env(), close_fds=True,
+                                             start_new_session=True, cwd=cwd)
+        self._recorder = None
+
+    def set_recorder(self, recorder):
+        """
+        Record all output, input and resize events of the shell with the given
+        session recorder (None to stop recording)
+        """
+        self._recorder = recorder
 
     def stop(self):
         """
@@ -37,7 +75,12 @@ class LinuxPty():
         if self.is_running():
             self._process.kill()
         self._process = None
-        return
+
+        if self._pty is not None:
+            os.close(self._pty)
+            os.close(self._pts)
+            self._pty = None
+            self._pts = None
 
     def receive_output(self, max_read_size, timeout=0):
         """
@@ -50,19 +93,36 @@ class LinuxPty():
         if not ready:
             return None
 
-        return os.read(self._pty, max_read_size)
+        data = os.read(self._pty, max_read_size)
+        if self._recorder is not None:
+            self._recorder.record_output(data)
+
+        return data
+
+    def fileno(self):
+        """
+        File descriptor to wait on for output of the shell
+        """
+        return self._pty
 
     def update_screen_size(self, lines, columns):
         """
         Notify the shell of a terminal screen resize
         """
-        if self.is_running:
-            # Note, assume ws_xpixel and ws_ypixel are zero.
-            tiocswinsz = getattr(termios, 'TIOCSWINSZ', -2146929561)
-            size_update = struct.pack('HHHH', lines, columns, 0, 0)
-            fcntl.ioctl(self._pts, tiocswinsz, size_update)
+        if self.is_running():
+            self._set_window_size(lines, columns)
             os.kill(self._process.pid, signal.SIGWINCH)
 
+            if self._recorder is not None:
+                self._recorder.record_resize(lines, columns)
+
+    def change_directory(self, cwd):
+        """
+        Make the shell change its working directory by typing a cd command.
+        The screen is cleared afterwards so the command does not show.
+        """
+        self._send_string(" cd -- %s && clear\r" % shlex.quote(cwd))
+
     def is_running(self):
         """
         Check if the shell is running
@@ -109,9 +169,72 @@ class LinuxPty():
 
         return key
 
+    def _set_window_size(self, lines, columns):
+        # Note, assume ws_xpixel and ws_ypixel are zero.
+        tiocswinsz = getattr(termios, 'TIOCSWINSZ', -2146929561)
+        size_update = struct.pack('HHHH', lines, columns, 0, 0)
+        fcntl.ioctl(self._pts, tiocswinsz, size_update)
+
     def _send_string(self, string):
         if self.is_running():
-            os.write(self._pty, string.encode('UTF-8'))
+            data = string.encode('UTF-8')
+            os.write(self._pty, data)
+            if self._recorder is not None:
+                self._recorder.record_input(data)
+
+
+class SpawnedProcess():
+    """
+    The parts of subprocess.Popen used by LinuxPty for a process started
+    with posix_spawn. As for Popen the return code is the exit status or
+    minus the signal number if the process was killed by a signal.
+    """
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            (pid, status) = os.waitpid(self.pid, os.WNOHANG)
+            if pid == self.pid:
+                self.returncode = _returncode(status)
+        return self.returncode
+
+    def kill(self):
+        if self.poll() is None:
+            os.kill(self.pid, signal.SIGKILL)
+            (_, status) = os.waitpid(self.pid, 0)
+            self.returncode = _returncode(status)
+
+
+def _returncode(status):
+    # Convert a wait status to a return code like Popen.returncode
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _posix_spawn(cmd, cwd, pts, env):
+    """
+    Start cmd with posix_spawn in a new session with the pty slave as stdin,
+    stdout, stderr and controlling terminal. Unlike subprocess.Popen with
+    close_fds this does not have to go through all possible file descriptors
+    (Python opens files non-inheritable anyway). posix_spawn can not change
+    the working directory so a small sh script does that before executing
+    cmd.
+    """
+    if isinstance(cmd, str):
+        # Popen accepts a lone program name too
+        cmd = [cmd]
+
+    if cwd and os.path.realpath(cwd) != os.getcwd():
+        cmd = ["/bin/sh", "-c", 'cd -- "$0" && exec "$@"', cwd] + list(cmd)
+
+    file_actions = [(os.POSIX_SPAWN_OPEN, 0, os.ttyname(pts), os.O_RDWR, 0),
+                    (os.POSIX_SPAWN_DUP2, 0, 1),
+                    (os.POSIX_SPAWN_DUP2, 0, 2)]
+    pid = os.posix_spawnp(cmd[0], cmd, env, file_actions=file_actions, setsid=True)
+    return SpawnedProcess(pid)
 
 
 _LINUX_KEY_MAP = {
@@ -0,0 +1,196 @@
+"""
+Lightweight counters and histograms for measuring the performance of a
+terminal view. Recording is a no-op when metrics are disabled so the calls can
+be left in the hot paths of the plugin.
+"""
+import bisect
+import collections
+import time
+
+# Bucket upper bounds for timings in milliseconds
+TIME_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Keypresses without an echo within this many seconds are not measured
+MAX_ECHO_DELAY = 1.0
+
+# Bucket upper bounds for sizes (bytes, lines)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+
+class Histogram():
+    """
+    Histogram with fixed buckets. Values larger than the last bucket bound are
+    counted in an overflow bucket.
+    """
+    def __init__(self, bounds):
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)
+        self._count = 0
+        self._total = 0
+        self._max = 0
+
+    def record(self, value):
+        self._counts[bisect.bisect_left(self._bounds, value)] += 1
+        self._count = self._count + 1
+        self._total = self._total + value
+        if value > self._max:
+            self._max = value
+
+    def count(self):
+        return self._count
+
+    def mean(self):
+        if self._count == 0:
+            return 0
+        return self._total / self._count
+
+    def max(self):
+        return self._max
+
+    def percentile(self, percentile):
+        """
+        Approximate percentile (0-100) of the recorded values. The upper bound
+        of the bucket the percentile falls in is returned, clamped to the
+        largest value recorded.
+        """
+        if self._count == 0:
+            return 0
+
+        rank = self._count * percentile / 100.
+        seen = 0
+        for (i, count) in enumerate(self._counts):
+            seen = seen + count
+            if seen >= rank and count > 0:
+                if i == len(self._bounds):
+                    return self._max
+                return min(self._bounds[i], self._max)
+
+        return self._max
+
+
+class Metrics():
+    """
+    Named counters and histograms of a single terminal view
+    """
+    def __init__(self, enabled=True):
+        self._enabled = enabled
+        self._counters = {}
+        self._histograms = {}
+
+        # Send times of keypresses still waiting for their echo and the number
+        # of them answered by output that has not been rendered yet
+        self._pending_inputs = collections.deque()
+        self._answered_inputs = 0
+
+    def enabled(self):
+        return self._enabled
+
+    def count(self, name, value=1):
+        """
+        Add value to the counter with the given name
+        """
+        if not self._enabled:
+            return
+
+        self._counters[name] = self._counters.get(name, 0) + value
+
+    def record(self, name, value, buckets=SIZE_BUCKETS):
+        """
+        Record a value in the histogram with the given name. The buckets are
+        only used when the histogram is created.
+        """
+        if not self._enabled:
+            return
+
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = Histogram(buckets)
+            self._histograms[name] = histogram
+        histogram.record(value)
+
+    def start_timer(self):
+        """
+        Start timing something. Pass the returned value to stop_timer.
+        """
+        if not self._enabled:
+            return 0
+        return time.perf_counter()
+
+    def stop_timer(self, name, start):
+        """
+        Record the time in milliseconds since start_timer in a histogram
+        """
+        if not self._enabled:
+            return
+
+        self.record(name, (time.perf_counter() - start) * 1000., TIME_BUCKETS_MS)
+
+    def input_sent(self):
+        """
+        Mark that a keypress was sent to the shell. Its latency is measured
+        until the first frame that renders output received after it.
+        """
+        if not self._enabled:
+            return
+
+        self._pending_inputs.append(time.perf_counter())
+
+    def output_received(self):
+        """
+        Mark that output was received from the shell. All keypresses sent
+        before it are considered echoed by this output.
+        """
+        if not self._enabled:
+            return
+
+        # Keypresses that were never echoed (e.g. password prompts) would
+        # otherwise be matched with unrelated output much later
+        pending = self._pending_inputs
+        too_old = time.perf_counter() - MAX_ECHO_DELAY
+        while pending and pending[0] < too_old:
+            pending.popleft()
+            self.count("keystrokes_without_echo")
+
+        self._answered_inputs = len(pending)
+
+    def frame_rendered(self):
+        """
+        Mark that a frame with changes was rendered to the view and record the
+        keystroke to glyph latency of the keypresses echoed in it
+        """
+        if not self._enabled or self._answered_inputs == 0:
+            return
+
+        now = time.perf_counter()
+        for _ in range(self._answered_inputs):
+            latency = (now - self._pending_inputs.popleft()) * 1000.
+            self.record("keystroke_latency_ms", latency, TIME_BUCKETS_MS)
+        self._answered_inputs = 0
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+    def histogram(self, name):
+        return self._histograms.get(name)
+
+    def reset(self):
+        self._counters = {}
+        self._histograms = {}
+        self._pending_inputs.clear()
+        self._answered_inputs = 0
+
+    def summary(self):
+        """
+        Get a human readable summary of all metrics as a list of lines
+        """
+        lines = []
+        for name in sorted(self._counters):
+            lines.append("%s: %i" % (name, self._counters[name]))
+
+        for name in sorted(self._histograms):
+            histogram = self._histograms[name]
+            lines.append("%s: n=%i p50=%g p99=%g max=%g" %
+                         (name, histogram.count(), histogram.percentile(50),
+                          histogram.percentile(99), round(histogram.max(), 3)))
+
+        return lines
@@ -0,0 +1,51 @@
+"""
+On-demand profiling of the update loop of a terminal view
+"""
+import cProfile
+import io
+import pstats
+import time
+
+
+class UpdateLoopProfiler():
+    """
+    Profiles the iterations of an update loop with cProfile for a limited
+    amount of time. The profiler is only enabled while an iteration is running
+    so time spent sleeping between frames does not show up in the results.
+    Note that cProfile only sees the thread calling start and stop.
+    """
+    def __init__(self, duration):
+        self._duration = duration
+        self._profile = cProfile.Profile()
+        self._started = time.monotonic()
+        self._nb_iterations = 0
+
+    def start(self):
+        """
+        Start profiling an iteration of the loop
+        """
+        self._profile.enable()
+
+    def stop(self):
+        """
+        Stop profiling an iteration of the loop
+        """
+        self._profile.disable()
+        self._nb_iterations = self._nb_iterations + 1
+
+    def finished(self):
+        return time.monotonic() - self._started >= self._duration
+
+    def dump(self, path, nb_entries=20):
+        """
+        Write the collected stats to a pstats file and return a summary of the
+        functions with the highest cumulative time.
+        """
+        self._profile.dump_stats(path)
+
+        summary = io.StringIO()
+        summary.write("Profiled %i iterations in %.1f s, stats saved to %s\n\n" %
+                      (self._nb_iterations, time.monotonic() - self._started, path))
+        stats = pstats.Stats(self._profile, stream=summary)
+        stats.sort_stats("cumulative").print_stats(nb_entries)
+        return summary.getvalue()
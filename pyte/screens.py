@@ -430,6 +430,7 @@ class Screen(object):
         # entered.
         if self.cursor.x == self.columns:
             if mo.DECAWM in self.mode:
+                self.wrap_line(self.cursor.y)
                 self.carriage_return()
                 self.linefeed()
             else:
@@ -451,6 +452,12 @@ class Screen(object):
         #           way, we'll never know when to linefeed.
         self.cursor.x += char_width
 
+    def wrap_line(self, y):
+        """Called by :meth:`draw` when the text on line ``y`` continues
+        on the next line because of :data:`~pyte.modes.DECAWM`. Does
+        nothing by default.
+        """
+
     def carriage_return(self):
         """Move the cursor to the beginning of the current line."""
         self.cursor.x = 0
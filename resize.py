@@ -0,0 +1,77 @@
+"""
+Debouncing of terminal view size changes
+"""
+import time
+
+# Seconds between checks of the view size while it is not changing
+POLL_INTERVAL = 0.25
+
+# Seconds the view size must stay the same before it is applied
+SETTLE_TIME = 0.15
+
+
+class ResizeDebouncer():
+    """
+    Sublime Text has no event for view size changes so the size has to be
+    polled. While nothing changes this is done only every poll_interval
+    seconds. Once a change is seen the size is checked every frame until it
+    has not changed for settle_time seconds and only that final size is
+    reported, so dragging a window edge results in a single resize of the
+    terminal and a single redraw of the program running in it.
+    """
+    def __init__(self, poll_interval=POLL_INTERVAL, settle_time=SETTLE_TIME):
+        self._poll_interval = poll_interval
+        self._settle_time = settle_time
+        self._size = None
+        self._pending_size = None
+        self._changed = 0
+        self._last_poll = None
+
+    def size(self):
+        """
+        The last size reported by update or None
+        """
+        return self._size
+
+    def update(self, get_size, now=None):
+        """
+        Check the size with get_size() if it is time to do so. A size of
+        (0, 0) means the view has no size (yet), e.g. while its font metrics
+        are not known, and is ignored.
+
+        Returns:
+            tuple: The new (rows, columns) to apply or None if the size should
+                   not be changed (yet).
+        """
+        if now is None:
+            now = time.monotonic()
+
+        if self._pending_size is None and self._last_poll is not None and \
+                now - self._last_poll < self._poll_interval:
+            return None
+        self._last_poll = now
+
+        size = get_size()
+        if size == (0, 0):
+            return None
+
+        if self._size is None:
+            # Nothing to debounce for the initial size
+            self._size = size
+            return size
+
+        if size != (self._pending_size or self._size):
+            self._pending_size = size
+            self._changed = now
+            return None
+
+        if self._pending_size is None or now - self._changed < self._settle_time:
+            return None
+
+        self._pending_size = None
+        if size == self._size:
+            # Resized back to the size we started with
+            return None
+
+        self._size = size
+        return size
@@ -0,0 +1,216 @@
+"""
+The visible grid of a terminal screen in a memory map, so a renderer in
+another process (see emulator_worker) can read the rows that changed without
+the text being copied through a pipe every frame.
+
+The map starts with a header (magic, version, lines and columns), followed
+by a 64 bit generation counter per row and then the cells of each row: the
+text as fixed-width UTF-32 code points, a word with the foreground color and
+the character flags and a word with the background color. Colors are packed
+as in color_scheme.
+
+Each write of a row increments its generation to an odd value before and to
+an even value after changing the cells. A reader remembers the generations
+of the rows it rendered and only reads the rows whose generation changed,
+retrying while a row is being written.
+"""
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+
+from . import color_scheme
+from .terminal_emulator import line_color_map
+
+FORMAT_VERSION = 1
+
+_MAGIC = b"TVGRID"
+_HEADER = struct.Struct("<6sBxHH4x")
+
+# Bits of the character flags in the foreground word, above the packed color
+_COLOR_MASK = (1 << 26) - 1
+_BOLD = 1 << 26
+_ITALICS = 1 << 27
+_UNDERSCORE = 1 << 28
+_STRIKETHROUGH = 1 << 29
+_REVERSE = 1 << 30
+
+# Words of a cell: code point, foreground and flags, background
+_CELL_WORDS = 3
+
+_TEXT_ENCODING = "utf-32-le" if sys.byteorder == "little" else "utf-32-be"
+
+# Times a reader tries to read a row that is being written before taking what
+# it got. Rows are written in a few microseconds so this only runs out if the
+# writer died in the middle of a row.
+_READ_ATTEMPTS = 1000
+
+
+def default_grid_dir():
+    """
+    Directory for the files of grids shared between processes, in memory
+    where possible
+    """
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def create_grid(lines, columns, directory=None):
+    """
+    Create a grid of the given size in a new file in directory (the default
+    grid directory if None). The file is only needed until the readers have
+    opened it and can be removed with ScreenGrid.unlink.
+    """
+    size = grid_size(lines, columns)
+    (fd, path) = tempfile.mkstemp(prefix="tvgrid-", dir=directory or default_grid_dir())
+    try:
+        os.ftruncate(fd, size)
+        mapping = mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+    mapping[:_HEADER.size] = _HEADER.pack(_MAGIC, FORMAT_VERSION, lines, columns)
+    grid = ScreenGrid(mapping, path)
+    for line in range(lines):
+        grid.write_line(line, ())
+    return grid
+
+
+def open_grid(path):
+    """
+    Open the grid created in another process at path for reading
+    """
+    with open(path, "rb") as grid_file:
+        mapping = mmap.mmap(grid_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    (magic, version, lines, columns) = _HEADER.unpack_from(mapping)
+    if magic != _MAGIC or version != FORMAT_VERSION or len(mapping) != grid_size(lines, columns):
+        mapping.close()
+        raise ValueError("Not a TerminalView screen grid")
+    return ScreenGrid(mapping, path)
+
+
+def grid_size(lines, columns):
+    return _HEADER.size + lines * 8 + lines * columns * _CELL_WORDS * 4
+
+
+class ScreenGrid():
+    """
+    A screen grid in a memory map. Use create_grid and open_grid to get one.
+    """
+    def __init__(self, mapping, path):
+        (_, _, self.lines, self.columns) = _HEADER.unpack_from(mapping)
+        self.path = path
+        self._map = mapping
+        self._view = memoryview(mapping)
+        cells = _HEADER.size + self.lines * 8
+        self._generations = self._view[_HEADER.size:cells].cast("Q")
+        self._words = self._view[cells:].cast("I")
+        self._row_words = self.columns * _CELL_WORDS
+
+    def close(self):
+        self._generations.release()
+        self._words.release()
+        self._view.release()
+        self._map.close()
+
+    def unlink(self):
+        """
+        Remove the file of the grid. The grid stays usable by the processes
+        that opened it.
+        """
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def write_line(self, line, chars):
+        """
+        Write a line of pyte characters to a row. Only the first code point
+        of each character is kept and the row is padded with blanks.
+        """
+        columns = self.columns
+        chars = chars[:columns]
+        codes = array("I", [ord(char.data[0]) if char.data else 0 for char in chars])
+        fgs = array("I")
+        for char in chars:
+            fg = (char.fg or 0) | (char.bold and _BOLD) | (char.italics and _ITALICS)
+            fg |= (char.underscore and _UNDERSCORE) | (char.strikethrough and _STRIKETHROUGH)
+            fgs.append(fg | (char.reverse and _REVERSE))
+        bgs = array("I", [char.bg or 0 for char in chars])
+        padding = columns - len(chars)
+        if padding:
+            codes.extend(array("I", [32]) * padding)
+            fgs.extend(array("I", [0]) * padding)
+            bgs.extend(array("I", [0]) * padding)
+
+        generation = self._generations[line] | 1
+        self._generations[line] = generation
+        start = line * self._row_words
+        self._words[start:start + columns] = codes
+        self._words[start + columns:start + 2 * columns] = fgs
+        self._words[start + 2 * columns:start + 3 * columns] = bgs
+        self._generations[line] = generation + 1
+
+    def generation(self, line):
+        return self._generations[line]
+
+    def changed_rows(self, generations):
+        """
+        Get the rows whose generation differs from the one in generations
+        (a list with one generation or None per row)
+        """
+        return [line for (line, generation) in enumerate(self._generations)
+                if generation != generations[line]]
+
+    def read_text(self, line):
+        """
+        Read the text of a row.
+
+        Returns:
+            tuple: The generation of the row and its text.
+        """
+        start = line * self._row_words
+        return self._read(line, lambda: str(self._words[start:start + self.columns],
+                                            _TEXT_ENCODING, "replace").replace("\0", ""))
+
+    def read_color_map(self, line):
+        """
+        Read the color map of a row (see line_color_map).
+
+        Returns:
+            tuple: The generation of the row and its color map.
+        """
+        return self._read(line, lambda: line_color_map(self._colors(line)))
+
+    def _colors(self, line):
+        default_bg = color_scheme.DEFAULT_BG
+        default_fg = color_scheme.DEFAULT_FG
+        columns = self.columns
+        start = line * self._row_words + columns
+        fgs = self._words[start:start + columns]
+        bgs = self._words[start + columns:start + 2 * columns]
+        for (fg, bg) in zip(fgs, bgs):
+            # Same as convert_pyte_buffer_to_colormap
+            bold = bool(fg & _BOLD)
+            if fg & _REVERSE:
+                yield ((fg & _COLOR_MASK) or default_fg, bg or default_bg, bold)
+            else:
+                yield (bg or default_bg, (fg & _COLOR_MASK) or default_fg, bold)
+
+    def _read(self, line, read):
+        for _ in range(_READ_ATTEMPTS):
+            generation = self._generations[line]
+            if generation & 1:
+                time.sleep(0)
+                continue
+
+            value = read()
+            if self._generations[line] == generation:
+                return (generation, value)
+
+        return (generation, read())
@@ -0,0 +1,210 @@
+"""
+Compact, versioned binary format for the complete state of a terminal screen
+(CustomHistoryScreen): the screen buffers, the scrollback history, the cursor,
+modes, margins, tabstops, character sets and saved cursors. Used for
+snapshots and for moving a terminal between processes.
+
+Lines are stored as their text plus attribute runs, with the attributes in a
+table of the scrollback history (see ScrollbackHistory.encode_lines), instead
+of as lists of Char tuples.
+"""
+import struct
+from array import array
+
+from .pyte import charsets
+from .pyte.screens import Cursor, Margins, Savepoint
+
+# Version 2 added the bloom filters of the scrollback history blocks
+FORMAT_VERSION = 2
+
+_MAGIC = b"TVSTATE"
+
+# Screen size, cursor position, cursor hidden, margins, active charset, the
+# g0 and g1 charsets, scroll offset in the history, alternate screen active,
+# number of savepoints, modes and tabstops
+_HEADER = struct.Struct("<HHHH?HHBBBI?HHH")
+
+# Cursor position, cursor hidden, g0 and g1 charsets, active charset, origin
+# and wrap modes of a savepoint
+_SAVEPOINT = struct.Struct("<HH?BBB??")
+
+_CHUNK_SIZE = struct.Struct("<I")
+
+# Charsets by the designator used to select them
+_CHARSET_KEYS = sorted(charsets.MAPS)
+
+
+class ByteArrayWriter():
+    """
+    File-like object collecting written data in a bytearray, so a state can
+    be serialized without the copies made by io.BytesIO.getvalue()
+    """
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data.extend(data)
+        return len(data)
+
+
+def dumps(screen):
+    """
+    Serialize the state of a screen.
+
+    Returns:
+        bytearray: The serialized state.
+    """
+    writer = ByteArrayWriter()
+    write_state(screen, writer)
+    return writer.data
+
+
+def write_state(screen, stream):
+    """
+    Write the state of a screen to a binary stream. A reflow of the history
+    that is in progress is finished first.
+    """
+    while screen.reflow_history(screen.history.size() or 1):
+        pass
+
+    history = screen.history
+    alternate = screen.primary_buffer is not None
+    savepoints = screen.savepoints
+    header = _HEADER.pack(screen.lines, screen.columns, screen.cursor.y, screen.cursor.x,
+                          screen.cursor.hidden, screen.margins.top, screen.margins.bottom,
+                          screen.charset, _charset_id(screen.g0_charset),
+                          _charset_id(screen.g1_charset), screen.scroll_offset, alternate,
+                          len(savepoints), len(screen.mode), len(screen.tabstops))
+    stream.write(_MAGIC + bytes((FORMAT_VERSION, )))
+    stream.write(header)
+    stream.write(array("I", sorted(screen.mode)).tobytes())
+    stream.write(array("I", sorted(screen.tabstops)).tobytes())
+    for savepoint in savepoints:
+        cursor = savepoint.cursor
+        stream.write(_SAVEPOINT.pack(cursor.y, cursor.x, cursor.hidden,
+                                     _charset_id(savepoint.g0_charset),
+                                     _charset_id(savepoint.g1_charset), savepoint.charset,
+                                     savepoint.origin, savepoint.wrap))
+
+    # The attributes of the cursors are stored as lines of a single character
+    cursor_attrs = [[screen.cursor.attrs]] + [[savepoint.cursor.attrs] for savepoint in savepoints]
+    _write_chunk(stream, history.encode_lines(cursor_attrs))
+    _write_chunk(stream, history.encode_lines(screen.buffer))
+    if alternate:
+        _write_chunk(stream, history.encode_lines(screen.primary_buffer))
+
+    # Last as the attribute table is only complete once all lines are encoded
+    history.save(stream)
+
+
+def loads(screen, data):
+    """
+    Restore the state of a screen serialized with dumps
+    """
+    read_state(screen, _BytesReader(data))
+
+
+def read_state(screen, stream):
+    """
+    Replace the state of a screen by one written with write_state
+    """
+    magic = _read_exactly(stream, len(_MAGIC) + 1)
+    if magic[:len(_MAGIC)] != _MAGIC:
+        raise ValueError("Not a TerminalView screen state")
+    if magic[-1] != FORMAT_VERSION:
+        raise ValueError("Unsupported screen state version %i" % magic[-1])
+
+    (lines, columns, y, x, hidden, top, bottom, charset, g0, g1, scroll_offset, alternate,
+     nb_savepoints, nb_modes, nb_tabstops) = _HEADER.unpack(_read_exactly(stream, _HEADER.size))
+    modes = _read_array(stream, nb_modes)
+    tabstops = _read_array(stream, nb_tabstops)
+    savepoints = [_SAVEPOINT.unpack(_read_exactly(stream, _SAVEPOINT.size))
+                  for _ in range(nb_savepoints)]
+    cursor_attrs = _read_chunk(stream)
+    buffer = _read_chunk(stream)
+    primary_buffer = _read_chunk(stream) if alternate else None
+
+    previous_lines = screen.lines
+    screen.lines, screen.columns = lines, columns
+    screen.reset()
+    history = screen.history
+    history.load(stream)
+
+    cursor_attrs = [line[0] for line in history.decode_lines(cursor_attrs)]
+    screen.buffer[:] = _decode_buffer(screen, buffer)
+    if primary_buffer is not None:
+        screen.primary_buffer = _decode_buffer(screen, primary_buffer)
+
+    screen.cursor = _cursor(x, y, hidden, cursor_attrs[0])
+    screen.margins = Margins(top, bottom)
+    screen.mode = set(modes)
+    screen.tabstops = set(tabstops)
+    screen.charset = charset
+    screen.g0_charset = _charset(g0)
+    screen.g1_charset = _charset(g1)
+    screen.savepoints = [Savepoint(_cursor(x, y, hidden, attrs), _charset(g0), _charset(g1),
+                                   charset, origin, wrap)
+                         for ((y, x, hidden, g0, g1, charset, origin, wrap), attrs)
+                         in zip(savepoints, cursor_attrs[1:])]
+    screen.scroll_offset = min(scroll_offset, len(history))
+    screen.dirty.update(range(max(previous_lines, lines)))
+
+
+class _BytesReader():
+    # Reads from bytes-like data without copying it into a BytesIO first
+    def __init__(self, data):
+        self._data = memoryview(data)
+        self._position = 0
+
+    def read(self, size):
+        start = self._position
+        self._position = min(start + size, len(self._data))
+        return self._data[start:self._position].tobytes()
+
+
+def _decode_buffer(screen, data):
+    buffer = [screen._fit_line(line) for line in screen.history.decode_lines(data)]
+    buffer[screen.lines:] = []
+    buffer.extend([screen.default_char] * screen.columns
+                  for _ in range(screen.lines - len(buffer)))
+    return buffer
+
+
+def _cursor(x, y, hidden, attrs):
+    cursor = Cursor(x, y, attrs)
+    cursor.hidden = hidden
+    return cursor
+
+
+def _charset_id(charset):
+    for (i, key) in enumerate(_CHARSET_KEYS):
+        if charsets.MAPS[key] is charset:
+            return i
+    return _CHARSET_KEYS.index("B")
+
+
+def _charset(charset_id):
+    return charsets.MAPS[_CHARSET_KEYS[charset_id]]
+
+
+def _read_array(stream, size):
+    values = array("I")
+    values.frombytes(_read_exactly(stream, values.itemsize * size))
+    return values
+
+
+def _write_chunk(stream, data):
+    stream.write(_CHUNK_SIZE.pack(len(data)))
+    stream.write(data)
+
+
+def _read_chunk(stream):
+    (size, ) = _CHUNK_SIZE.unpack(_read_exactly(stream, _CHUNK_SIZE.size))
+    return _read_exactly(stream, size)
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        raise ValueError("Screen state is truncated")
+    return data
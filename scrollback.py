@@ -0,0 +1,834 @@
+"""
+Scrollback history store used by the terminal emulator
+"""
+import collections
+import json
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from array import array
+
+from .pyte.screens import Char
+from .pyte.wcwidth import wcwidth
+
+# Number of lines frozen together into one history block
+BLOCK_LINES = 256
+
+# Number of decoded blocks kept around for scrolling
+DECODED_BLOCK_CACHE_SIZE = 4
+
+# Bits per distinct n-gram in the bloom filter kept for each block and number
+# of bits set per n-gram, for about 1% false positives
+BLOCK_FILTER_BITS_PER_NGRAM = 10
+BLOCK_FILTER_HASHES = 4
+
+# Header of a saved history: compressed blocks, lines skipped in the first
+# block, number of blocks
+_SAVE_HEADER = struct.Struct("<?II")
+_CHUNK_SIZE = struct.Struct("<I")
+
+# Bytes moved at a time when compacting the spill file
+_COPY_CHUNK_SIZE = 1 << 20
+
+# Name of the spill files is _SPILL_PREFIX + random part + _SPILL_SUFFIX
+_SPILL_PREFIX = "scrollback_"
+_SPILL_SUFFIX = ".bin"
+
+
+class WrappedLine(list):
+    """
+    A screen line that was soft wrapped, i.e. the text continues on the next
+    line because it did not fit on this one
+    """
+    __slots__ = ()
+
+
+def remove_spill_files(spill_dir):
+    """
+    Remove the spill files in spill_dir. Histories remove their file when
+    closed, so the files found when the plugin is loaded were left behind by
+    a plugin host that crashed or was killed.
+    """
+    try:
+        names = os.listdir(spill_dir)
+    except OSError:
+        return
+
+    for name in names:
+        if name.startswith(_SPILL_PREFIX) and name.endswith(_SPILL_SUFFIX):
+            try:
+                os.remove(os.path.join(spill_dir, name))
+            except OSError:
+                pass
+
+
+class ScrollbackHistory():
+    """
+    Fixed size store of the lines that have scrolled off the top of the
+    terminal screen. Index 0 is the oldest line.
+
+    Lines are frozen into a compact encoding when they are appended: the text
+    of the line plus run-length encoded attributes, where each distinct set of
+    attributes is stored once in an attribute table. Every BLOCK_LINES lines
+    the encoded lines are packed into a single block which is optionally zlib
+    compressed. Blocks are only decoded when one of their lines is requested.
+
+    If a spill directory is given, the oldest blocks are moved to a file in
+    that directory once the blocks kept in memory exceed memory_limit bytes.
+    Spilled blocks are read back through mmap so scrolling far back costs a
+    page fault instead of resident memory. Blocks are appended to the file and
+    the blocks still in the history are moved to the start of the file once
+    the space of dropped blocks exceeds theirs, so the file stays at most
+    about twice the size of the spilled history. Call close() to remove the
+    file again.
+
+    For searching, a bloom filter of the (lower case) characters, bigrams and
+    trigrams of each block is built when the block is frozen, sized for the
+    number of distinct n-grams in the block. Blocks that can not contain a
+    search query are skipped without being read or decompressed.
+
+    Soft wrapped lines (WrappedLine) are stored with a flag so they come back
+    as WrappedLine.
+
+    save() writes the history to a binary stream block by block in its encoded
+    form together with the bloom filters, so load() only has to read the blocks
+    back instead of encoding the lines again. The filters use crc32 as hash so
+    they stay valid in other processes.
+    """
+    def __init__(self, size, compress=True, spill_dir=None, memory_limit=0):
+        self._size = max(int(size), 0)
+        self._compress = compress
+        self._spill_dir = spill_dir
+        self._memory_limit = max(int(memory_limit), 0)
+        self._spill_file = None
+        self._spill_path = None
+        self._spill_size = 0
+        self._spill_map = None
+        self.clear()
+
+    def __len__(self):
+        return self._nb_lines
+
+    def __getitem__(self, index):
+        nb_lines = self._nb_lines
+        if index < 0:
+            index = index + nb_lines
+
+        if index < 0 or index >= nb_lines:
+            raise IndexError("scrollback index out of range")
+
+        position = index + self._skip
+        frozen_lines = len(self._blocks) * BLOCK_LINES
+        if position < frozen_lines:
+            block_no, line_no = divmod(position, BLOCK_LINES)
+            return self._decoded_block(block_no)[line_no]
+
+        text, runs, wrapped = self._hot_lines[position - frozen_lines]
+        return self._decode_line(text, runs, wrapped)
+
+    def size(self):
+        """
+        Maximum number of lines kept in the history
+        """
+        return self._size
+
+    def memory_usage(self):
+        """
+        Approximate number of bytes used to store the history in memory (not
+        counting the decoded block cache and spilled blocks)
+        """
+        filter_bytes = sum(len(block_filter) for block_filter in self._block_filters)
+        return self._block_bytes + self._hot_bytes + filter_bytes
+
+    def disk_usage(self):
+        """
+        Number of bytes written to the spill file
+        """
+        return self._spill_size
+
+    def nb_dropped(self):
+        """
+        Number of lines dropped from the top of the history since it was
+        cleared. Adding this to an index gives a position that stays the same
+        when older lines are dropped.
+        """
+        return self._nb_dropped
+
+    def append(self, line):
+        """
+        Add a line to the bottom of the history. If the history is full the
+        oldest line is dropped.
+        """
+        if self._size == 0:
+            return
+
+        self._append_encoded(self._encode_line(line))
+
+    def _append_encoded(self, encoded):
+        self._hot_lines.append(encoded)
+        self._hot_bytes = self._hot_bytes + _encoded_line_size(encoded)
+        self._nb_lines = self._nb_lines + 1
+
+        if len(self._hot_lines) == BLOCK_LINES:
+            self._freeze_hot_lines()
+
+        if self._nb_lines > self._size:
+            self._drop_oldest_line()
+
+    def search(self, query, before=None):
+        """
+        Search backwards for the last line before line index `before` that
+        contains `query` (case insensitive).
+
+        Returns:
+            tuple: (line index, column) of the match or None if not found.
+        """
+        if not query or self._nb_lines == 0:
+            return None
+
+        query = query.lower()
+        if before is None or before > self._nb_lines:
+            before = self._nb_lines
+
+        # Lines that have not been frozen yet are searched directly
+        frozen_lines = len(self._blocks) * BLOCK_LINES
+        for position in range(before + self._skip - 1, frozen_lines - 1, -1):
+            text = self._hot_lines[position - frozen_lines][0]
+            column = text.lower().find(query)
+            if column >= 0:
+                return (position - self._skip, column)
+
+        ngrams = _query_ngrams(query)
+        last_block = min(before + self._skip, frozen_lines) - 1
+        for block_no in range(last_block // BLOCK_LINES, -1, -1):
+            if not _filter_contains(self._block_filters[block_no], ngrams):
+                continue
+
+            texts = self._block_texts(block_no)
+            first = block_no * BLOCK_LINES
+            last = min(first + BLOCK_LINES - 1, last_block)
+            for position in range(last, max(first, self._skip) - 1, -1):
+                column = texts[position - first].lower().find(query)
+                if column >= 0:
+                    return (position - self._skip, column)
+
+        return None
+
+    def pop_lines(self, count):
+        """
+        Remove the `count` newest lines from the bottom of the history.
+
+        Returns:
+            list: The removed lines, oldest first.
+        """
+        count = min(count, self._nb_lines)
+        lines = []
+        while len(lines) < count:
+            if not self._hot_lines:
+                self._thaw_last_block()
+
+            encoded = self._hot_lines.pop()
+            self._hot_bytes = self._hot_bytes - _encoded_line_size(encoded)
+            self._nb_lines = self._nb_lines - 1
+            lines.append(self._decode_line(*encoded))
+
+        lines.reverse()
+        return lines
+
+    def get_lines(self, start, stop):
+        """
+        Get the lines in the range [start, stop) as a list. The range is
+        clamped to the lines available.
+        """
+        start = max(start, 0)
+        stop = min(stop, self._nb_lines)
+        return [self[i] for i in range(start, stop)]
+
+    def encode_lines(self, lines):
+        """
+        Encode lines (e.g. of the screen) like a history block, using the
+        attribute table of this history. The result is only valid together
+        with the history it was encoded with (see save and decode_lines).
+        """
+        return _pack_encoded([self._encode_line(line) for line in lines])
+
+    def decode_lines(self, data):
+        """
+        Decode lines encoded with encode_lines
+        """
+        return [self._decode_line(*encoded) for encoded in _unpack_encoded(data)]
+
+    def save(self, stream):
+        """
+        Write the history and its attribute table to a binary stream
+        """
+        stream.write(_SAVE_HEADER.pack(self._compress, self._skip, len(self._blocks)))
+        (colors, attrs) = _pack_attrs(self._attrs)
+        _write_chunk(stream, colors)
+        _write_chunk(stream, attrs)
+        for block_no in range(len(self._blocks)):
+            _write_chunk(stream, self._read_block(block_no))
+            _write_chunk(stream, self._block_filters[block_no])
+        _write_chunk(stream, _pack_encoded(self._hot_lines))
+
+    def load(self, stream):
+        """
+        Replace the history by one written with save. If the saved history
+        holds more lines than fit in this one the oldest lines are dropped.
+        """
+        self.clear()
+        header = _read_exactly(stream, _SAVE_HEADER.size)
+        (compressed, skip, nb_blocks) = _SAVE_HEADER.unpack(header)
+        colors = _read_chunk(stream)
+        for attrs in _unpack_attrs(colors, _read_chunk(stream)):
+            self._attr_id(attrs)
+
+        for _ in range(nb_blocks):
+            data = _read_chunk(stream)
+            if compressed and not self._compress:
+                data = zlib.decompress(data)
+            elif self._compress and not compressed:
+                data = zlib.compress(data)
+            self._blocks.append(data)
+            self._block_filters.append(bytearray(_read_chunk(stream)))
+            self._block_bytes = self._block_bytes + len(data)
+
+        self._skip = skip if nb_blocks else 0
+        self._hot_lines = _unpack_encoded(_read_chunk(stream))
+        self._hot_bytes = sum(_encoded_line_size(encoded) for encoded in self._hot_lines)
+        self._nb_lines = nb_blocks * BLOCK_LINES - self._skip + len(self._hot_lines)
+
+        while self._nb_lines > self._size:
+            self._drop_oldest_line()
+        self._spill_blocks_over_limit()
+
+    def empty_copy(self):
+        """
+        Create an empty history with the same settings. Both histories share
+        the attribute table so encoded lines can be moved between them.
+        """
+        copy = ScrollbackHistory(self._size, self._compress, self._spill_dir, self._memory_limit)
+        copy._attrs = self._attrs
+        copy._attr_ids = self._attr_ids
+        return copy
+
+    def clear(self):
+        """
+        Remove all lines from the history
+        """
+        self._attrs = []
+        self._attr_ids = {}
+        self._blocks = collections.deque()
+        self._block_filters = collections.deque()
+        self._first_block_no = 0
+        self._block_bytes = 0
+        self._hot_lines = []
+        self._hot_bytes = 0
+        self._skip = 0
+        self._nb_lines = 0
+        self._nb_dropped = 0
+        self._nb_spilled_blocks = 0
+        self._decoded_blocks = collections.OrderedDict()
+        self._reset_spill_file()
+
+    def close(self):
+        """
+        Release the history and remove the spill file if one was created
+        """
+        self.clear()
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+            try:
+                os.remove(self._spill_path)
+            except OSError:
+                pass
+
+    def _encode_line(self, line):
+        attr_ids = self._attr_ids
+        runs = []
+        last_attrs = None
+        run_length = 0
+        for char in line:
+            attrs = char[1:]
+            if attrs == last_attrs:
+                run_length = run_length + 1
+                continue
+
+            if run_length:
+                runs.append(run_length)
+                runs.append(attr_ids[last_attrs])
+
+            if attrs not in attr_ids:
+                self._attr_id(attrs)
+
+            last_attrs = attrs
+            run_length = 1
+
+        if run_length:
+            runs.append(run_length)
+            runs.append(attr_ids[last_attrs])
+
+        text = "".join(char.data for char in line)
+        return (text, tuple(runs), isinstance(line, WrappedLine))
+
+    def _attr_id(self, attrs):
+        attr_id = self._attr_ids.get(attrs)
+        if attr_id is None:
+            attr_id = len(self._attrs)
+            self._attr_ids[attrs] = attr_id
+            self._attrs.append(attrs)
+        return attr_id
+
+    def _decode_line(self, text, runs, wrapped=False):
+        attrs = self._attrs
+        make_char = Char._make
+        line = []
+        pos = 0
+        for i in range(0, len(runs), 2):
+            end = pos + runs[i]
+            char_attrs = attrs[runs[i + 1]]
+            line.extend(make_char((data, ) + char_attrs) for data in text[pos:end])
+            pos = end
+
+        if wrapped:
+            return WrappedLine(line)
+        return line
+
+    def _freeze_hot_lines(self):
+        data = _pack_encoded(self._hot_lines)
+        if self._compress:
+            data = zlib.compress(data)
+
+        self._blocks.append(data)
+        self._block_filters.append(_make_filter(text for text, _, _ in self._hot_lines))
+        self._block_bytes = self._block_bytes + len(data)
+        self._hot_lines = []
+        self._hot_bytes = 0
+        self._spill_blocks_over_limit()
+
+    def _spill_blocks_over_limit(self):
+        if self._spill_dir is not None:
+            while self._block_bytes > self._memory_limit and \
+                    self._nb_spilled_blocks < len(self._blocks):
+                self._spill_oldest_block()
+
+    def _spill_oldest_block(self):
+        if self._spill_file is None:
+            os.makedirs(self._spill_dir, exist_ok=True)
+            (handle, self._spill_path) = tempfile.mkstemp(prefix=_SPILL_PREFIX,
+                                                          suffix=_SPILL_SUFFIX,
+                                                          dir=self._spill_dir)
+            self._spill_file = os.fdopen(handle, "w+b")
+
+        block_no = self._nb_spilled_blocks
+        data = self._blocks[block_no]
+        self._spill_file.write(data)
+        self._spill_file.flush()
+
+        self._blocks[block_no] = (self._spill_size, len(data))
+        self._spill_size = self._spill_size + len(data)
+        self._block_bytes = self._block_bytes - len(data)
+        self._nb_spilled_blocks = self._nb_spilled_blocks + 1
+
+    def _read_block(self, block_no):
+        block = self._blocks[block_no]
+        if block_no >= self._nb_spilled_blocks:
+            return block
+
+        (offset, length) = block
+        if self._spill_map is None or offset + length > len(self._spill_map):
+            # The file has grown since it was mapped
+            if self._spill_map is not None:
+                self._spill_map.close()
+            self._spill_map = mmap.mmap(self._spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self._spill_map[offset:offset + length]
+
+    def _reset_spill_file(self):
+        self._truncate_spill_file(0)
+
+    def _truncate_spill_file(self, size):
+        if self._spill_map is not None:
+            self._spill_map.close()
+            self._spill_map = None
+
+        if self._spill_file is not None:
+            self._spill_file.seek(size)
+            self._spill_file.truncate()
+
+        self._spill_size = size
+
+    def _compact_spill_file(self):
+        # Move the spilled blocks, which are stored one after the other from
+        # the offset of the oldest one to the end of the file, to the start
+        # of the file. Copied in chunks so the blocks are not all in memory.
+        start = self._blocks[0][0]
+        spill_file = self._spill_file
+        for offset in range(start, self._spill_size, _COPY_CHUNK_SIZE):
+            spill_file.seek(offset)
+            data = spill_file.read(_COPY_CHUNK_SIZE)
+            spill_file.seek(offset - start)
+            spill_file.write(data)
+
+        for block_no in range(self._nb_spilled_blocks):
+            (offset, length) = self._blocks[block_no]
+            self._blocks[block_no] = (offset - start, length)
+        self._truncate_spill_file(self._spill_size - start)
+        spill_file.flush()
+
+    def _unpack_block(self, block_no):
+        data = self._read_block(block_no)
+        if self._compress:
+            data = zlib.decompress(data)
+
+        (text_size, ) = struct.unpack_from("<I", data)
+        return (data, text_size)
+
+    def _block_texts(self, block_no):
+        key = self._first_block_no + block_no
+        if key in self._decoded_blocks:
+            lines = self._decoded_blocks[key]
+            return ["".join(char.data for char in line) for line in lines]
+
+        (data, text_size) = self._unpack_block(block_no)
+        return data[4:4 + text_size].decode("utf-8").split("\n")
+
+    def _decoded_block(self, block_no):
+        key = self._first_block_no + block_no
+        cache = self._decoded_blocks
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+        lines = [self._decode_line(*encoded) for encoded in self._encoded_block_lines(block_no)]
+
+        cache[key] = lines
+        if len(cache) > DECODED_BLOCK_CACHE_SIZE:
+            cache.popitem(last=False)
+
+        return lines
+
+    def _encoded_block_lines(self, block_no):
+        data = self._read_block(block_no)
+        if self._compress:
+            data = zlib.decompress(data)
+
+        return _unpack_encoded(data)
+
+    def _encoded_lines(self, start, stop):
+        # Lines in the range [start, stop) without decoding them
+        position = max(start, 0) + self._skip
+        end = min(stop, self._nb_lines) + self._skip
+        frozen_lines = len(self._blocks) * BLOCK_LINES
+        lines = []
+        while position < min(end, frozen_lines):
+            first = position - position % BLOCK_LINES
+            last = min(end, first + BLOCK_LINES)
+            block_lines = self._encoded_block_lines(first // BLOCK_LINES)
+            lines.extend(block_lines[position - first:last - first])
+            position = last
+
+        if position < end:
+            lines.extend(self._hot_lines[position - frozen_lines:end - frozen_lines])
+
+        return lines
+
+    def _thaw_last_block(self):
+        # Move the lines of the newest block back to the hot lines
+        block_no = len(self._blocks) - 1
+        lines = self._encoded_block_lines(block_no)
+        if block_no == 0:
+            lines = lines[self._skip:]
+            self._skip = 0
+
+        removed = self._blocks.pop()
+        self._block_filters.pop()
+        if block_no < self._nb_spilled_blocks:
+            self._nb_spilled_blocks = self._nb_spilled_blocks - 1
+            if self._nb_spilled_blocks == 0:
+                self._reset_spill_file()
+            else:
+                # The newest spilled block is at the end of the file
+                self._truncate_spill_file(removed[0])
+        else:
+            self._block_bytes = self._block_bytes - len(removed)
+        self._decoded_blocks.pop(self._first_block_no + block_no, None)
+
+        self._hot_lines = lines
+        self._hot_bytes = sum(_encoded_line_size(encoded) for encoded in lines)
+
+    def _drop_oldest_line(self):
+        self._nb_lines = self._nb_lines - 1
+        self._nb_dropped = self._nb_dropped + 1
+        if not self._blocks:
+            removed = self._hot_lines.pop(0)
+            self._hot_bytes = self._hot_bytes - _encoded_line_size(removed)
+            return
+
+        self._skip = self._skip + 1
+        if self._skip == BLOCK_LINES:
+            removed = self._blocks.popleft()
+            self._block_filters.popleft()
+            if self._nb_spilled_blocks > 0:
+                self._nb_spilled_blocks = self._nb_spilled_blocks - 1
+                if self._nb_spilled_blocks == 0:
+                    self._reset_spill_file()
+                elif self._blocks[0][0] > self._spill_size - self._blocks[0][0]:
+                    # More of the file is used by dropped blocks than by the
+                    # blocks still in the history
+                    self._compact_spill_file()
+            else:
+                self._block_bytes = self._block_bytes - len(removed)
+            self._decoded_blocks.pop(self._first_block_no, None)
+            self._first_block_no = self._first_block_no + 1
+            self._skip = 0
+
+
+class HistoryReflow():
+    """
+    Rewraps the lines of a history to a new number of columns a few lines at
+    a time. Lines are rewrapped in their encoded form, oldest first, into a
+    new history which should replace the current one when done. Lines added
+    to the history in the meantime are assumed to have the new width already
+    and are copied over at the end.
+    """
+    def __init__(self, history, columns, blank_char):
+        self.new_history = history.empty_copy()
+        self._columns = columns
+        self._blank_id = history._attr_id(tuple(blank_char[1:]))
+
+        # Positions counted from the first line ever added, so they remain
+        # valid when old lines are dropped from the history
+        self._position = history.nb_dropped()
+        self._end = history.nb_dropped() + len(history)
+
+        # Start of a logical line that continues past the last step
+        self._pending = []
+
+    def step(self, history, max_lines):
+        """
+        Rewrap up to max_lines more lines.
+
+        Returns:
+            bool: True when done.
+        """
+        dropped = history.nb_dropped()
+        start = max(self._position - dropped, 0)
+        end = self._end - dropped
+        stop = min(start + max_lines, end)
+
+        lines = self._pending
+        if stop > start:
+            lines = lines + history._encoded_lines(start, stop)
+            self._position = stop + dropped
+
+        done = stop >= end
+        self._pending = []
+        if not done:
+            split = len(lines)
+            while split > 0 and lines[split - 1][2]:
+                split = split - 1
+            self._pending = lines[split:]
+            lines = lines[:split]
+
+        new_history = self.new_history
+        for encoded in _rewrap_encoded_lines(lines, self._columns, self._blank_id):
+            new_history._append_encoded(encoded)
+
+        if done:
+            for encoded in history._encoded_lines(max(end, 0), len(history)):
+                new_history._append_encoded(encoded)
+
+        return done
+
+
+def _rewrap_encoded_lines(lines, columns, blank_id):
+    # Join the encoded lines into logical lines and split them again into
+    # lines of the given width, dropping blanks at the end of logical lines
+    texts = []
+    runs = []
+    last = len(lines) - 1
+    for (i, (text, line_runs, wrapped)) in enumerate(lines):
+        texts.append(text)
+        runs.extend(line_runs)
+        if wrapped and i < last:
+            continue
+
+        text = "".join(texts)
+        while runs and runs[-1] == blank_id:
+            length = runs[-2]
+            kept = len(text[len(text) - length:].rstrip(" "))
+            text = text[:len(text) - length + kept]
+            if kept > 0:
+                runs[-2] = kept
+                break
+            del runs[-2:]
+
+        start = 0
+        while True:
+            end = start + columns
+            wrapped = end < len(text)
+            if wrapped and columns > 1 and wcwidth(text[end - 1]) > 1:
+                # Keep wide characters together with their stub
+                end = end - 1
+            line_text = text[start:end]
+            line_runs = _slice_runs(runs, start, end)
+            padding = columns - len(line_text)
+            if padding > 0:
+                line_text = line_text + " " * padding
+                line_runs.extend((padding, blank_id))
+            yield (line_text, tuple(line_runs), wrapped)
+
+            if not wrapped:
+                break
+            start = end
+
+        texts = []
+        runs = []
+
+
+def _slice_runs(runs, start, end):
+    # Attribute runs of the characters in the range [start, end)
+    sliced = []
+    position = 0
+    for i in range(0, len(runs), 2):
+        run_end = position + runs[i]
+        if run_end > start and position < end:
+            sliced.append(min(run_end, end) - max(position, start))
+            sliced.append(runs[i + 1])
+        position = run_end
+        if position >= end:
+            break
+
+    return sliced
+
+
+def _pack_encoded(lines):
+    # Text of all lines followed by the attribute runs of all lines
+    texts = "\n".join(text for text, _, _ in lines).encode("utf-8")
+    runs = array("I")
+    for _, line_runs, wrapped in lines:
+        # The number of runs is even so the lowest bit holds the wrapped flag
+        runs.append(len(line_runs) | wrapped)
+        runs.extend(line_runs)
+
+    return struct.pack("<I", len(texts)) + texts + runs.tobytes()
+
+
+def _unpack_encoded(data):
+    (text_size, ) = struct.unpack_from("<I", data)
+    runs = array("I")
+    runs.frombytes(data[4 + text_size:])
+    if not runs:
+        return []
+
+    lines = []
+    pos = 0
+    for text in data[4:4 + text_size].decode("utf-8").split("\n"):
+        nb_runs = runs[pos] & ~1
+        wrapped = bool(runs[pos] & 1)
+        pos = pos + 1
+        lines.append((text, tuple(runs[pos:pos + nb_runs]), wrapped))
+        pos = pos + nb_runs
+
+    return lines
+
+
+def _pack_attrs(attr_table):
+    # The colors (packed integers or pyte color names) are stored once in a
+    # table, each set of attributes as two color indexes and a bit per flag
+    colors = []
+    color_ids = {}
+    packed = array("I")
+    for (fg, bg, *flags) in attr_table:
+        for color in (fg, bg):
+            if color not in color_ids:
+                color_ids[color] = len(colors)
+                colors.append(color)
+            packed.append(color_ids[color])
+        packed.append(sum(1 << i for (i, flag) in enumerate(flags) if flag))
+
+    return (json.dumps(colors, separators=(",", ":")).encode("utf-8"), packed.tobytes())
+
+
+def _unpack_attrs(colors, packed_attrs):
+    colors = json.loads(colors.decode("utf-8"))
+    packed = array("I")
+    packed.frombytes(packed_attrs)
+    nb_flags = len(Char._fields) - 3
+    flags = [tuple(bool(value & (1 << bit)) for bit in range(nb_flags))
+             for value in range(1 << nb_flags)]
+    return [(colors[packed[i]], colors[packed[i + 1]]) + flags[packed[i + 2]]
+            for i in range(0, len(packed), 3)]
+
+
+def _write_chunk(stream, data):
+    stream.write(_CHUNK_SIZE.pack(len(data)))
+    stream.write(data)
+
+
+def _read_chunk(stream):
+    (size, ) = _CHUNK_SIZE.unpack(_read_exactly(stream, _CHUNK_SIZE.size))
+    return _read_exactly(stream, size)
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        raise ValueError("Saved scrollback history is truncated")
+    return data
+
+
+def _encoded_line_size(encoded):
+    text, runs, _ = encoded
+    return len(text) + 4 * len(runs)
+
+
+def _block_ngrams(texts):
+    # The characters, bigrams and trigrams of lines, in lower case
+    ngrams = set()
+    for text in texts:
+        text = text.lower()
+        ngrams.update(text)
+        ngrams.update(text[i:i + 2] for i in range(len(text) - 1))
+        ngrams.update(text[i:i + 3] for i in range(len(text) - 2))
+    return ngrams
+
+
+def _query_ngrams(query):
+    # N-grams a block must contain to contain query (in lower case)
+    if len(query) < 3:
+        return (query, )
+    return set(query[i:i + 3] for i in range(len(query) - 2))
+
+
+def _make_filter(texts):
+    ngrams = _block_ngrams(texts)
+    block_filter = bytearray(max(len(ngrams) * BLOCK_FILTER_BITS_PER_NGRAM // 8, 8))
+    nb_bits = len(block_filter) * 8
+    for ngram in ngrams:
+        for bit in _filter_positions(ngram, nb_bits):
+            block_filter[bit >> 3] |= 1 << (bit & 7)
+    return block_filter
+
+
+def _filter_positions(ngram, nb_bits):
+    # Double hashing with two crc32 values, which unlike hash() are the same
+    # in every process
+    data = ngram.encode("utf-8")
+    first = zlib.crc32(data)
+    second = zlib.crc32(data, 0x5bd1e995) | 1
+    return [(first + i * second) % nb_bits for i in range(BLOCK_FILTER_HASHES)]
+
+
+def _filter_contains(block_filter, ngrams):
+    nb_bits = len(block_filter) * 8
+    for ngram in ngrams:
+        for bit in _filter_positions(ngram, nb_bits):
+            if not block_filter[bit >> 3] & (1 << (bit & 7)):
+                return False
+
+    return True
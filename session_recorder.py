@@ -0,0 +1,137 @@
+"""
+Recording and deterministic replay of terminal sessions. The raw output of the
+shell is recorded with the chunking it was read with, together with input and
+resize events, so slow sessions can be reproduced and profiled offline.
+"""
+import struct
+import time
+
+# File header (magic and format version)
+_MAGIC = b"TVREC\x01"
+
+# Record header: event type, seconds since start of recording, payload size
+_RECORD_HEADER = struct.Struct("<BdI")
+_RESIZE_PAYLOAD = struct.Struct("<HH")
+
+# Event types
+EVENT_OUTPUT = 1
+EVENT_INPUT = 2
+EVENT_RESIZE = 3
+
+# Size of the write buffer of the recording file
+_WRITE_BUFFER_SIZE = 65536
+
+
+class SessionRecorder():
+    """
+    Records the events of a terminal session to a compact binary log. Writes
+    are buffered so recording is cheap enough to leave on during a session.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._file = open(path, "wb", buffering=_WRITE_BUFFER_SIZE)
+        self._file.write(_MAGIC)
+        self._start = time.monotonic()
+
+    def path(self):
+        return self._path
+
+    def record_output(self, data):
+        """
+        Record a chunk of output from the shell
+        """
+        self._write(EVENT_OUTPUT, data)
+
+    def record_input(self, data):
+        """
+        Record input sent to the shell
+        """
+        self._write(EVENT_INPUT, data)
+
+    def record_resize(self, lines, columns):
+        """
+        Record a resize of the terminal screen
+        """
+        self._write(EVENT_RESIZE, _RESIZE_PAYLOAD.pack(lines, columns))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, event, payload):
+        if self._file is None:
+            return
+
+        timestamp = time.monotonic() - self._start
+        # Write header and payload in one call so records from different
+        # threads never interleave
+        self._file.write(_RECORD_HEADER.pack(event, timestamp, len(payload)) + payload)
+
+
+def read_session(path):
+    """
+    Read a recorded session one event at a time.
+
+    Yields:
+        tuple: (event type, timestamp, payload) where the payload is bytes for
+               output and input events and (lines, columns) for resize events.
+    """
+    with open(path, "rb") as session_file:
+        if session_file.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("%s is not a TerminalView session recording" % path)
+
+        while True:
+            header = session_file.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+
+            (event, timestamp, size) = _RECORD_HEADER.unpack(header)
+            payload = session_file.read(size)
+            if len(payload) < size:
+                # Recording was cut off while writing the last event
+                return
+
+            if event == EVENT_RESIZE:
+                payload = _RESIZE_PAYLOAD.unpack(payload)
+
+            yield (event, timestamp, payload)
+
+
+def replay_session(path, terminal, realtime=False, speed=1.0, on_output=None):
+    """
+    Replay a recorded session into a terminal emulator with the original
+    chunking of the output.
+
+    Args:
+        path (str): Recorded session file.
+        terminal: Object with feed(data) and resize(lines, columns) methods,
+                  e.g. a PyteTerminalEmulator.
+        realtime (bool, optional): Replay with the original timing instead of
+                                   as fast as possible.
+        speed (float, optional): Speed multiplier when replaying in realtime.
+        on_output (callable, optional): Called after each output chunk has
+                                        been fed, e.g. to render a frame.
+
+    Returns:
+        tuple: (number of output chunks, number of output bytes)
+    """
+    nb_chunks = 0
+    nb_bytes = 0
+    start = time.monotonic()
+    for (event, timestamp, payload) in read_session(path):
+        if realtime:
+            delay = timestamp / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        if event == EVENT_OUTPUT:
+            terminal.feed(payload)
+            nb_chunks = nb_chunks + 1
+            nb_bytes = nb_bytes + len(payload)
+            if on_output is not None:
+                on_output()
+        elif event == EVENT_RESIZE:
+            terminal.resize(payload[0], payload[1])
+
+    return (nb_chunks, nb_bytes)
@@ -0,0 +1,119 @@
+"""
+Pool of shells started ahead of time so a terminal view does not have to wait
+for the shell to start up
+"""
+import os
+import threading
+
+from . import linux_pty
+
+# Screen size the pooled shells are started with (the initial size of the
+# terminal emulator)
+POOL_LINES = 24
+POOL_COLUMNS = 80
+
+
+# Bytes of buffered shell output read at a time when draining a shell
+_DRAIN_READ_SIZE = 65536
+
+
+class ShellPool():
+    """
+    Keeps up to `size` started shells for each of the given shell commands.
+    Other commands (e.g. ssh or htop) are never pooled, as they are not
+    shells that can be moved to another directory and spare copies of them
+    should not run in the background. The shells are started in the home
+    directory and moved to the working directory of the terminal view that
+    adopts them. Adopted shells are replaced in a background thread.
+    """
+    def __init__(self, size, commands, spawn=None):
+        self._size = max(int(size), 0)
+        self._commands = frozenset(commands)
+        self._spawn = spawn or _spawn_shell
+        self._shells = {}
+        self._nb_starting = {}
+        self._lock = threading.Lock()
+
+    def prewarm(self, cmd):
+        """
+        Fill the pool for the given command in a background thread
+        """
+        if self._size == 0 or cmd not in self._commands:
+            return
+
+        thread = threading.Thread(target=self.fill, args=(cmd, ))
+        thread.daemon = True
+        thread.start()
+
+    def fill(self, cmd):
+        """
+        Start shells for the given command until its pool is full
+        """
+        if self._size == 0 or cmd not in self._commands:
+            return
+
+        while True:
+            with self._lock:
+                nb_starting = self._nb_starting.get(cmd, 0)
+                if len(self._shells.get(cmd, ())) + nb_starting >= self._size:
+                    return
+                self._nb_starting[cmd] = nb_starting + 1
+
+            try:
+                shell = self._spawn(cmd)
+            finally:
+                with self._lock:
+                    self._nb_starting[cmd] = self._nb_starting[cmd] - 1
+
+            with self._lock:
+                self._shells.setdefault(cmd, []).append(shell)
+
+    def acquire(self, cmd, cwd):
+        """
+        Take a started shell for the given command out of the pool and move
+        it to cwd. The output the shell printed so far (its prompt) is
+        discarded so only the prompt printed after the cd shows. The pool is
+        refilled in the background.
+
+        Returns:
+            The shell or None if the command is not pooled or there is no
+            started shell for it.
+        """
+        if cmd not in self._commands:
+            return None
+
+        shell = None
+        with self._lock:
+            shells = self._shells.get(cmd, [])
+            while shells and shell is None:
+                shell = shells.pop(0)
+                if not shell.is_running():
+                    shell = None
+
+        self.prewarm(cmd)
+        if shell is not None:
+            while shell.receive_output(_DRAIN_READ_SIZE) is not None:
+                pass
+            if cwd:
+                shell.change_directory(cwd)
+
+        return shell
+
+    def nb_available(self, cmd):
+        with self._lock:
+            return len(self._shells.get(cmd, ()))
+
+    def close(self):
+        """
+        Stop all shells in the pool
+        """
+        with self._lock:
+            shells = [shell for pool in self._shells.values() for shell in pool]
+            self._shells = {}
+
+        for shell in shells:
+            shell.stop()
+
+
+def _spawn_shell(cmd):
+    return linux_pty.LinuxPty(cmd.split(), os.path.expanduser("~"), POOL_LINES, POOL_COLUMNS)
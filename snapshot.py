@@ -0,0 +1,80 @@
+"""
+Snapshots of the screen and scrollback history of a terminal view saved to
+disk, so the output of a terminal is not lost when Sublime Text restarts or
+the project is switched
+"""
+import os
+import time
+
+# File header (magic and format version), followed by the screen state (see
+# screen_state)
+_MAGIC = b"TVSNAP\x02"
+
+# Size of the file buffers used for reading and writing snapshots
+_BUFFER_SIZE = 262144
+
+# Snapshots not written for this many seconds belong to terminal views that
+# no longer exist
+SNAPSHOT_MAX_AGE = 30 * 24 * 3600
+
+
+def save_snapshot(path, emulator):
+    """
+    Save the state of a terminal emulator (see PyteTerminalEmulator.save_state).
+    The snapshot is written to a temporary file first so an interrupted save
+    never leaves a broken snapshot behind.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb", buffering=_BUFFER_SIZE) as snapshot_file:
+        snapshot_file.write(_MAGIC)
+        emulator.save_state(snapshot_file)
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path, emulator):
+    """
+    Restore the contents of a terminal emulator from a snapshot for a new
+    shell (see PyteTerminalEmulator.load_snapshot).
+
+    Returns:
+        bool: False if there is no snapshot at path.
+    """
+    try:
+        snapshot_file = open(path, "rb", buffering=_BUFFER_SIZE)
+    except FileNotFoundError:
+        return False
+
+    with snapshot_file:
+        if snapshot_file.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("%s is not a TerminalView snapshot" % path)
+        emulator.load_snapshot(snapshot_file)
+
+    return True
+
+
+def remove_snapshot(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def remove_old_snapshots(snapshot_dir, max_age=SNAPSHOT_MAX_AGE):
+    """
+    Remove the snapshots in snapshot_dir that were not written for max_age
+    seconds
+    """
+    try:
+        names = os.listdir(snapshot_dir)
+    except OSError:
+        return
+
+    oldest = time.time() - max_age
+    for name in names:
+        path = os.path.join(snapshot_dir, name)
+        try:
+            if os.path.getmtime(path) < oldest:
+                os.remove(path)
+        except OSError:
+            pass
@@ -2,13 +2,21 @@
 Wrapper module around a Sublime Text 3 view for showing a terminal look-a-like
 """
 import collections
+import os
 import time
 
 import sublime
 import sublime_plugin
 
+from . import color_scheme
+from . import event_trace
+from . import metrics
+from . import snapshot
 from . import terminal_emulator
 
+# Number of lines updated between checks of the frame budget
+FRAME_BUDGET_CHUNK_LINES = 8
+
 
 class SublimeTerminalBuffer():
     def __init__(self, sublime_view, title, logger, syntax_file=None):
@@ -26,6 +34,8 @@ class SublimeTerminalBuffer():
         self._view.settings().set("draw_indent_guides", False)
         self._view.settings().set("caret_style", "blink")
         self._view.settings().set("scroll_past_end", False)
+        # Scopes of the colors set by the shell (see set_color_scheme)
+        self._view.terminal_view_color_scheme = color_scheme.BasicColorScopes()
         self._view.settings().add_on_change('color_scheme', lambda: set_color_scheme(self._view))
 
         if syntax_file is not None:
@@ -33,12 +43,31 @@ class SublimeTerminalBuffer():
 
         settings = sublime.load_settings('TerminalView.sublime-settings')
         self._view.terminal_view_logger = logger
+        collect_stats = settings.get("terminal_view_collect_stats", False)
+        self._view.terminal_view_metrics = metrics.Metrics(collect_stats)
+        trace_size = settings.get("terminal_view_trace_size", 0)
+        self._view.terminal_view_trace = event_trace.EventTrace(trace_size) if trace_size else None
         self._view.terminal_view_show_colors = settings.get("terminal_view_show_colors", False)
+        self._view.terminal_view_frame_budget = settings.get("terminal_view_frame_budget_ms",
+                                                             8) / 1000.
         self._view.terminal_view_last_cursor_pos = None
 
+        # Number of rows of the terminal screen, which is the debounced size
+        # of the view (see update_terminal_size)
+
         # Flag to request scrolling in view (from one thread to another)
         self._view.terminal_view_scroll = None
 
+        # Search query requested in view (from one thread to another) and the
+        # state of the last search
+        self._view.terminal_view_search = None
+        self._view.terminal_view_last_search = None
+        self._view.terminal_view_search_match = None
+
+        # Number of seconds to profile the update loop for (requested from
+        # one thread to another)
+        self._view.terminal_view_profile = None
+
         # Mark in the views private settings that this is a terminal view so we
         # can use this as context in the keymap
         self._view.settings().set("terminal_view", True)
@@ -58,17 +87,57 @@ class SublimeTerminalBuffer():
         # Use pyte as underlying terminal emulator
         hist = settings.get("terminal_view_scroll_history", 1000)
         ratio = settings.get("terminal_view_scroll_ratio", 0.5)
+        compress = settings.get("terminal_view_scroll_history_compression", True)
+        spill_dir = None
+        if settings.get("terminal_view_scroll_history_spill", False):
+            spill_dir = history_spill_dir(settings)
+        memory_limit = settings.get("terminal_view_scroll_history_memory_limit", 8388608)
         self._view.terminal_view_emulator = \
-            terminal_emulator.PyteTerminalEmulator(80, 24, hist, ratio)
+            terminal_emulator.PyteTerminalEmulator(80, 24, hist, ratio, compress,
+                                                   history_spill_dir=spill_dir,
+                                                   history_memory_limit=memory_limit)
+        self._emulator_options = {"lines": 24, "columns": 80, "history": hist, "ratio": ratio,
+                                  "compress": compress, "spill_dir": spill_dir,
+                                  "memory_limit": memory_limit}
+
+    def emulator_options(self):
+        """
+        Arguments of the terminal emulator for creating it elsewhere (see
+        emulator_worker)
+        """
+        return dict(self._emulator_options)
+
+    def set_emulator(self, emulator):
+        """
+        Show the screen of another terminal emulator, e.g. the RemoteEmulator
+        of an emulator_worker, instead of the local one
+        """
+        self._view.terminal_view_emulator.close()
+        self._view.terminal_view_emulator = emulator
 
     def set_keypress_callback(self, callback):
         self._view.terminal_view_keypress_callback = callback
 
     def insert_data(self, data):
-        start = time.time()
+        view_metrics = self._view.terminal_view_metrics
+        trace = self._view.terminal_view_trace
+        if trace is not None:
+            trace_start = trace.now()
+        start = view_metrics.start_timer()
         self._view.terminal_view_emulator.feed(data)
-        t = time.time() - start
-        self._view.terminal_view_logger.log("Updated terminal emulator in %.3f ms" % (t * 1000.))
+        view_metrics.stop_timer("parse_ms", start)
+        view_metrics.output_received()
+        if trace is not None:
+            trace.add("feed", trace_start, len(data))
+        view_metrics.count("bytes_read", len(data))
+        view_metrics.record("bytes_per_read", len(data))
+
+        logger = self._view.terminal_view_logger
+        if logger.enabled():
+            emulator = self._view.terminal_view_emulator
+            logger.log("Scrollback history holds %u lines in %u bytes (%u bytes on disk)",
+                       emulator.history_size(), emulator.history_memory_usage(),
+                       emulator.history_disk_usage())
 
     def update_view(self):
         # If update fails last_update remains the same
@@ -82,14 +151,52 @@ class SublimeTerminalBuffer():
     def is_open(self):
         return self._view.is_valid()
 
+    def output_parsed_elsewhere(self, nb_bytes, parse_ms):
+        """
+        Record the metrics of output that was parsed by an emulator in another
+        process (see emulator_worker) like insert_data does for local output
+        """
+        view_metrics = self._view.terminal_view_metrics
+        view_metrics.record("parse_ms", parse_ms, metrics.TIME_BUCKETS_MS)
+        view_metrics.output_received()
+        view_metrics.count("bytes_read", nb_bytes)
+
+    def metrics(self):
+        return self._view.terminal_view_metrics
+
     def close(self):
         if self.is_open():
             sublime.active_window().focus_view(self._view)
             sublime.active_window().run_command("close_file")
 
+    def release_history(self):
+        """
+        Release the scrollback history of the terminal including any history
+        spilled to disk
+        """
+        self._view.terminal_view_emulator.close()
+
+    def save_snapshot(self, path):
+        snapshot.save_snapshot(path, self._view.terminal_view_emulator)
+
+    def load_snapshot(self, path):
+        """
+        Restore the screen and history of the terminal from a snapshot
+
+        Returns:
+            bool: False if there is no snapshot at path.
+        """
+        return snapshot.load_snapshot(path, self._view.terminal_view_emulator)
+
     def update_terminal_size(self, nb_rows, nb_cols):
         self._view.terminal_view_emulator.resize(nb_rows, nb_cols)
 
+    def terminal_size(self):
+        """
+        Size of the terminal screen as (rows, columns)
+        """
+        return self._view.terminal_view_emulator.screen_size()
+
     def view_size(self):
         view = self._view
         (pixel_width, pixel_height) = view.viewport_extent()
@@ -114,7 +221,7 @@ class SublimeTerminalBuffer():
 class TerminalViewScroll(sublime_plugin.TextCommand):
     def run(self, _, forward=False, line=False):
         # Mark on view to request a scroll in the thread that handles the
-        # updates. Note lines are supported at the moment.
+        # updates. Scrolling is done either by lines or by pages.
         if line:
             self.view.terminal_view_scroll = ("line", )
         else:
@@ -126,6 +233,76 @@ class TerminalViewScroll(sublime_plugin.TextCommand):
             self.view.terminal_view_scroll = self.view.terminal_view_scroll + ("down", )
 
 
+class TerminalViewSearch(sublime_plugin.TextCommand):
+    def run(self, _, query=None):
+        if query is not None:
+            self._request_search(query)
+            return
+
+        last_query = self.view.terminal_view_last_search or ""
+        self.view.window().show_input_panel("Search terminal history:", last_query,
+                                            self._request_search, None, None)
+
+    def _request_search(self, query):
+        # Mark on view to request a search in the thread that handles the
+        # updates. Searching for the same query again finds the next older match.
+        if query:
+            self.view.terminal_view_search = query
+
+
+class TerminalViewProfile(sublime_plugin.TextCommand):
+    def run(self, _, duration=10):
+        # Mark on view to request profiling in the thread that handles the
+        # updates. The results are shown in a new view when done.
+        self.view.terminal_view_profile = duration
+        sublime.status_message("Terminal View: Profiling for %i seconds" % duration)
+
+
+class TerminalViewDumpTrace(sublime_plugin.TextCommand):
+    def run(self, _):
+        trace = getattr(self.view, "terminal_view_trace", None)
+        if trace is None:
+            sublime.status_message("Terminal View: Set terminal_view_trace_size to record a trace")
+            return
+
+        trace_dir = os.path.join(sublime.cache_path(), "TerminalView", "traces")
+        os.makedirs(trace_dir, exist_ok=True)
+        name = "trace_%s_%i.json" % (time.strftime("%Y%m%d_%H%M%S"), self.view.id())
+        path = os.path.join(trace_dir, name)
+        trace.dump(path)
+
+        print("[terminal_view] Wrote trace of %i spans to %s" % (len(trace), path))
+        sublime.status_message("Terminal View: Wrote trace to %s" % path)
+
+
+class TerminalViewShowStats(sublime_plugin.TextCommand):
+    def run(self, _):
+        view_metrics = getattr(self.view, "terminal_view_metrics", None)
+        if view_metrics is None:
+            sublime.status_message("Terminal View: Not a terminal view")
+            return
+
+        if not view_metrics.enabled():
+            sublime.status_message("Terminal View: Enable terminal_view_collect_stats to "
+                                   "collect stats")
+            return
+
+        lines = view_metrics.summary()
+        print("[terminal_view stats] %s" % self.view.name())
+        for line in lines:
+            print("  " + line)
+
+        # Show the most interesting numbers in the status bar
+        status = []
+        for name in ("parse_ms", "view_update_ms", "keystroke_latency_ms"):
+            histogram = view_metrics.histogram(name)
+            if histogram is not None:
+                status.append("%s p50=%g p99=%g" % (name, histogram.percentile(50),
+                                                    histogram.percentile(99)))
+        status.append("frames_dropped=%i" % view_metrics.counter("frames_dropped"))
+        sublime.status_message("Terminal View: " + ", ".join(status) + " (see console)")
+
+
 class TerminalViewKeypress(sublime_plugin.TextCommand):
     def run(self, _, **kwargs):
         if type(kwargs["key"]) is not str:
@@ -192,11 +369,25 @@ class TerminalViewUpdate(sublime_plugin.TextCommand):
         if not hasattr(self.view, "terminal_view_emulator"):
             return
 
-        # Check if scroll was requested
+        # Check if scroll or search was requested
         self._update_scrolling()
-
-        # Update dirty lines in buffer if there are any
-        dirty_lines = self.view.terminal_view_emulator.dirty_lines()
+        search_match = self._update_search()
+
+        # Rewrap some more of the history after the terminal width changed
+        self.view.terminal_view_emulator.reflow_history()
+
+        # Update dirty lines in buffer if there are any. Lines below the
+        # visible part of the view are only updated in frames where nothing
+        # visible changed.
+        trace = self.view.terminal_view_trace
+        if trace is not None:
+            trace_start = trace.now()
+        emulator = self.view.terminal_view_emulator
+        dirty_lines = emulator.dirty_lines(self._visible_rows())
+        if len(dirty_lines) == 0:
+            dirty_lines = emulator.dirty_lines()
+        if trace is not None:
+            trace.add("dirty_calc", trace_start, len(dirty_lines))
         if len(dirty_lines) > 0:
             # Reset viewport when data is inserted
             self._update_viewport_position()
@@ -204,28 +395,51 @@ class TerminalViewUpdate(sublime_plugin.TextCommand):
             # Invalidate the last cursor position when dirty lines are updated
             self.view.terminal_view_last_cursor_pos = None
 
-            # Generate color map
-            color_map = {}
-            if self.view.terminal_view_show_colors:
-                start = time.time()
-                color_map = self.view.terminal_view_emulator.color_map(dirty_lines.keys())
-                t = time.time() - start
-                self.view.terminal_view_logger.log("Generated color map in %.3f ms" % (t * 1000.))
-
-            # Update the view
-            start = time.time()
-            self._update_lines(edit, dirty_lines, color_map)
-            self.view.terminal_view_emulator.clear_dirty()
-            t = time.time() - start
-            self.view.terminal_view_logger.log("Updated ST3 view in %.3f ms" % (t * 1000.))
+            view_metrics = self.view.terminal_view_metrics
+            view_metrics.record("dirty_lines_per_frame", len(dirty_lines))
+
+            # Update the view. Lines not updated within the frame budget stay
+            # dirty and are updated in the next frame.
+            start = view_metrics.start_timer()
+            updated_lines = self._update_lines_within_budget(edit, dirty_lines)
+            emulator.clear_dirty(updated_lines)
+            view_metrics.stop_timer("view_update_ms", start)
+            view_metrics.frame_rendered()
+
+            nb_carried_over = len(dirty_lines) - len(updated_lines)
+            if nb_carried_over > 0:
+                view_metrics.record("lines_carried_over", nb_carried_over)
+                self.view.terminal_view_logger.log(
+                    "Frame budget of %g ms used up, %u dirty lines carried over to the next frame",
+                    self.view.terminal_view_frame_budget * 1000., nb_carried_over)
+
+        # Write newly generated color scopes to the color scheme (in another
+        # thread and rate limited as the color scheme is reloaded each time)
+        self.view.terminal_view_color_scheme.flush_if_needed(sublime.set_timeout_async)
 
         # Update cursor last to avoid a selection blinking at the top of the
         # terminal when starting or when a new prompt is being drawn at the
         # bottom
         self._update_cursor()
 
+        # Select the search match last so it is not replaced by the cursor
+        if search_match is not None:
+            self._select_search_match(search_match)
+
         self.view.terminal_view_last_update = time.time()
 
+    def _visible_rows(self):
+        # Frames that update lines reset the viewport to the top (see
+        # _update_viewport_position), so the rows shown are the first rows
+        # that fit in the view. While a resize is debounced the view can be
+        # smaller than the screen.
+        line_height = self.view.line_height()
+        if line_height == 0:
+            return None
+
+        nb_rows = int(self.view.viewport_extent()[1] / line_height)
+        return range(max(nb_rows, 1))
+
     def _update_viewport_position(self):
         self.view.set_viewport_position((0, 0), animate=False)
 
@@ -246,16 +460,107 @@ class TerminalViewUpdate(sublime_plugin.TextCommand):
 
             self.view.terminal_view_scroll = None
 
+    def _update_search(self):
+        query = self.view.terminal_view_search
+        if query is None:
+            return None
+
+        self.view.terminal_view_search = None
+        emulator = self.view.terminal_view_emulator
+
+        # Continue upwards from the last match when searching for the same
+        # query again and wrap around when the top is reached
+        before = None
+        last_match = self.view.terminal_view_search_match
+        if query == self.view.terminal_view_last_search and last_match is not None:
+            before = last_match[0]
+
+        try:
+            match = emulator.search(query, before)
+            if match is None and before is not None:
+                match = emulator.search(query)
+
+            self.view.terminal_view_last_search = query
+            self.view.terminal_view_search_match = match
+            if match is None:
+                sublime.status_message("Terminal View: No match for \"%s\"" % query)
+                return None
+
+            row = emulator.scroll_to_line(match[0])
+        except OSError as e:
+            # The search ran in a worker process that is busy or gone
+            sublime.status_message("Terminal View: Search for \"%s\" failed: %s" % (query, e))
+            return None
+
+        return (row, match[1], len(query))
+
+    def _select_search_match(self, search_match):
+        (row, col, length) = search_match
+        start = self.view.text_point(row, col)
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(start, start + length))
+
+        # Keep the selection until the terminal cursor moves
+        self.view.terminal_view_last_cursor_pos = self.view.terminal_view_emulator.cursor()
+
     def _update_cursor(self):
         cursor_pos = self.view.terminal_view_emulator.cursor()
         if self.view.terminal_view_last_cursor_pos == cursor_pos:
             return
 
-        tp = self.view.text_point(cursor_pos[0], cursor_pos[1])
+        # No caret is shown while the cursor is scrolled out of the viewport
         self.view.sel().clear()
-        self.view.sel().add(sublime.Region(tp, tp))
+        if cursor_pos is not None:
+            tp = self.view.text_point(cursor_pos[0], cursor_pos[1])
+            self.view.sel().add(sublime.Region(tp, tp))
         self.view.terminal_view_last_cursor_pos = cursor_pos
 
+    def _update_lines_within_budget(self, edit, dirty_lines):
+        """
+        Update the dirty lines a few at a time until the frame budget is used
+        up, starting with the lines that matter most.
+
+        Returns:
+            list: The lines that were updated.
+        """
+        budget = self.view.terminal_view_frame_budget
+        deadline = time.perf_counter() + budget
+        lines = self._prioritize_lines(dirty_lines)
+        for start in range(0, len(lines), FRAME_BUDGET_CHUNK_LINES):
+            chunk = lines[start:start + FRAME_BUDGET_CHUNK_LINES]
+            chunk_lines = {line: dirty_lines[line] for line in chunk}
+            self._update_lines(edit, chunk_lines, self._color_map(chunk))
+            if budget and time.perf_counter() > deadline:
+                return lines[:start + FRAME_BUDGET_CHUNK_LINES]
+
+        return lines
+
+    def _prioritize_lines(self, dirty_lines):
+        # Lines removed from the screen are erased first so the lines in the
+        # view stay in sync with the screen, then the cursor line and the
+        # other lines from the bottom up as that is where new output appears
+        cursor_line = (self.view.terminal_view_emulator.cursor() or (None, ))[0]
+        removed = sorted(line for line, content in dirty_lines.items() if content is None)
+        changed = sorted((line for line, content in dirty_lines.items() if content is not None),
+                         key=lambda line: (line != cursor_line, -line))
+        return removed + changed
+
+    def _color_map(self, lines):
+        if not self.view.terminal_view_show_colors:
+            return {}
+
+        trace = self.view.terminal_view_trace
+        if trace is not None:
+            trace_start = trace.now()
+        view_metrics = self.view.terminal_view_metrics
+        start = view_metrics.start_timer()
+        color_map = self.view.terminal_view_emulator.color_map(lines)
+        view_metrics.stop_timer("color_map_ms", start)
+        if trace is not None:
+            trace.add("color_map", trace_start, len(color_map))
+
+        return color_map
+
     def _update_lines(self, edit, dirty_lines, color_map):
         self.view.set_read_only(False)
         lines = dirty_lines.keys()
@@ -287,12 +592,19 @@ class TerminalViewUpdate(sublime_plugin.TextCommand):
         # API has been left out on purpose as they are slower than the
         # alternative.
 
+        if content is not None and line_no not in self.view.terminal_view_buffer_contents:
+            self._insert_placeholder_lines(edit, line_no)
+
         # Get start and end point of the line
         line_start, line_end = self._get_line_start_and_end_points(line_no)
 
         # Make region spanning entire line (including any newline at the end)
         line_region = sublime.Region(line_start, line_end)
 
+        trace = self.view.terminal_view_trace
+        if trace is not None:
+            trace_start = trace.now()
+
         if content is None:
             self.view.erase(edit, line_region)
             if line_no in self.view.terminal_view_buffer_contents:
@@ -305,14 +617,34 @@ class TerminalViewUpdate(sublime_plugin.TextCommand):
             # Update our local copy of the ST3 view buffer
             self.view.terminal_view_buffer_contents[line_no] = content_w_newline
 
+        if trace is not None:
+            trace.add("replace", trace_start, len(content or ""))
+
+    def _insert_placeholder_lines(self, edit, line_no):
+        # Lines are updated from the bottom up and possibly over several
+        # frames, so the lines above a new line may not be in the view yet.
+        # Blank lines keep their place so the new line (and the cursor) ends
+        # up on the right row until they are updated.
+        buffer_contents = self.view.terminal_view_buffer_contents
+        point = 0
+        for i in range(line_no):
+            if i not in buffer_contents:
+                self.view.insert(edit, point, "\n")
+                buffer_contents[i] = "\n"
+            point = point + len(buffer_contents[i])
+
     def _update_line_colors(self, line_no, line_color_map):
         # Note this function has been optimized quite a bit. Calls to the ST3
         # API has been left out on purpose as they are slower than the
         # alternative.
+        trace = self.view.terminal_view_trace
+        if trace is not None:
+            trace_start = trace.now()
 
+        scopes = self.view.terminal_view_color_scheme
         for idx, field in line_color_map.items():
             length = field["field_length"]
-            color_scope = "terminalview.%s_%s" % (field["color"][0], field["color"][1])
+            color_scope = scopes.scope(*field["color"])
 
             # Get text point where color should start
             line_start, _ = self._get_line_start_and_end_points(line_no)
@@ -327,6 +659,9 @@ class TerminalViewUpdate(sublime_plugin.TextCommand):
             self.view.add_regions(region_key, [buffer_region], color_scope, flags=flags)
             self._register_color_region(line_no, region_key)
 
+        if trace is not None:
+            trace.add("add_regions", trace_start, len(line_color_map))
+
     def _register_color_region(self, line_no, key):
         if line_no in self.view.terminal_view_color_regions:
             self.view.terminal_view_color_regions[line_no].appendleft(key)
@@ -360,18 +695,43 @@ class TerminalViewClear(sublime_plugin.TextCommand):
         self.view.set_read_only(True)
 
 
+def history_spill_dir(settings):
+    """
+    Directory the scrollback histories spill their oldest blocks to (see
+    terminal_view_scroll_history_spill_dir)
+    """
+    spill_dir = settings.get("terminal_view_scroll_history_spill_dir", "")
+    if not spill_dir:
+        spill_dir = os.path.join(sublime.cache_path(), "TerminalView")
+    return spill_dir
+
+
+# Color scheme with generated scopes shared by all terminal views
+_color_scheme_generator = None
+
+
 def set_color_scheme(view):
     """
-    Set color scheme for view
+    Set color scheme for view. Unless the user has their own color scheme a
+    scheme with scopes generated on demand for all colors is used.
     """
-    color_scheme = "Packages/TerminalView/TerminalView.hidden-tmTheme"
+    global _color_scheme_generator
 
     # Check if user color scheme exists
     try:
         sublime.load_resource("Packages/User/TerminalView.hidden-tmTheme")
-        color_scheme = "Packages/User/TerminalView.hidden-tmTheme"
+        color_scheme_name = "Packages/User/TerminalView.hidden-tmTheme"
+        if not isinstance(view.terminal_view_color_scheme, color_scheme.BasicColorScopes):
+            view.terminal_view_color_scheme = color_scheme.BasicColorScopes()
     except:
-        pass
+        if _color_scheme_generator is None:
+            path = os.path.join(sublime.packages_path(), "User", "TerminalView",
+                                "TerminalViewGenerated.hidden-tmTheme")
+            _color_scheme_generator = color_scheme.ColorSchemeGenerator(path)
+            _color_scheme_generator.flush()
+
+        color_scheme_name = "Packages/User/TerminalView/TerminalViewGenerated.hidden-tmTheme"
+        view.terminal_view_color_scheme = _color_scheme_generator
 
-    if view.settings().get('color_scheme') != color_scheme:
-        view.settings().set('color_scheme', color_scheme)
+    if view.settings().get('color_scheme') != color_scheme_name:
+        view.settings().set('color_scheme', color_scheme_name)
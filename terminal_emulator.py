@@ -1,22 +1,41 @@
 """
 Wrapper module for the Pyte terminal emulator
 """
-from collections import deque, namedtuple
-from itertools import islice
+import bisect
+from collections import namedtuple
+from itertools import islice, repeat
 import math
 
+from . import color_scheme
 from . import pyte
+from . import screen_state
+from . import scrollback
+from .pyte import charsets
+from .pyte import graphics
 from .pyte import modes
+from .pyte.screens import Char
+from .pyte.wcwidth import wcwidth
+from .scrollback import WrappedLine
+
+# Private modes switching to the alternate screen buffer (shifted like the
+# private modes in pyte.modes)
+ALTERNATE_SCREEN = 47 << 5
+ALTERNATE_SCREEN_CLEAR = 1047 << 5
+ALTERNATE_SCREEN_SAVE_CURSOR = 1049 << 5
+ALTERNATE_SCREEN_MODES = (ALTERNATE_SCREEN, ALTERNATE_SCREEN_CLEAR, ALTERNATE_SCREEN_SAVE_CURSOR)
+
+# Number of history lines reflowed per step after the screen width changed
+REFLOW_LINES_PER_STEP = 500
 
 
 class PyteTerminalEmulator():
     """
     Adapter for the pyte terminal emulator
     """
-    def __init__(self, cols, lines, history, ratio):
-        # Double history size due to pyte splitting it between two queues
-        # resulting in only having half the scrollback as expected
-        self._screen = CustomHistoryScreen(cols, lines, history * 2, ratio)
+    def __init__(self, cols, lines, history, ratio, compress_history=True,
+                 history_spill_dir=None, history_memory_limit=0):
+        self._screen = CustomHistoryScreen(cols, lines, history, ratio, compress_history,
+                                           history_spill_dir, history_memory_limit)
         self._bytestream = pyte.ByteStream()
         self._bytestream.attach(self._screen)
 
@@ -25,65 +44,176 @@ class PyteTerminalEmulator():
         self._bytestream.feed(data)
 
     def resize(self, lines, cols):
+        if lines == self._screen.lines and cols == self._screen.columns:
+            return
+
         self._screen.scroll_to_bottom()
         dirty_lines = max(lines, self._screen.lines)
         self._screen.dirty.update(range(dirty_lines))
         return self._screen.resize(lines, cols)
 
+    def prev_line(self):
+        self._screen.prev_line()
+
+    def next_line(self):
+        self._screen.next_line()
+
     def prev_page(self):
         self._screen.prev_page()
-        self._screen.ensure_screen_width()
 
     def next_page(self):
         self._screen.next_page()
-        self._screen.ensure_screen_width()
 
-    def dirty_lines(self):
+    def reflow_history(self, max_lines=REFLOW_LINES_PER_STEP):
+        return self._screen.reflow_history(max_lines)
+
+    def search(self, query, before=None):
+        return self._screen.search(query, before)
+
+    def scroll_to_line(self, line):
+        return self._screen.scroll_to_line(line)
+
+    def dirty_lines(self, lines=None):
+        """
+        Get the content of the dirty lines. If lines (e.g. a range) is given
+        only those lines are included, except for lines removed from the
+        screen.
+        """
         dirty_lines = {}
         nb_dirty_lines = len(self._screen.dirty)
         if nb_dirty_lines > 0:
-            display = self._screen.display
+            viewport = self._screen.viewport()
             for line in self._screen.dirty:
-                if line >= len(display):
+                if line >= len(viewport):
                     # This happens when screen is resized smaller
                     dirty_lines[line] = None
-                else:
-                    dirty_lines[line] = display[line]
+                elif lines is None or line in lines:
+                    dirty_lines[line] = "".join(char.data for char in viewport[line])
 
         return dirty_lines
 
-    def clear_dirty(self):
-        return self._screen.dirty.clear()
+    def clear_dirty(self, lines=None):
+        if lines is None:
+            return self._screen.dirty.clear()
+        return self._screen.dirty.difference_update(lines)
+
+    def write_grid(self, grid, all_lines=False):
+        """
+        Write the dirty lines of the viewport (or all lines) to a ScreenGrid
+        and clear them.
+
+        Returns:
+            int: The number of lines written.
+        """
+        viewport = self._screen.viewport()
+        lines = range(grid.lines) if all_lines else self._screen.dirty
+        lines = [line for line in lines if line < grid.lines]
+        for line in lines:
+            grid.write_line(line, viewport[line] if line < len(viewport) else ())
+        self._screen.dirty.clear()
+        return len(lines)
 
     def cursor(self):
+        """
+        Get the position of the cursor in the viewport as (row, column), or
+        None if the viewport is scrolled back so far that the cursor is below
+        it
+        """
         cursor = self._screen.cursor
         if cursor:
-            return (cursor.y, cursor.x)
+            # When scrolled back in history the cursor moves down with the
+            # screen contents
+            y = cursor.y + self._screen.scroll_offset
+            if y >= self._screen.lines:
+                return None
+            return (y, cursor.x)
 
         return (0, 0)
 
     def color_map(self, lines):
-        return convert_pyte_buffer_to_colormap(self._screen.buffer, lines)
+        return convert_pyte_buffer_to_colormap(self._screen.viewport(), lines)
 
     def display(self):
-        return self._screen.display
+        return ["".join(char.data for char in line) for line in self._screen.viewport()]
+
+    def screen_size(self):
+        return (self._screen.lines, self._screen.columns)
+
+    def history_size(self):
+        return len(self._screen.history)
+
+    def history_memory_usage(self):
+        return self._screen.history.memory_usage()
+
+    def history_disk_usage(self):
+        return self._screen.history.disk_usage()
+
+    def save_state(self, stream):
+        """
+        Write the complete state of the screen and the history to a binary
+        stream (see screen_state)
+        """
+        screen_state.write_state(self._screen, stream)
+
+    def load_state(self, stream):
+        screen_state.read_state(self._screen, stream)
+
+    def load_snapshot(self, stream):
+        """
+        Restore the screen and the history saved with save_state for a new
+        shell. Only the contents of the primary screen are kept and the cursor
+        is moved to the start of the next line so the output of the new shell
+        starts below the restored output.
+        """
+        screen_state.read_state(self._screen, stream)
+        self._screen.reset_program_state()
+        self._bytestream.feed(b"\r\n")
+
+    def close(self):
+        self._screen.cancel_history_reflow()
+        self._screen.history.close()
 
 
-History = namedtuple("History", "top bottom ratio size position")
 Margins = namedtuple("Margins", "top bottom")
 
 
 class CustomHistoryScreen(pyte.DiffScreen):
     """
-    Custom history screen customized for this plugin. Basically a copy of the
-    standard pyte history screen but with some optimizations.
+    Custom history screen customized for this plugin. Lines scrolled off the
+    top of the screen are kept in a single scrollback history and scrolling
+    is done by moving a read-only viewport offset into that history. The live
+    screen buffer is never touched when scrolling.
+
+    Full screen programs (vim, less, htop, etc.) draw on an alternate screen
+    buffer. The primary buffer is kept aside while the alternate screen is in
+    use and nothing scrolled off the alternate screen goes into the history.
+
+    Colors are stored as packed integers (see color_scheme) instead of color
+    names so 256 colors and 24 bit colors can be represented.
+
+    Lines that wrap because the text does not fit are stored as WrappedLine so
+    they can be rewrapped when the number of columns changes. The screen and
+    the newest history lines are reflowed right away, the rest of the history
+    is reflowed a few lines at a time by reflow_history.
     """
-    def __init__(self, columns, lines, history, ratio):
-        self.history = History(deque(maxlen=history // 2),
-                               deque(maxlen=history),
-                               float(ratio),
-                               history,
-                               history)
+    default_char = Char(data=" ", fg=color_scheme.DEFAULT, bg=color_scheme.DEFAULT)
+    default_line = repeat(default_char)
+
+    def __init__(self, columns, lines, history, ratio, compress_history=True,
+                 history_spill_dir=None, history_memory_limit=0):
+        self.history = scrollback.ScrollbackHistory(history, compress_history,
+                                                    history_spill_dir, history_memory_limit)
+        self.history_ratio = float(ratio)
+
+        # Reflow of the history lines older than the last width change
+        self._history_reflow = None
+
+        # Number of history lines the viewport is scrolled back (0 means the
+        # viewport shows the live screen)
+        self.scroll_offset = 0
+
+        # The primary buffer while the alternate screen is shown
+        self.primary_buffer = None
 
         super(CustomHistoryScreen, self).__init__(columns, lines)
 
@@ -91,132 +221,420 @@ class CustomHistoryScreen(pyte.DiffScreen):
         """
         Ensure a screen is at the bottom of the history buffer
         """
-        while self.history.position < self.history.size:
-            self.next_page()
+        if self.scroll_offset > 0:
+            self._set_scroll_offset(0)
 
-    def ensure_screen_width(self):
+    def prev_line(self):
         """
-        Ensure all lines on a screen have proper width columns. Extra characters
-        are truncated, missing characters are filled with whitespace.
+        Move the viewport one line up through the history buffer
         """
-        for idx, line in enumerate(self.buffer):
-            if len(line) > self.columns:
-                self.buffer[idx] = line[:self.columns]
-            elif len(line) < self.columns:
-                self.buffer[idx] = line + take(self.columns - len(line),
-                                               self.default_line)
+        self._set_scroll_offset(self.scroll_offset + 1)
 
-        # If we're at the bottom of the history buffer and `DECTCEM`
-        # mode is set -- show the cursor.
-        self.cursor.hidden = not (
-            abs(self.history.position - self.history.size) < self.lines and
-            modes.DECTCEM in self.mode
-        )
+    def next_line(self):
+        """
+        Move the viewport one line down through the history buffer
+        """
+        self._set_scroll_offset(self.scroll_offset - 1)
 
-    def reset_history(self):
-        self.history.top.clear()
-        self.history.bottom.clear()
-        self.history = self.history._replace(position=self.history.size)
+    def prev_page(self):
+        """
+        Move the viewport a page up through the history buffer
+        """
+        self._set_scroll_offset(self.scroll_offset + self._page_size())
 
-    def reset(self):
+    def next_page(self):
         """
-        Overloaded to reset screen history state: history position
-        is reset to bottom of both queues;  queues themselves are
-        emptied.
+        Move the viewport a page down through the history buffer
         """
-        super(CustomHistoryScreen, self).reset()
-        self.reset_history()
+        self._set_scroll_offset(self.scroll_offset - self._page_size())
 
-    def erase_in_display(self, how=0):
+    def search(self, query, before=None):
         """
-        Overloaded to reset history state
+        Search backwards through the screen and the history for the last line
+        before `before` that contains `query` (case insensitive). The history
+        is not searched while the alternate screen is shown.
+
+        Lines are numbered by the number of lines that went into the history
+        before them (history line i has number history.nb_dropped() + i), so
+        a line keeps its number when lines are added to or dropped from the
+        history between searches.
+
+        Returns:
+            tuple: (line, column) of the match or None if not found.
         """
-        super(CustomHistoryScreen, self).erase_in_display(how)
+        nb_dropped = self.history.nb_dropped()
+        first_screen_line = nb_dropped + len(self.history)
+        total = first_screen_line + self.lines
+        if before is None or before > total:
+            before = total
+
+        lower_query = query.lower()
+        for line in range(before - 1, first_screen_line - 1, -1):
+            text = "".join(char.data for char in self.buffer[line - first_screen_line])
+            column = text.lower().find(lower_query)
+            if column >= 0:
+                return (line, column)
+
+        if self.in_alternate_screen() or before <= nb_dropped:
+            return None
+
+        match = self.history.search(query, min(before, first_screen_line) - nb_dropped)
+        if match is None:
+            return None
+        return (match[0] + nb_dropped, match[1])
+
+    def scroll_to_line(self, line):
+        """
+        Move the viewport so the given line (numbered as in `search`) is
+        visible, preferably in the middle of the viewport.
 
-        if how == 3:
-            self.reset_history()
+        Returns:
+            int: The row of the viewport the line is shown in.
+        """
+        nb_history = len(self.history)
+        line = max(line - self.history.nb_dropped(), 0)
+        if line >= nb_history or self.in_alternate_screen():
+            self._set_scroll_offset(0)
+        else:
+            self._set_scroll_offset(nb_history - line + self.lines // 2)
 
-    def index(self):
+        return line - (nb_history - self.scroll_offset)
+
+    def viewport(self):
         """
-        Overloaded to update top history with the removed lines
+        Get the lines currently shown in the viewport. When scrolled back these
+        are a mix of history lines and the top of the live screen.
         """
-        top, bottom = self.margins
+        offset = self.scroll_offset
+        if offset == 0:
+            return self.buffer
 
-        if self.cursor.y == bottom:
-            self.history.top.append(self.buffer[top])
+        nb_history = len(self.history)
+        start = nb_history - offset
+        lines = self.history.get_lines(start, start + self.lines)
+        lines = [self._fit_line(line) for line in lines]
+        if len(lines) < self.lines:
+            lines.extend(self.buffer[:self.lines - len(lines)])
 
-        super(CustomHistoryScreen, self).index()
+        return lines
 
-    def reverse_index(self):
+    def reset_history(self):
+        self.cancel_history_reflow()
+        self.history.clear()
+        self.scroll_offset = 0
+
+    def reflow_history(self, max_lines):
         """
-        Overloaded to update bottom history with the removed lines
+        Reflow up to max_lines of the history lines that still have the width
+        of before the last resize.
+
+        Returns:
+            bool: True if there are more lines to reflow.
         """
-        top, bottom = self.margins
+        reflow = self._history_reflow
+        if reflow is None:
+            return False
 
-        if self.cursor.y == top:
-            self.history.bottom.append(self.buffer[bottom])
+        if not reflow.step(self.history, max_lines):
+            return True
 
-        super(CustomHistoryScreen, self).reverse_index()
+        self._history_reflow = None
+        self.history.close()
+        self.history = reflow.new_history
+        if self.scroll_offset > 0:
+            # The viewport shows different lines now
+            self.scroll_offset = min(self.scroll_offset, len(self.history))
+            self.dirty.update(range(self.lines))
 
-    def prev_page(self):
+        return False
+
+    def cancel_history_reflow(self):
+        if self._history_reflow is not None:
+            self._history_reflow.new_history.close()
+            self._history_reflow = None
+
+    def reset_program_state(self):
+        """
+        Keep the contents of the primary screen, the history and the cursor
+        position but reset everything else a program running in the terminal
+        may have changed: modes, margins, charsets, saved cursors and the
+        alternate screen.
+        """
+        if self.primary_buffer is not None:
+            self.buffer = self.primary_buffer
+            self.primary_buffer = None
+            # Put the cursor on the last line with content
+            y = self.lines - 1
+            while y > 0 and all(char == self.default_char for char in self.buffer[y]):
+                y = y - 1
+            self.cursor.y = y
+
+        self.scroll_offset = 0
+        self.mode = set([modes.DECAWM, modes.DECTCEM])
+        self.margins = Margins(0, self.lines - 1)
+        self.charset = 0
+        self.g0_charset = charsets.IBMPC_MAP
+        self.g1_charset = charsets.VT100_MAP
+        self.tabstops = set(range(7, self.columns, 8))
+        self.savepoints = []
+        self.cursor.attrs = self.default_char
+        self.cursor.hidden = False
+        self.dirty.update(range(self.lines))
+
+    def in_alternate_screen(self):
+        return self.primary_buffer is not None
+
+    def set_mode(self, *modes, **kwargs):
+        """
+        Overloaded to switch to the alternate screen buffer
+        """
+        super(CustomHistoryScreen, self).set_mode(*modes, **kwargs)
+        if not kwargs.get("private"):
+            return
+
+        for mode in modes:
+            mode = mode << 5
+            if mode in ALTERNATE_SCREEN_MODES and not self.in_alternate_screen():
+                if mode == ALTERNATE_SCREEN_SAVE_CURSOR:
+                    self.save_cursor()
+                alternate_buffer = [take(self.columns, self.default_line)
+                                    for _ in range(self.lines)]
+                self.primary_buffer = self._switch_buffer(alternate_buffer)
+
+    def reset_mode(self, *modes, **kwargs):
         """
-        Move the screen page up through the history buffer
+        Overloaded to switch back to the primary screen buffer
         """
-        if self.history.position > self.lines and self.history.top:
-            mid = min(len(self.history.top),
-                      int(math.ceil(self.lines * self.history.ratio)))
+        super(CustomHistoryScreen, self).reset_mode(*modes, **kwargs)
+        if not kwargs.get("private"):
+            return
+
+        for mode in modes:
+            mode = mode << 5
+            if mode in ALTERNATE_SCREEN_MODES and self.in_alternate_screen():
+                primary_buffer = self.primary_buffer
+                self.primary_buffer = None
+                self._switch_buffer(primary_buffer)
+                if mode == ALTERNATE_SCREEN_SAVE_CURSOR:
+                    self.restore_cursor()
 
-            self.history.bottom.extendleft(reversed(self.buffer[-mid:]))
-            self.history = self.history \
-                ._replace(position=self.history.position - self.lines)
+    def reset(self):
+        """
+        Overloaded to reset screen history state: history position is reset to
+        the bottom and the history itself is emptied. The screen is switched
+        back to the primary buffer.
+        """
+        if self.primary_buffer is not None:
+            self.buffer = self.primary_buffer
+            self.primary_buffer = None
 
-            self.buffer[:] = list(reversed([
-                self.history.top.pop() for _ in range(mid)
-            ])) + self.buffer[:-mid]
+        super(CustomHistoryScreen, self).reset()
+        self.cursor.attrs = self.default_char
+        self.reset_history()
 
-            self.dirty = set(range(self.lines))
+    def select_graphic_rendition(self, *attrs):
+        """
+        Overloaded to support the bright colors, 256 colors (38;5;n and
+        48;5;n) and 24 bit colors (38;2;r;g;b and 48;2;r;g;b)
+        """
+        replace = {}
+        attrs = attrs or (0, )
+        i = 0
+        while i < len(attrs):
+            attr = attrs[i]
+            i = i + 1
+            if 30 <= attr <= 37:
+                replace["fg"] = color_scheme.INDEXED | (attr - 30)
+            elif 40 <= attr <= 47:
+                replace["bg"] = color_scheme.INDEXED | (attr - 40)
+            elif 90 <= attr <= 97:
+                replace["fg"] = color_scheme.INDEXED | (attr - 82)
+            elif 100 <= attr <= 107:
+                replace["bg"] = color_scheme.INDEXED | (attr - 92)
+            elif attr == 39:
+                replace["fg"] = color_scheme.DEFAULT
+            elif attr == 49:
+                replace["bg"] = color_scheme.DEFAULT
+            elif attr == 38 or attr == 48:
+                (color, i) = parse_extended_color(attrs, i)
+                if color is None:
+                    # The rest of the attributes can not be interpreted
+                    break
+                replace["fg" if attr == 38 else "bg"] = color
+            elif attr in graphics.TEXT:
+                attr = graphics.TEXT[attr]
+                replace[attr[1:]] = attr.startswith("+")
+            elif not attr:
+                replace = self.default_char._asdict()
+
+        self.cursor.attrs = self.cursor.attrs._replace(**replace)
+
+    def wrap_line(self, y):
+        """
+        Overloaded to mark lines that wrap
+        """
+        self._set_wrapped(y, True)
 
-    def next_page(self):
+    def erase_in_line(self, how=0, private=False):
+        """
+        Overloaded to unmark wrapped lines that are erased to the end
+        """
+        super(CustomHistoryScreen, self).erase_in_line(how, private)
+
+        if how == 0 or how == 2:
+            self._set_wrapped(self.cursor.y, False)
+
+    def erase_in_display(self, how=0):
+        """
+        Overloaded to reset history state and unmark erased wrapped lines
+        """
+        super(CustomHistoryScreen, self).erase_in_display(how)
+
+        if how == 0:
+            erased = range(self.cursor.y, self.lines)
+        elif how == 2:
+            erased = range(self.lines)
+        else:
+            erased = ()
+        for y in erased:
+            self._set_wrapped(y, False)
+
+        if how == 3:
+            self.reset_history()
+
+    def index(self):
         """
-        Move the screen page down through the history buffer
+        Overloaded to update history with the removed lines
         """
-        if self.history.position < self.history.size and self.history.bottom:
-            mid = min(len(self.history.bottom),
-                      int(math.ceil(self.lines * self.history.ratio)))
+        top, bottom = self.margins
 
-            self.history.top.extend(self.buffer[:mid])
-            self.history = self.history \
-                ._replace(position=self.history.position + self.lines)
+        if self.cursor.y == bottom and self.primary_buffer is None:
+            self.history.append(self.buffer[top])
 
-            self.buffer[:] = self.buffer[mid:] + [
-                self.history.bottom.popleft() for _ in range(mid)
-            ]
+        super(CustomHistoryScreen, self).index()
 
-            self.dirty = set(range(self.lines))
+    def _set_wrapped(self, y, wrapped):
+        line = self.buffer[y]
+        if isinstance(line, WrappedLine) != wrapped:
+            self.buffer[y] = WrappedLine(line) if wrapped else list(line)
+
+    def _page_size(self):
+        return max(int(math.ceil(self.lines * self.history_ratio)), 1)
+
+    def _switch_buffer(self, buffer):
+        """
+        Show the given buffer instead of the current one and return the
+        current one. Only the lines that differ between the two buffers are
+        marked dirty.
+        """
+        self.scroll_to_bottom()
+        previous_buffer = self.buffer
+        self.buffer = buffer
+        for (y, (old, new)) in enumerate(zip(previous_buffer, buffer)):
+            if old != new:
+                self.dirty.add(y)
+
+        return previous_buffer
+
+    def _set_scroll_offset(self, offset):
+        # The history belongs to the primary screen
+        if self.primary_buffer is not None:
+            offset = 0
+
+        offset = min(max(offset, 0), len(self.history))
+        if offset != self.scroll_offset:
+            self.scroll_offset = offset
+            self.dirty.update(range(self.lines))
+
+    def _fit_line(self, line):
+        # History lines keep the width they had when they left the screen so
+        # truncate or pad them to the current screen width
+        if len(line) > self.columns:
+            return line[:self.columns]
+        elif len(line) < self.columns:
+            return line + take(self.columns - len(line), self.default_line)
+
+        return line
 
     def resize(self, lines=None, columns=None):
         lines = lines or self.lines
         columns = columns or self.columns
 
+        if columns != self.columns and self.primary_buffer is None:
+            self._reflow(lines, columns)
+        else:
+            # Full screen programs redraw the alternate screen themselves
+            self._resize_buffer(self.buffer, lines, columns)
+        if self.primary_buffer is not None:
+            # The primary screen is resized as well so it fits when switching
+            # back to it
+            self._resize_buffer(self.primary_buffer, lines, columns)
+
+        self.lines, self.columns = lines, columns
+        self.margins = Margins(0, self.lines - 1)
+
+        # JW tweak - move cursor upwards if its out of bounds do not reset it
+        self.ensure_bounds(use_margins=True)
+
+    def _reflow(self, lines, columns):
+        """
+        Rewrap the screen and the newest history lines to the new number of
+        columns. Lines scrolled off the top by the reflow go into the history
+        and history lines are pulled back onto the screen when there is room.
+        The older history is reflowed later by reflow_history.
+        """
+        self.cancel_history_reflow()
+        history = self.history
+
+        # Take the history lines right above the screen including the start of
+        # a logical line that continues on the screen
+        nb_history = min(lines, len(history))
+        while nb_history < min(4 * lines, len(history)) and \
+                isinstance(history[-nb_history - 1], WrappedLine):
+            nb_history = nb_history + 1
+        history_lines = history.pop_lines(nb_history)
+
+        # Blank lines below the cursor are not content
+        last = self.lines - 1
+        while last > self.cursor.y and all(char == self.default_char for char in self.buffer[last]):
+            last = last - 1
+
+        cursor = (len(history_lines) + self.cursor.y, self.cursor.x)
+        (reflowed, (y, x)) = reflow_lines(history_lines + self.buffer[:last + 1], columns,
+                                          self.default_char, cursor)
+
+        if len(history) > 0:
+            self._history_reflow = scrollback.HistoryReflow(history, columns, self.default_char)
+
+        nb_scrolled = max(len(reflowed) - lines, 0)
+        for line in reflowed[:nb_scrolled]:
+            history.append(line)
+
+        self.buffer[:] = reflowed[nb_scrolled:]
+        self.buffer.extend(take(columns, self.default_line)
+                           for _ in range(lines - len(self.buffer)))
+        self.cursor.y = y - nb_scrolled
+        self.cursor.x = x
+
+    def _resize_buffer(self, buffer, lines, columns):
         # First resize the lines:
         line_diff = self.lines - lines
 
         # a) if the current display size is less than the requested
         #    size, add lines to the bottom.
         if line_diff < 0:
-            self.buffer.extend(take(self.columns, self.default_line)
-                               for _ in range(line_diff, 0))
+            buffer.extend(take(self.columns, self.default_line)
+                          for _ in range(line_diff, 0))
         # b) if the current display size is greater than requested
         #    size, take lines off the top.
         elif line_diff > 0:
             # JW tweak - if we only have spaces in the bottom of the screen
             # remove those lines instead
-            disp = self.display[-line_diff:]
-            contents = "".join(disp)
+            contents = "".join(char.data for line in buffer[-line_diff:] for char in line)
             if contents.isspace():
-                self.buffer[-line_diff:] = ()
+                buffer[-line_diff:] = ()
             else:
-                self.buffer[:line_diff] = ()
+                buffer[:line_diff] = ()
 
         # Then resize the columns:
         col_diff = self.columns - columns
@@ -225,18 +643,99 @@ class CustomHistoryScreen(pyte.DiffScreen):
         #    size, expand each line to the new size.
         if col_diff < 0:
             for y in range(lines):
-                self.buffer[y].extend(take(abs(col_diff), self.default_line))
+                buffer[y].extend(take(abs(col_diff), self.default_line))
         # b) if the current display size is greater than requested
         #    size, trim each line from the right to the new size.
         elif col_diff > 0:
-            for line in self.buffer:
+            for line in buffer:
                 del line[columns:]
 
-        self.lines, self.columns = lines, columns
-        self.margins = Margins(0, self.lines - 1)
 
-        # JW tweak - move cursor upwards if its out of bounds do not reset it
-        self.ensure_bounds(use_margins=True)
+def reflow_lines(lines, columns, default_char, cursor=None):
+    """
+    Rewrap lines to a new number of columns. A line together with the wrapped
+    lines before it forms a logical line, which is split again into lines of
+    the new width. Blanks at the end of logical lines are dropped.
+
+    Args:
+        cursor: (y, x) position in lines to keep track of or None.
+
+    Returns:
+        tuple: (reflowed lines, (y, x) position of the cursor in them or None)
+    """
+    reflowed = []
+    new_cursor = None
+    logical_line = []
+    cursor_offset = None
+    last = len(lines) - 1
+    for (y, line) in enumerate(lines):
+        if cursor is not None and y == cursor[0]:
+            cursor_offset = len(logical_line) + cursor[1]
+
+        logical_line.extend(line)
+        if y < last and isinstance(line, WrappedLine):
+            continue
+
+        # Keep the blanks the cursor is on
+        end = len(logical_line)
+        min_end = cursor_offset or 0
+        while end > min_end and logical_line[end - 1] == default_char:
+            end = end - 1
+        del logical_line[end:]
+
+        first = len(reflowed)
+        starts = wrap_line(logical_line, columns, default_char, reflowed)
+        if cursor_offset is not None:
+            row = bisect.bisect_right(starts, cursor_offset) - 1
+            new_cursor = (first + row, cursor_offset - starts[row])
+            cursor_offset = None
+
+        logical_line = []
+
+    return (reflowed, new_cursor)
+
+
+def wrap_line(chars, columns, default_char, lines):
+    """
+    Split a logical line into lines of the given number of columns and add
+    them to lines. A wide character is never split from its stub.
+
+    Returns:
+        list: Offset in chars of the start of each line.
+    """
+    starts = []
+    start = 0
+    while True:
+        starts.append(start)
+        end = start + columns
+        if end >= len(chars):
+            line = chars[start:]
+            line.extend(repeat(default_char, columns - len(line)))
+            lines.append(line)
+            return starts
+
+        if columns > 1 and wcwidth(chars[end - 1].data) > 1:
+            end = end - 1
+        line = WrappedLine(chars[start:end])
+        line.extend(repeat(default_char, columns - len(line)))
+        lines.append(line)
+        start = end
+
+
+def parse_extended_color(attrs, i):
+    """
+    Parse the color of an extended color attribute (38 or 48) starting at
+    attrs[i].
+
+    Returns:
+        tuple: (packed color or None if invalid, index of the next attribute)
+    """
+    if i < len(attrs) and attrs[i] == 5 and i + 1 < len(attrs):
+        return (color_scheme.indexed(attrs[i + 1]), i + 2)
+    elif i < len(attrs) and attrs[i] == 2 and i + 3 < len(attrs):
+        return (color_scheme.rgb(attrs[i + 1], attrs[i + 2], attrs[i + 3]), i + 4)
+
+    return (None, len(attrs))
 
 
 def take(n, iterable):
@@ -248,6 +747,9 @@ def convert_pyte_buffer_to_colormap(buffer, lines):
     """
     Convert a pyte buffer to a simple colors
     """
+    default_bg = color_scheme.DEFAULT_BG
+    default_fg = color_scheme.DEFAULT_FG
+
     color_map = {}
     for line_index in lines:
         # There may be lines outside the buffer after terminal was resized.
@@ -255,70 +757,48 @@ def convert_pyte_buffer_to_colormap(buffer, lines):
         if line_index > len(buffer) - 1:
             break
 
-        # Get line and process all colors on that. If there are multiple
-        # continuous fields with same color we want to combine them for
-        # optimization and because it looks better when rendered in ST3.
-        line = buffer[line_index]
-        line_len = len(line)
-        if line_len == 0:
-            continue
+        # Colors are packed integers where the default color is 0
+        line_colors = line_color_map((char.fg or default_fg, char.bg or default_bg, char.bold)
+                                     if char.reverse else
+                                     (char.bg or default_bg, char.fg or default_fg, char.bold)
+                                     for char in buffer[line_index])
+        if line_colors:
+            color_map[line_index] = line_colors
 
-        # Initialize vars to keep track of continuous colors
-        last_bg = line[0].bg
-        if last_bg == "default":
-            last_bg = "black"
+    return color_map
 
-        last_fg = line[0].fg
-        if last_fg == "default":
-            last_fg = "white"
 
-        if line[0].reverse:
-            last_color = (last_fg, last_bg)
+def line_color_map(colors):
+    """
+    Get the color map of a line from the (background, foreground, bold) color
+    of each of its characters, with colors packed as in color_scheme and
+    defaults resolved
+    """
+    default_color = (color_scheme.DEFAULT_BG, color_scheme.DEFAULT_FG, False)
+
+    # If there are multiple continuous fields with same color we want to
+    # combine them for optimization and because it looks better when rendered
+    # in ST3.
+    line_colors = {}
+    last_color = None
+    last_index = 0
+    field_length = 0
+    char_index = 0
+    for color in colors:
+        if last_color == color:
+            field_length = field_length + 1
         else:
-            last_color = (last_bg, last_fg)
-
-        last_index = 0
-        field_length = 0
+            if last_color is not None and last_color != default_color:
+                line_colors[last_index] = {"color": last_color, "field_length": field_length}
 
-        char_index = 0
-        for char in line:
-            # Default bg is black
-            if char.bg is "default":
-                bg = "black"
-            else:
-                bg = char.bg
+            last_color = color
+            last_index = char_index
+            field_length = 1
 
-            # Default fg is white
-            if char.fg is "default":
-                fg = "white"
-            else:
-                fg = char.fg
+        char_index = char_index + 1
 
-            if char.reverse:
-                color = (fg, bg)
-            else:
-                color = (bg, fg)
-
-            if last_color == color:
-                field_length = field_length + 1
-            else:
-                color_dict = {"color": last_color, "field_length": field_length}
+    # The last field runs to the end of the line
+    if last_color is not None and last_color != default_color:
+        line_colors[last_index] = {"color": last_color, "field_length": field_length}
 
-                if last_color != ("black", "white"):
-                    if line_index not in color_map:
-                        color_map[line_index] = {}
-                    color_map[line_index][last_index] = color_dict
-
-                last_color = color
-                last_index = char_index
-                field_length = 1
-
-            # Check if last color was active to the end of screen
-            if last_color != ("black", "white"):
-                color_dict = {"color": last_color, "field_length": field_length}
-                if line_index not in color_map:
-                    color_map[line_index] = {}
-                color_map[line_index][last_index] = color_dict
-
-            char_index = char_index + 1
-    return color_map
+    return line_colors
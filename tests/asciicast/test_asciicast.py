@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from TerminalView import asciicast
+from TerminalView import terminal_emulator
+
+
+class asciicast_format(unittest.TestCase):
+    def setUp(self):
+        (handle, self.path) = tempfile.mkstemp(suffix=".cast")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_export_import(self):
+        writer = asciicast.AsciicastWriter(self.path, width=10, height=3)
+        writer.record_output(b"line 1\r\n")
+        # Multi byte character split across two chunks
+        writer.record_output("æ".encode("utf-8")[:1])
+        writer.record_output("æ".encode("utf-8")[1:] + b"x")
+        writer.record_input(b"q")
+        writer.record_resize(3, 12)
+        writer.close()
+
+        with open(self.path) as cast_file:
+            header = json.loads(cast_file.readline())
+        self.assertEqual(header["version"], 2)
+        self.assertEqual(header["width"], 10)
+        self.assertEqual(header["height"], 3)
+
+        events = [(event, data) for (_, event, data) in asciicast.read_asciicast(self.path)]
+        self.assertEqual(events, [("o", "line 1\r\n"), ("o", "æx"), ("i", "q"),
+                                  ("r", "12x3")])
+
+        emulator = terminal_emulator.PyteTerminalEmulator(10, 3, 100, 0.5)
+        self.assertEqual(asciicast.replay_asciicast(self.path, emulator), (2, 11))
+
+        expected = terminal_emulator.PyteTerminalEmulator(10, 3, 100, 0.5)
+        expected.feed("line 1\r\næx".encode("utf-8"))
+        expected.resize(3, 12)
+        self.assertEqual(emulator.display(), expected.display())
+
+    def test_player(self):
+        with open(self.path, "w") as cast_file:
+            cast_file.write(json.dumps({"version": 2, "width": 80, "height": 24}) + "\n")
+            cast_file.write(json.dumps([0.0, "o", "first"]) + "\n")
+            cast_file.write(json.dumps([0.0, "i", "ignored"]) + "\n")
+            cast_file.write(json.dumps([0.0, "o", " second"]) + "\n")
+            cast_file.write(json.dumps([1000.0, "o", "much later"]) + "\n")
+
+        player = asciicast.AsciicastPlayer(self.path)
+        self.assertEqual(player.receive_output(4096), b"first second")
+        self.assertEqual(player.receive_output(4096), None)
+        self.assertTrue(player.is_running())
+
+        # Speed multiplier makes the last event due right away
+        player = asciicast.AsciicastPlayer(self.path, speed=1e9)
+        time.sleep(0.01)
+        self.assertEqual(player.receive_output(4096), b"first secondmuch later")
+        player.stop()
+        self.assertFalse(player.is_running())
+
+    def test_player_size(self):
+        with open(self.path, "w") as cast_file:
+            cast_file.write(json.dumps({"version": 2, "width": 10, "height": 3}) + "\n")
+            cast_file.write(json.dumps([0.0, "o", "small"]) + "\n")
+            cast_file.write(json.dumps([0.0, "r", "20x5"]) + "\n")
+            cast_file.write(json.dumps([0.0, "o", "large"]) + "\n")
+
+        sizes = []
+        player = asciicast.AsciicastPlayer(self.path, on_resize=lambda *size: sizes.append(size))
+        self.assertEqual(sizes, [(3, 10)])
+
+        # The output before the resize is returned first
+        self.assertEqual(player.receive_output(4096), b"small")
+        self.assertEqual(sizes, [(3, 10)])
+        self.assertEqual(player.receive_output(4096), b"large")
+        self.assertEqual(sizes, [(3, 10), (5, 20)])
+
+    def test_replay_size(self):
+        with open(self.path, "w") as cast_file:
+            cast_file.write(json.dumps({"version": 2, "width": 12, "height": 4}) + "\n")
+
+        emulator = terminal_emulator.PyteTerminalEmulator(80, 24, 100, 0.5)
+        asciicast.replay_asciicast(self.path, emulator)
+        self.assertEqual(emulator.screen_size(), (4, 12))
+
+    def test_invalid_file(self):
+        with open(self.path, "w") as cast_file:
+            cast_file.write(json.dumps({"version": 1}) + "\n")
+
+        with self.assertRaises(ValueError):
+            list(asciicast.read_asciicast(self.path))
@@ -0,0 +1,50 @@
+"""
+Synthetic keystroke to glyph latency benchmark. Keys are sent to a `cat`
+child process over a PTY and the echoed output is fed through the headless
+pipeline, measuring the time from sending a key until the frame rendering its
+echo has been drawn.
+"""
+import os
+import string
+
+from TerminalView import linux_pty
+from TerminalView import metrics
+
+from . import pipeline
+
+
+def run_echo_benchmark(nb_keys=500, lines=24, columns=80, timeout=2.0):
+    """
+    Type nb_keys characters into `cat` and measure the latency of each.
+
+    Returns:
+        Histogram: Keystroke to glyph latencies in milliseconds.
+    """
+    terminal = pipeline.HeadlessTerminal(lines, columns)
+    view_metrics = metrics.Metrics()
+    terminal.view.terminal_view_metrics = view_metrics
+
+    shell = linux_pty.LinuxPty(["cat"], os.getcwd())
+    try:
+        shell.update_screen_size(lines, columns)
+        keys = string.ascii_letters + string.digits
+        for i in range(nb_keys):
+            view_metrics.input_sent()
+            shell.send_keypress(keys[i % len(keys)])
+            if i % columns == columns - 1:
+                shell.send_keypress("enter")
+
+            # Poll and render like the main update loop until the key is echoed
+            latencies = view_metrics.histogram("keystroke_latency_ms")
+            nb_measured = latencies.count() if latencies is not None else 0
+            while view_metrics.histogram("keystroke_latency_ms") is None or \
+                    view_metrics.histogram("keystroke_latency_ms").count() == nb_measured:
+                data = shell.receive_output(4096, timeout)
+                if data is None:
+                    raise RuntimeError("No echo from cat within %.1f s" % timeout)
+                terminal.buffer.insert_data(data)
+                terminal.render()
+    finally:
+        shell.stop()
+
+    return view_metrics.histogram("keystroke_latency_ms")
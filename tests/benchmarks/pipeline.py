@@ -0,0 +1,163 @@
+"""
+Headless terminal pipeline for benchmarking. Bytes are fed through the
+ByteStream and CustomHistoryScreen of the terminal emulator and rendered with
+TerminalViewUpdate into a stub view, the same way the main update loop does.
+"""
+import time
+import tracemalloc
+
+# Import sublime stub
+import sublime
+
+from TerminalView import sublime_terminal_buffer
+from TerminalView import utils
+
+
+class SelectionStub(list):
+    def clear(self):
+        del self[:]
+
+    def add(self, region):
+        self.append(region)
+
+
+class HeadlessViewStub(sublime.SublimeViewStub):
+    """
+    View stub implementing the parts of the view API used when rendering,
+    without keeping any of the rendered content around
+    """
+    def __init__(self, id):
+        super().__init__(id)
+        self._selection = SelectionStub()
+        self._columns = 80
+
+    def sel(self):
+        return self._selection
+
+    def insert(self, edit, pt, str):
+        pass
+
+    def replace(self, edit, region, str):
+        pass
+
+    def erase(self, edit, region):
+        pass
+
+    def add_regions(self, key, regions, scope="", icon="", flags=0):
+        pass
+
+    def erase_regions(self, key):
+        pass
+
+    def set_viewport_position(self, xy, animate=True):
+        pass
+
+    def text_point(self, row, col):
+        return row * (self._columns + 1) + col
+
+
+class HeadlessTerminal():
+    """
+    A terminal view without Sublime Text and without a shell
+    """
+    def __init__(self, lines=24, columns=80):
+        self.view = HeadlessViewStub(1)
+        self._set_view_size(lines, columns)
+        self.buffer = sublime_terminal_buffer.SublimeTerminalBuffer(self.view, "benchmark",
+                                                                    utils.ConsoleLogger())
+        self.view.terminal_view_show_colors = True
+        self.buffer.update_terminal_size(lines, columns)
+        self._update_cmd = sublime_terminal_buffer.TerminalViewUpdate(self.view)
+
+    def feed(self, data):
+        self.view.terminal_view_emulator.feed(data)
+
+    def resize(self, lines, columns):
+        self._set_view_size(lines, columns)
+        self.buffer.update_terminal_size(lines, columns)
+
+    def _set_view_size(self, lines, columns):
+        # The whole terminal is visible
+        self.view._columns = columns
+        self.view.set_viewport_extent(((columns + 1) * self.view.em_width(),
+                                       lines * self.view.line_height()))
+
+    def render(self):
+        self._update_cmd.run(None)
+
+
+class BenchmarkResult():
+    def __init__(self, name, nb_bytes, nb_frames, parse_time, frame_times, alloc_per_frame):
+        self.name = name
+        self.nb_bytes = nb_bytes
+        self.nb_frames = nb_frames
+        self.parse_time = parse_time
+        self.frame_times = frame_times
+        self.alloc_per_frame = alloc_per_frame
+
+    def mb_per_second(self):
+        if self.parse_time == 0:
+            return 0.0
+        return self.nb_bytes / self.parse_time / (1024. * 1024.)
+
+    def ms_per_frame(self):
+        return sum(self.frame_times) / len(self.frame_times) * 1000.
+
+    def max_ms_per_frame(self):
+        return max(self.frame_times) * 1000.
+
+    def as_dict(self):
+        return {
+            "mb_per_second": self.mb_per_second(),
+            "ms_per_frame": self.ms_per_frame(),
+            "max_ms_per_frame": self.max_ms_per_frame(),
+            "alloc_kb_per_frame": self.alloc_per_frame / 1024.,
+        }
+
+
+def run_workload(name, chunks, lines=24, columns=80, alloc_frames=50):
+    """
+    Replay a workload through the full pipeline, rendering a frame after each
+    chunk like the main update loop does.
+
+    Args:
+        name (str): Workload name.
+        chunks (list): Workload byte stream split into the chunks to feed.
+        alloc_frames (int): Number of frames to measure allocations on. Memory
+                            tracing is slow so it is done in a separate pass.
+    """
+
+    terminal = HeadlessTerminal(lines, columns)
+    parse_time = 0.0
+    frame_times = []
+    for chunk in chunks:
+        start = time.perf_counter()
+        terminal.feed(chunk)
+        parse_time = parse_time + time.perf_counter() - start
+
+        start = time.perf_counter()
+        terminal.render()
+        frame_times.append(time.perf_counter() - start)
+
+    # Measure the memory allocated while rendering a frame
+    terminal = HeadlessTerminal(lines, columns)
+    allocated = 0
+    nb_measured = 0
+    tracemalloc.start()
+    try:
+        for chunk in chunks[:alloc_frames]:
+            terminal.feed(chunk)
+            tracemalloc.clear_traces()
+            before, _ = tracemalloc.get_traced_memory()
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            terminal.render()
+            _, peak = tracemalloc.get_traced_memory()
+            allocated = allocated + max(peak - before, 0)
+            nb_measured = nb_measured + 1
+    finally:
+        tracemalloc.stop()
+
+    nb_bytes = sum(len(chunk) for chunk in chunks)
+    return BenchmarkResult(name, nb_bytes, len(chunks), parse_time, frame_times,
+                           allocated / max(nb_measured, 1))
@@ -0,0 +1,40 @@
+"""
+Shell start up benchmark. Measures how long starting a process on a PTY
+blocks the caller and how long it takes until its first output arrives, for
+each way of starting the process.
+"""
+import os
+import time
+
+from TerminalView import linux_pty
+
+
+def run_spawn_benchmark(nb_spawns=50, backend=linux_pty.DEFAULT_SPAWN_BACKEND, timeout=2.0):
+    """
+    Start a shell printing a line nb_spawns times with the given spawn
+    backend.
+
+    Returns:
+        tuple: (mean ms spent starting the process, mean ms until the first
+               output was read)
+    """
+    spawn_time = 0
+    output_time = 0
+    for _ in range(nb_spawns):
+        start = time.perf_counter()
+        # The shell waits for input so it is still running when the output
+        # is read
+        shell = linux_pty.LinuxPty(["sh", "-c", "echo ready; read line"], os.path.expanduser("~"),
+                                   backend=backend)
+        spawned = time.perf_counter()
+        try:
+            if shell.receive_output(1024, timeout) is None:
+                raise RuntimeError("No output from the shell within %.1f s" % timeout)
+            done = time.perf_counter()
+        finally:
+            shell.stop()
+
+        spawn_time = spawn_time + spawned - start
+        output_time = output_time + done - start
+
+    return (spawn_time * 1000. / nb_spawns, output_time * 1000. / nb_spawns)
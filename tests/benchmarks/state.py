@@ -0,0 +1,68 @@
+"""
+Screen state serialization benchmark. Compares the time and size of
+serializing a terminal with a full history with screen_state against pickling
+the screen and history lines as lists of Char tuples.
+"""
+import pickle
+import time
+
+from TerminalView import screen_state
+from TerminalView import terminal_emulator
+
+
+def make_screen(nb_lines, lines=24, columns=80):
+    """
+    Create a screen with nb_lines lines of colored output in its history
+    """
+    screen = terminal_emulator.CustomHistoryScreen(columns, lines, nb_lines, 0.5)
+    stream = terminal_emulator.pyte.ByteStream()
+    stream.attach(screen)
+    for i in range(nb_lines + lines):
+        stream.feed(b"\x1b[1;34m%6i\x1b[0m drwxr-xr-x  2 user group 4096 \x1b[32mfile_%i.txt"
+                    b"\x1b[0m\r\n" % (i, i))
+    return screen
+
+
+def _pickled_state(screen):
+    history = screen.history.get_lines(0, len(screen.history))
+    return (screen.lines, screen.columns, screen.buffer, screen.primary_buffer, history,
+            screen.cursor, screen.mode, screen.margins, screen.tabstops, screen.charset,
+            screen.g0_charset, screen.g1_charset, screen.savepoints, screen.scroll_offset)
+
+
+def _mean_ms(function, nb_runs):
+    start = time.perf_counter()
+    for _ in range(nb_runs):
+        result = function()
+    return ((time.perf_counter() - start) * 1000. / nb_runs, result)
+
+
+def run_state_benchmark(nb_lines=10000, nb_runs=5):
+    """
+    Serialize and restore a screen with nb_lines history lines.
+
+    Returns:
+        dict: Mean milliseconds to save and to load and the size in bytes for
+              both screen_state and pickle.
+    """
+    screen = make_screen(nb_lines)
+
+    (save_ms, data) = _mean_ms(lambda: screen_state.dumps(screen), nb_runs)
+    restored = terminal_emulator.CustomHistoryScreen(80, 24, nb_lines, 0.5)
+    (load_ms, _) = _mean_ms(lambda: screen_state.loads(restored, data), nb_runs)
+
+    # Only the pickling is timed, not decoding the history lines. Pickling
+    # is slow enough that a single run is representative.
+    pickled_state = _pickled_state(screen)
+    (pickle_save_ms, pickled) = _mean_ms(
+        lambda: pickle.dumps(pickled_state, pickle.HIGHEST_PROTOCOL), 1)
+    (pickle_load_ms, _) = _mean_ms(lambda: pickle.loads(pickled), 1)
+
+    return {
+        "save_ms": save_ms,
+        "load_ms": load_ms,
+        "bytes": len(data),
+        "pickle_save_ms": pickle_save_ms,
+        "pickle_load_ms": pickle_load_ms,
+        "pickle_bytes": len(pickled),
+    }
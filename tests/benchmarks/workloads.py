@@ -0,0 +1,138 @@
+"""
+Fixed workloads for the benchmark suite. Each workload is a deterministic
+byte stream that mimics the output of a typical terminal program.
+"""
+import random
+
+from TerminalView import asciicast
+
+ESC = "\x1b"
+CSI = ESC + "["
+
+# Chunk size used when feeding the workloads (same as the max read size used
+# when polling the shell)
+CHUNK_SIZE = 4096
+
+
+def plain_text(nb_lines=20000):
+    """
+    Flood of plain text lines, e.g. cat of a big log file
+    """
+    rng = random.Random(1)
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing",
+             "elit", "sed", "do", "eiusmod", "tempor", "incididunt"]
+    lines = []
+    for i in range(nb_lines):
+        line = "%06i " % i + " ".join(rng.choice(words) for _ in range(10))
+        lines.append(line[:79])
+    return ("\r\n".join(lines) + "\r\n").encode("utf-8")
+
+
+def ls_color_recursive(nb_dirs=400):
+    """
+    Output of ls --color -R, with colored file names in columns
+    """
+    rng = random.Random(2)
+    kinds = [("01;34", "dir"), ("01;32", "run.sh"), ("00", "notes.txt"),
+             ("01;31", "archive.tar.gz"), ("01;36", "link"), ("00", "main.c")]
+    out = []
+    for d in range(nb_dirs):
+        out.append("./src/module_%i:\r\n" % d)
+        entries = []
+        for f in range(rng.randint(4, 24)):
+            color, name = rng.choice(kinds)
+            entries.append("%s%sm%s_%i%s0m" % (CSI, color, name, f, CSI))
+        for i in range(0, len(entries), 4):
+            out.append("  ".join(entries[i:i + 4]) + "\r\n")
+        out.append("\r\n")
+    return "".join(out).encode("utf-8")
+
+
+def top_redraw(nb_frames=300, lines=24, cols=80):
+    """
+    Full screen redraws at the same positions like top does, with a reverse
+    video header and a colored summary
+    """
+    rng = random.Random(3)
+    out = []
+    for frame in range(nb_frames):
+        out.append(CSI + "H")
+        out.append("top - 12:%02i:%02i up 3 days, load average: %.2f, %.2f, %.2f" %
+                   (frame // 60 % 60, frame % 60, rng.random(), rng.random(), rng.random()))
+        out.append(CSI + "K\r\n")
+        out.append("Tasks: %i total, %s%i running%s" % (200 + frame % 7, CSI + "1m", 1 + frame % 3,
+                                                        CSI + "0m"))
+        out.append(CSI + "K\r\n\r\n")
+        header = "  PID USER      PR  NI    VIRT    RES  %CPU %MEM     TIME+ COMMAND"
+        out.append(CSI + "7m" + header.ljust(cols) + CSI + "0m\r\n")
+        for row in range(lines - 5):
+            out.append("%5i user      20   0 %7i %6i %5.1f %4.1f   0:%02i.%02i process_%i" %
+                       (1000 + row, rng.randint(1000, 999999), rng.randint(100, 99999),
+                        rng.random() * 100, rng.random() * 10, row, frame % 100, row))
+            out.append(CSI + "K")
+            if row < lines - 6:
+                out.append("\r\n")
+    return "".join(out).encode("utf-8")
+
+
+def vim_scroll(nb_steps=1500, lines=24, cols=80):
+    """
+    Scrolling through a file in vim: the alternate screen, a scroll region
+    above the status line, delete/insert line scrolling and syntax colored
+    lines
+    """
+    rng = random.Random(4)
+    keywords = [("33", "def"), ("35", "return"), ("32", "'string'"), ("36", "None"),
+                ("34", "# comment")]
+    out = [CSI + "?1049h", CSI + "1;%ir" % (lines - 1), CSI + "H", CSI + "2J"]
+    for step in range(nb_steps):
+        # Scroll the region one line up and draw the new bottom line
+        out.append(CSI + "1;1H" + CSI + "M")
+        out.append(CSI + "%i;1H" % (lines - 1))
+        color, word = rng.choice(keywords)
+        line = "%5i     %s%sm%s%s0m value_%i = compute(%i)" % (
+            step, CSI, color, word, CSI, step, step * 7)
+        out.append(line + CSI + "K")
+
+        # Status line
+        out.append(CSI + "%i;1H" % lines)
+        out.append(CSI + "7m" + ("file.py  line %i" % step).ljust(cols - 1) + CSI + "0m")
+    out.append(CSI + "r" + CSI + "?1049l")
+    return "".join(out).encode("utf-8")
+
+
+def wide_cjk(nb_lines=4000):
+    """
+    Lines of wide CJK characters mixed with ASCII
+    """
+    rng = random.Random(5)
+    chars = [chr(c) for c in range(0x4e00, 0x4e00 + 500)]
+    lines = []
+    for i in range(nb_lines):
+        lines.append("%05i " % i + "".join(rng.choice(chars) for _ in range(35)))
+    return ("\r\n".join(lines) + "\r\n").encode("utf-8")
+
+
+WORKLOADS = [
+    ("plain_text", plain_text),
+    ("ls_color_recursive", ls_color_recursive),
+    ("top_redraw", top_redraw),
+    ("vim_scroll", vim_scroll),
+    ("wide_cjk", wide_cjk),
+]
+
+
+def chunks(data, size=CHUNK_SIZE):
+    """
+    Split a workload into the chunks that are fed to the emulator
+    """
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def asciicast_chunks(path):
+    """
+    Output of an asciicast v2 recording with its original chunking. Allows
+    public recordings to be used as benchmark workloads.
+    """
+    return [data.encode("utf-8") for (_, event, data) in asciicast.read_asciicast(path)
+            if event == "o"]
@@ -0,0 +1,80 @@
+import os
+import plistlib
+import shutil
+import tempfile
+import unittest
+
+from TerminalView import color_scheme
+from TerminalView.color_scheme import INDEXED, DEFAULT
+
+
+def load_scopes(path):
+    with open(path, "rb") as scheme_file:
+        scheme = plistlib.load(scheme_file)
+    return dict((entry["scope"], entry["settings"]) for entry in scheme["settings"]
+                if "scope" in entry)
+
+
+class colors(unittest.TestCase):
+    def test_palette(self):
+        self.assertEqual(color_scheme.to_hex(DEFAULT, background=True), "#000001")
+        self.assertEqual(color_scheme.to_hex(DEFAULT), "#ffffff")
+        self.assertEqual(color_scheme.to_hex(color_scheme.indexed(196)), "#ff0000")
+        self.assertEqual(color_scheme.to_hex(color_scheme.indexed(232)), "#080808")
+        self.assertEqual(color_scheme.to_hex(color_scheme.rgb(1, 2, 3)), "#010203")
+
+    def test_basic_scopes(self):
+        scopes = color_scheme.BasicColorScopes()
+        self.assertEqual(scopes.scope(INDEXED | 4, DEFAULT), "terminalview.blue_white")
+        # User schemes only have scopes for the 8 normal colors
+        self.assertEqual(scopes.scope(INDEXED | 9, INDEXED | 15), "terminalview.red_white")
+        # Closest normal color is used for other colors
+        self.assertEqual(scopes.scope(DEFAULT, color_scheme.rgb(250, 0, 0), True),
+                         "terminalview.black_red")
+        self.assertEqual(scopes.scope(DEFAULT, color_scheme.indexed(196)), "terminalview.black_red")
+
+
+class color_scheme_generator(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "User", "Generated.hidden-tmTheme")
+        self.scheduled = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_generate_scopes(self):
+        generator = color_scheme.ColorSchemeGenerator(self.path, flush_interval=0)
+        generator.flush()
+        scopes = load_scopes(self.path)
+        self.assertEqual(len(scopes), 1 + 16 * 16)
+
+        # Basic pairs are already in the scheme
+        self.assertEqual(generator.scope(INDEXED | 1, INDEXED | 2), "terminalview.red_green")
+        self.assertEqual(generator.pending(), 0)
+
+        scope = generator.scope(color_scheme.indexed(21), color_scheme.rgb(255, 128, 0), True)
+        self.assertEqual(scope, "terminalview.i21_xff8000_bold")
+        self.assertEqual(generator.scope(DEFAULT, DEFAULT, True), "terminalview.black_white_bold")
+        # Cached
+        generator.scope(color_scheme.indexed(21), color_scheme.rgb(255, 128, 0), True)
+        self.assertEqual(generator.pending(), 2)
+
+        generator.flush_if_needed(self.scheduled.append)
+        generator.flush_if_needed(self.scheduled.append)
+        self.assertEqual(self.scheduled, [generator.flush])
+        self.scheduled[0]()
+        self.assertEqual(generator.pending(), 0)
+
+        scopes = load_scopes(self.path)
+        self.assertEqual(scopes["terminalview.i21_xff8000_bold"],
+                         {"background": "#0000ff", "foreground": "#ff8000", "fontStyle": "bold"})
+        self.assertIn("terminalview.black_white_bold", scopes)
+
+    def test_rate_limit(self):
+        generator = color_scheme.ColorSchemeGenerator(self.path, flush_interval=60)
+        generator.flush()
+        generator.scope(DEFAULT, color_scheme.indexed(100))
+        generator.flush_if_needed(self.scheduled.append)
+        self.assertEqual(self.scheduled, [])
+        self.assertEqual(generator.pending(), 1)
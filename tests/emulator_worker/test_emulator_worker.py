@@ -0,0 +1,165 @@
+import io
+import os
+import signal
+import sys
+import time
+import unittest
+
+from TerminalView import emulator_worker
+from TerminalView import screen_grid
+from TerminalView import terminal_emulator
+
+
+def options(lines=5, columns=30):
+    return {"lines": lines, "columns": columns, "history": 100, "ratio": 0.5,
+            "compress": True, "spill_dir": None, "memory_limit": 0}
+
+
+class remote_emulator(unittest.TestCase):
+    def setUp(self):
+        self.emulator = emulator_worker.RemoteEmulator(None)
+        self.local = terminal_emulator.PyteTerminalEmulator(10, 3, 100, 0.5)
+        self.grids = []
+
+    def tearDown(self):
+        self.emulator.close()
+        for grid in self.grids:
+            grid.unlink()
+            grid.close()
+
+    def _publish(self, cursor=(0, 0), history=(0, 0, 0), output=(0, 0)):
+        (lines, columns) = self.local.screen_size()
+        if not self.grids or (self.grids[-1].lines, self.grids[-1].columns) != (lines, columns):
+            self.grids.append(screen_grid.create_grid(lines, columns))
+            self.local.write_grid(self.grids[-1], all_lines=True)
+        else:
+            self.local.write_grid(self.grids[-1])
+        self.emulator.apply_frame((lines, cursor, history, self.grids[-1].path, output))
+
+    def test_frames(self):
+        self.local.feed(b"ab\r\n\x1b[31mcd\x1b[0m")
+        self._publish((1, 2), (5, 100, 0))
+        self.assertEqual(self.emulator.dirty_lines(), {0: "ab" + " " * 8, 1: "cd" + " " * 8,
+                                                       2: " " * 10})
+        self.assertEqual(self.emulator.dirty_lines(range(1)), {0: "ab" + " " * 8})
+        self.assertEqual(self.emulator.cursor(), (1, 2))
+        self.assertEqual(self.emulator.history_size(), 5)
+        self.assertEqual(self.emulator.color_map([0, 1, 2]), self.local.color_map([0, 1, 2]))
+
+        self.emulator.clear_dirty([0, 2])
+        self.assertEqual(set(self.emulator.dirty_lines()), {1})
+        self.emulator.clear_dirty()
+        self.assertEqual(self.emulator.dirty_lines(), {})
+
+        self.local.feed(b"ef")
+        self._publish()
+        self.assertEqual(self.emulator.dirty_lines(), {1: "cdef" + " " * 6})
+
+    def test_output(self):
+        self._publish(output=(10, 0.5))
+        self._publish(output=(5, 0.25))
+        self.assertEqual(self.emulator.take_output(), (15, 0.75))
+        self.assertEqual(self.emulator.take_output(), (0, 0))
+
+    def test_row_changed_after_read(self):
+        self._publish()
+        self.emulator.dirty_lines()
+        self.local.feed(b"x")
+        self._publish()
+
+        # The row is shown with the text read before it changed
+        self.emulator.clear_dirty()
+        self.assertEqual(self.emulator.dirty_lines(), {0: "x" + " " * 9})
+
+    def test_removed_lines(self):
+        self._publish()
+        self.emulator.clear_dirty(self.emulator.dirty_lines())
+        self.local.resize(2, 10)
+        self._publish()
+        self.assertEqual(self.emulator.dirty_lines(range(0)), {2: None})
+        self.assertEqual(sorted(self.emulator.dirty_lines()), [0, 1, 2])
+        self.emulator.clear_dirty()
+        self.assertEqual(self.emulator.dirty_lines(), {})
+
+        # The new grid file was removed once it was opened
+        self.assertFalse(os.path.exists(self.grids[-1].path))
+
+
+class worker_process(unittest.TestCase):
+    def setUp(self):
+        self.client = emulator_worker.WorkerClient(["sh"], "/", sys.executable, options())
+        self.emulator = self.client.emulator()
+
+        # Wait for the prompt so typed text is not echoed before it
+        self._wait_for_output(lambda line: line.strip())
+        self.emulator.clear_dirty()
+
+    def tearDown(self):
+        self.client.stop()
+        self.assertFalse(self.client.is_running())
+
+    def _type(self, text):
+        for char in text:
+            self.client.send_keypress(char)
+        self.client.send_keypress("enter")
+
+    def _wait_for(self, text):
+        return self._wait_for_output(lambda line: text in line)
+
+    def _wait_for_output(self, match, timeout=5):
+        start = time.time()
+        while time.time() < start + timeout:
+            self.client.poll()
+            lines = self.emulator.dirty_lines()
+            if any(line is not None and match(line) for line in lines.values()):
+                return lines
+            time.sleep(0.01)
+        self.fail("Expected output not shown within %i seconds" % timeout)
+
+    def test_output(self):
+        self._type("printf '\\033[31mr''ed\\033[0m\\n'")
+        lines = self._wait_for("red")
+        line = [line for (line, text) in lines.items() if text.startswith("red")][0]
+        color_map = self.emulator.color_map([line])[line]
+        self.assertEqual(color_map[0]["field_length"], 3)
+        self.assertGreater(self.emulator.take_output()[0], 0)
+
+    def test_resize(self):
+        self.emulator.resize(3, 20)
+        self._type("stty size")
+        self._wait_for("3 20")
+        self.assertIsNotNone(self.emulator.search("size"))
+
+    def test_request_timeout(self):
+        self._type("echo fo''und")
+        self._wait_for("found")
+        # Stop the worker so it cannot answer in time
+        os.kill(self.client._process.pid, signal.SIGSTOP)
+        try:
+            with self.assertRaises(TimeoutError):
+                self.emulator.search("found")
+        finally:
+            os.kill(self.client._process.pid, signal.SIGCONT)
+
+        # The late response to the search is not taken for the next one
+        self.assertIsNone(self.emulator.search("not shown"))
+        self.assertIsNotNone(self.emulator.search("found"))
+
+    def test_save_state(self):
+        self._type("echo sav''ed")
+        self._wait_for("saved")
+        stream = io.BytesIO()
+        self.emulator.save_state(stream)
+        stream.seek(0)
+
+        local = terminal_emulator.PyteTerminalEmulator(10, 2, 100, 0.5)
+        local.load_state(stream)
+        self.assertTrue(any("saved" in line for line in local.display()))
+
+    def test_exit(self):
+        self._type("exit")
+        start = time.time()
+        while self.client.is_running() and time.time() < start + 5:
+            self.client.poll()
+            time.sleep(0.01)
+        self.assertFalse(self.client.is_running())
@@ -0,0 +1,39 @@
+import json
+import os
+import tempfile
+import unittest
+
+from TerminalView import event_trace
+
+
+class ring_buffer(unittest.TestCase):
+    def test_capacity(self):
+        trace = event_trace.EventTrace(3)
+        for i in range(5):
+            trace.add("feed", trace.now(), i)
+
+        self.assertEqual(len(trace), 3)
+        self.assertEqual([event[3] for event in trace.events()], [2, 3, 4])
+
+    def test_chrome_trace(self):
+        trace = event_trace.EventTrace(10)
+        start = trace.now()
+        trace.add("read", start, 4096)
+        trace.add("replace", trace.now(), 80)
+
+        (handle, path) = tempfile.mkstemp(suffix=".json")
+        os.close(handle)
+        try:
+            trace.dump(path)
+            with open(path) as trace_file:
+                data = json.load(trace_file)
+        finally:
+            os.remove(path)
+
+        events = data["traceEvents"]
+        self.assertEqual([event["name"] for event in events], ["read", "replace"])
+        self.assertEqual(events[0]["ph"], "X")
+        self.assertEqual(events[0]["args"], {"size": 4096})
+        self.assertAlmostEqual(events[0]["ts"], start * 1e6)
+        self.assertGreaterEqual(events[0]["dur"], 0)
+        self.assertLessEqual(events[0]["ts"], events[1]["ts"])
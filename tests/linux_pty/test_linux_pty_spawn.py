@@ -0,0 +1,70 @@
+"""
+Unittests for the ways LinuxPty can start the shell
+"""
+import os
+import signal
+import tempfile
+import time
+import unittest
+
+# Module to test
+from TerminalView import linux_pty
+
+
+def _read_output(shell, timeout=2):
+    data = b''
+    start = time.time()
+    while time.time() < start + timeout:
+        new_data = shell.receive_output(1024, timeout=0.1)
+        if new_data is not None:
+            data = data + new_data
+            if b"done" in data:
+                break
+    return data.decode("UTF-8")
+
+
+class spawn_backends(unittest.TestCase):
+    script = 'tty -s && echo "tty:$TERM:$(pwd -P)"; echo done; read line'
+
+    def _check_backend(self, backend):
+        cwd = os.path.realpath(tempfile.gettempdir())
+        shell = linux_pty.LinuxPty(["sh", "-c", self.script], cwd, 24, 80, backend=backend)
+        try:
+            self.assertTrue(shell.is_running())
+            output = _read_output(shell)
+        finally:
+            shell.stop()
+
+        self.assertFalse(shell.is_running())
+        self.assertIn("tty:linux:%s" % cwd, output)
+
+    def test_popen(self):
+        self._check_backend(linux_pty.SPAWN_POPEN)
+
+    @unittest.skipUnless(hasattr(os, "posix_spawn"), "posix_spawn needs Python 3.8")
+    def test_posix_spawn(self):
+        self._check_backend(linux_pty.SPAWN_POSIX_SPAWN)
+
+    @unittest.skipUnless(hasattr(os, "posix_spawn"), "posix_spawn needs Python 3.8")
+    def test_posix_spawn_program_name(self):
+        shell = linux_pty.LinuxPty("cat", None, backend=linux_pty.SPAWN_POSIX_SPAWN)
+        try:
+            self.assertTrue(shell.is_running())
+        finally:
+            shell.stop()
+
+    @unittest.skipUnless(hasattr(os, "posix_spawn"), "posix_spawn needs Python 3.8")
+    def test_posix_spawn_returncode(self):
+        shell = linux_pty.LinuxPty(["sh", "-c", "exit 3"], None,
+                                   backend=linux_pty.SPAWN_POSIX_SPAWN)
+        process = shell._process
+        start = time.time()
+        while shell.is_running() and time.time() < start + 5:
+            time.sleep(0.01)
+        shell.stop()
+        self.assertEqual(process.returncode, 3)
+
+        shell = linux_pty.LinuxPty("cat", None, backend=linux_pty.SPAWN_POSIX_SPAWN)
+        process = shell._process
+        shell.stop()
+        self.assertEqual(process.returncode, -signal.SIGKILL)
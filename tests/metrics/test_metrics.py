@@ -0,0 +1,87 @@
+import unittest
+
+from TerminalView import metrics
+
+
+class histograms(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = metrics.Histogram((1, 2, 5, 10))
+        for value in [0.5] * 50 + [1.5] * 40 + [4] * 9 + [100]:
+            histogram.record(value)
+
+        self.assertEqual(histogram.count(), 100)
+        self.assertEqual(histogram.percentile(50), 1)
+        self.assertEqual(histogram.percentile(90), 2)
+        self.assertEqual(histogram.percentile(99), 5)
+        # Overflow bucket reports the largest value
+        self.assertEqual(histogram.percentile(100), 100)
+        self.assertEqual(histogram.max(), 100)
+
+    def test_clamped_to_max(self):
+        histogram = metrics.Histogram((1, 10))
+        histogram.record(3)
+        self.assertEqual(histogram.percentile(50), 3)
+
+    def test_empty(self):
+        histogram = metrics.Histogram((1, 10))
+        self.assertEqual(histogram.percentile(99), 0)
+        self.assertEqual(histogram.mean(), 0)
+
+
+class view_metrics(unittest.TestCase):
+    def test_record(self):
+        view_metrics = metrics.Metrics()
+        view_metrics.count("bytes_read", 100)
+        view_metrics.count("bytes_read", 20)
+        view_metrics.record("dirty_lines_per_frame", 24)
+        start = view_metrics.start_timer()
+        view_metrics.stop_timer("parse_ms", start)
+
+        self.assertEqual(view_metrics.counter("bytes_read"), 120)
+        self.assertEqual(view_metrics.histogram("dirty_lines_per_frame").count(), 1)
+        self.assertEqual(view_metrics.histogram("parse_ms").count(), 1)
+
+        summary = view_metrics.summary()
+        self.assertEqual(summary[0], "bytes_read: 120")
+        self.assertEqual(len(summary), 3)
+
+    def test_disabled(self):
+        view_metrics = metrics.Metrics(enabled=False)
+        view_metrics.count("bytes_read", 100)
+        view_metrics.record("dirty_lines_per_frame", 24)
+        view_metrics.stop_timer("parse_ms", view_metrics.start_timer())
+
+        self.assertEqual(view_metrics.counter("bytes_read"), 0)
+        self.assertIsNone(view_metrics.histogram("parse_ms"))
+        self.assertEqual(view_metrics.summary(), [])
+
+
+class keystroke_latency(unittest.TestCase):
+    def test_echo_in_frame(self):
+        view_metrics = metrics.Metrics()
+        view_metrics.input_sent()
+        view_metrics.input_sent()
+
+        # No output yet so the frame does not contain the echo
+        view_metrics.frame_rendered()
+        self.assertIsNone(view_metrics.histogram("keystroke_latency_ms"))
+
+        view_metrics.output_received()
+        # Sent after the output so it waits for the next echo
+        view_metrics.input_sent()
+        view_metrics.frame_rendered()
+        self.assertEqual(view_metrics.histogram("keystroke_latency_ms").count(), 2)
+
+        view_metrics.output_received()
+        view_metrics.frame_rendered()
+        self.assertEqual(view_metrics.histogram("keystroke_latency_ms").count(), 3)
+
+    def test_no_echo(self):
+        view_metrics = metrics.Metrics()
+        view_metrics.input_sent()
+        view_metrics._pending_inputs[0] -= metrics.MAX_ECHO_DELAY + 1
+
+        view_metrics.output_received()
+        view_metrics.frame_rendered()
+        self.assertIsNone(view_metrics.histogram("keystroke_latency_ms"))
+        self.assertEqual(view_metrics.counter("keystrokes_without_echo"), 1)
@@ -0,0 +1,37 @@
+import os
+import pstats
+import tempfile
+import unittest
+
+from TerminalView import profiler
+
+
+def busy_function():
+    return sum(i * i for i in range(10000))
+
+
+class update_loop_profiler(unittest.TestCase):
+    def test_profile_and_dump(self):
+        loop_profiler = profiler.UpdateLoopProfiler(0)
+        for _ in range(3):
+            loop_profiler.start()
+            busy_function()
+            loop_profiler.stop()
+        self.assertTrue(loop_profiler.finished())
+
+        (handle, path) = tempfile.mkstemp(suffix=".pstats")
+        os.close(handle)
+        try:
+            summary = loop_profiler.dump(path)
+            stats = pstats.Stats(path)
+        finally:
+            os.remove(path)
+
+        self.assertIn("Profiled 3 iterations", summary)
+        self.assertIn("busy_function", summary)
+        functions = [function for (_, _, function) in stats.stats.keys()]
+        self.assertIn("busy_function", functions)
+
+    def test_not_finished(self):
+        loop_profiler = profiler.UpdateLoopProfiler(60)
+        self.assertFalse(loop_profiler.finished())
@@ -0,0 +1,75 @@
+"""
+Replay a recorded terminal session (see the terminal_view_record_sessions
+setting) or an asciicast v2 file (.cast) through the terminal emulator,
+optionally rendering every chunk into a headless view and profiling the
+replay.
+
+    python3 tests/replay_session.py session.tvrec
+    python3 tests/replay_session.py session.tvrec --render --profile replay.pstats
+    python3 tests/replay_session.py session.tvrec --realtime --speed 2
+"""
+import argparse
+import cProfile
+import sys
+import time
+from os.path import dirname, join, abspath
+
+
+def from_here(*parts):
+    return abspath(join(HERE, *parts))
+
+
+HERE = dirname(__file__)
+sys.path += [
+    from_here('..', '..'),
+    from_here('stubs'),
+    from_here('.')
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded TerminalView session")
+    parser.add_argument("session", help="Recorded session file")
+    parser.add_argument("--realtime", action="store_true",
+                        help="Replay with the original timing instead of as fast as possible")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Speed multiplier when replaying in realtime")
+    parser.add_argument("--render", action="store_true",
+                        help="Render a frame into a headless view after each chunk")
+    parser.add_argument("--profile", help="Profile the replay and write pstats to this file")
+    args = parser.parse_args()
+
+    from TerminalView import asciicast
+    from TerminalView import session_recorder
+    from TerminalView import terminal_emulator
+    from benchmarks import pipeline
+
+    on_output = None
+    if args.render:
+        terminal = pipeline.HeadlessTerminal()
+        on_output = terminal.render
+    else:
+        terminal = terminal_emulator.PyteTerminalEmulator(80, 24, 1000, 0.5)
+
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    start = time.perf_counter()
+    replay = session_recorder.replay_session
+    if args.session.endswith(".cast"):
+        replay = asciicast.replay_asciicast
+    (nb_chunks, nb_bytes) = replay(args.session, terminal, realtime=args.realtime,
+                                   speed=args.speed, on_output=on_output)
+    duration = time.perf_counter() - start
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+    print("Replayed %u chunks (%u bytes) in %.3f s" % (nb_chunks, nb_bytes, duration))
+
+
+if __name__ == '__main__':
+    main()
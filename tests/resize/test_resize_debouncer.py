@@ -0,0 +1,64 @@
+import unittest
+
+from TerminalView import resize
+
+
+class resize_debouncer(unittest.TestCase):
+    def setUp(self):
+        self.debouncer = resize.ResizeDebouncer(poll_interval=0.25, settle_time=0.15)
+        self.size = (24, 80)
+        self.nb_polls = 0
+
+    def _get_size(self):
+        self.nb_polls = self.nb_polls + 1
+        return self.size
+
+    def test_initial_size(self):
+        self.assertEqual(self.debouncer.update(self._get_size, now=0), (24, 80))
+        self.assertEqual(self.debouncer.size(), (24, 80))
+
+    def test_no_size_yet(self):
+        self.size = (0, 0)
+        self.assertIsNone(self.debouncer.update(self._get_size, now=0))
+        self.assertIsNone(self.debouncer.size())
+
+        self.size = (24, 80)
+        self.assertEqual(self.debouncer.update(self._get_size, now=0.25), (24, 80))
+
+        # The view losing its size later does not resize the terminal either
+        self.size = (0, 0)
+        self.assertIsNone(self.debouncer.update(self._get_size, now=0.5))
+        self.assertIsNone(self.debouncer.update(self._get_size, now=0.75))
+        self.assertEqual(self.debouncer.size(), (24, 80))
+
+    def test_polls_at_low_rate(self):
+        self.debouncer.update(self._get_size, now=0)
+        for i in range(1, 8):
+            self.assertIsNone(self.debouncer.update(self._get_size, now=i * 0.03))
+        self.assertEqual(self.nb_polls, 1)
+        self.debouncer.update(self._get_size, now=0.3)
+        self.assertEqual(self.nb_polls, 2)
+
+    def test_only_final_size_is_applied(self):
+        self.debouncer.update(self._get_size, now=0)
+
+        # Dragging changes the size every frame
+        now = 0.25
+        for columns in range(81, 90):
+            self.size = (24, columns)
+            self.assertIsNone(self.debouncer.update(self._get_size, now=now))
+            now = now + 0.03
+
+        # The size is applied once it has settled
+        self.assertIsNone(self.debouncer.update(self._get_size, now=now))
+        self.assertEqual(self.debouncer.update(self._get_size, now=now + 0.15), (24, 89))
+        self.assertIsNone(self.debouncer.update(self._get_size, now=now + 0.2))
+
+    def test_resize_back_to_same_size(self):
+        self.debouncer.update(self._get_size, now=0)
+        self.size = (30, 80)
+        self.assertIsNone(self.debouncer.update(self._get_size, now=0.25))
+        self.size = (24, 80)
+        self.assertIsNone(self.debouncer.update(self._get_size, now=0.28))
+        self.assertIsNone(self.debouncer.update(self._get_size, now=0.5))
+        self.assertEqual(self.debouncer.size(), (24, 80))
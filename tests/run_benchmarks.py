@@ -0,0 +1,157 @@
+"""
+Run the headless benchmark suite.
+
+Replays fixed workloads through the terminal emulator and view update code
+and reports parse throughput, frame times and memory allocated per frame. If
+a baseline file is given the run fails when a workload regresses by more than
+the tolerance.
+
+    python3 tests/run_benchmarks.py --save-baseline baseline.json
+    python3 tests/run_benchmarks.py --baseline baseline.json --tolerance 0.2
+    python3 tests/run_benchmarks.py --asciicast recording.cast
+    python3 tests/run_benchmarks.py --echo 500
+    python3 tests/run_benchmarks.py --spawn 50
+    python3 tests/run_benchmarks.py --state 10000
+"""
+import argparse
+import json
+import os
+import sys
+from os.path import dirname, join, abspath
+
+
+def from_here(*parts):
+    return abspath(join(HERE, *parts))
+
+
+HERE = dirname(__file__)
+sys.path += [
+    from_here('..', '..'),
+    from_here('stubs'),
+    from_here('.')
+]
+
+# Metrics where higher values are better, all others are better when lower
+HIGHER_IS_BETTER = ("mb_per_second", )
+
+
+def check_regressions(results, baseline, tolerance):
+    """
+    Compare results against a baseline and return a list of regressions
+    """
+    regressions = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+
+        for metric, value in metrics.items():
+            if metric not in baseline[name]:
+                continue
+
+            expected = baseline[name][metric]
+            if metric in HIGHER_IS_BETTER:
+                regressed = value < expected * (1.0 - tolerance)
+            else:
+                regressed = value > expected * (1.0 + tolerance)
+
+            if regressed:
+                regressions.append("%s %s: %.3f (baseline %.3f)" % (name, metric, value, expected))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TerminalView benchmark suite")
+    parser.add_argument("--baseline", help="JSON file with baseline results to compare against")
+    parser.add_argument("--save-baseline", help="Write the results to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative regression (default 0.25)")
+    parser.add_argument("--only", action="append", help="Only run the given workload(s)")
+    parser.add_argument("--asciicast", action="append", default=[],
+                        help="Add an asciicast v2 recording as a workload")
+    parser.add_argument("--echo", type=int, default=0, metavar="KEYS",
+                        help="Measure keystroke to glyph latency by typing KEYS keys into cat")
+    parser.add_argument("--spawn", type=int, default=0, metavar="COUNT",
+                        help="Measure process start up time over COUNT starts per spawn backend")
+    parser.add_argument("--state", type=int, default=0, metavar="LINES",
+                        help="Compare saving a screen with LINES history lines to pickle")
+    args = parser.parse_args()
+
+    from benchmarks import pipeline
+    from benchmarks import workloads
+
+    results = {}
+    row = "%-20s %10s %12s %12s %14s"
+    print(row % ("workload", "MB/s", "ms/frame", "max ms", "alloc KB/frame"))
+    all_workloads = [(name, lambda workload=workload: workloads.chunks(workload()))
+                     for name, workload in workloads.WORKLOADS]
+    for path in args.asciicast:
+        name = os.path.splitext(os.path.basename(path))[0]
+        all_workloads.append((name, lambda path=path: workloads.asciicast_chunks(path)))
+
+    for name, workload_chunks in all_workloads:
+        if args.only and name not in args.only:
+            continue
+
+        result = pipeline.run_workload(name, workload_chunks())
+        metrics = result.as_dict()
+        results[name] = metrics
+        print(row % (name, "%.3f" % metrics["mb_per_second"], "%.3f" % metrics["ms_per_frame"],
+                     "%.3f" % metrics["max_ms_per_frame"],
+                     "%.1f" % metrics["alloc_kb_per_frame"]))
+
+    if args.echo:
+        from benchmarks import echo
+
+        latencies = echo.run_echo_benchmark(args.echo)
+        results["echo"] = {
+            "p50_latency_ms": latencies.percentile(50),
+            "p99_latency_ms": latencies.percentile(99),
+        }
+        print("Keystroke to glyph latency over %i keys: p50 %.2f ms, p99 %.2f ms, max %.2f ms" %
+              (latencies.count(), latencies.percentile(50), latencies.percentile(99),
+               latencies.max()))
+
+    if args.spawn:
+        from benchmarks import spawn
+        from TerminalView import linux_pty
+
+        backends = [linux_pty.SPAWN_POPEN]
+        if linux_pty.DEFAULT_SPAWN_BACKEND == linux_pty.SPAWN_POSIX_SPAWN:
+            backends.append(linux_pty.SPAWN_POSIX_SPAWN)
+        for backend in backends:
+            (spawn_ms, output_ms) = spawn.run_spawn_benchmark(args.spawn, backend)
+            results["spawn_" + backend] = {"spawn_ms": spawn_ms, "first_output_ms": output_ms}
+            print("Starting a process with %s: %.2f ms blocked, first output after %.2f ms" %
+                  (backend, spawn_ms, output_ms))
+
+    if args.state:
+        from benchmarks import state
+
+        result = state.run_state_benchmark(args.state)
+        results["state"] = result
+        print("Screen state with %i history lines: save %.2f ms, load %.2f ms, %i KB" %
+              (args.state, result["save_ms"], result["load_ms"], result["bytes"] // 1024))
+        print("Pickled screen state: save %.2f ms, load %.2f ms, %i KB" %
+              (result["pickle_save_ms"], result["pickle_load_ms"], result["pickle_bytes"] // 1024))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = check_regressions(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions compared to baseline:")
+            for regression in regressions:
+                print("  " + regression)
+            sys.exit(1)
+
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import unittest
+
+from TerminalView import color_scheme
+from TerminalView import screen_grid
+from TerminalView import terminal_emulator
+
+
+class screen_grid_rows(unittest.TestCase):
+    def setUp(self):
+        self.emulator = terminal_emulator.PyteTerminalEmulator(8, 3, 100, 0.5)
+        self.grid = screen_grid.create_grid(3, 8)
+        self.reader = screen_grid.open_grid(self.grid.path)
+        self.grid.unlink()
+
+    def tearDown(self):
+        self.reader.close()
+        self.grid.close()
+
+    def _shown(self):
+        return [self.reader.generation(line) for line in range(self.reader.lines)]
+
+    def test_size(self):
+        self.assertEqual((self.reader.lines, self.reader.columns), (3, 8))
+        self.assertEqual(self.reader.changed_rows([None] * 3), [0, 1, 2])
+
+    def test_text(self):
+        self.emulator.feed("a中b\r\né".encode("utf-8"))
+        self.emulator.write_grid(self.grid, all_lines=True)
+        display = self.emulator.display()
+        self.assertEqual([self.reader.read_text(line)[1] for line in range(3)], display)
+
+    def test_changed_rows(self):
+        self.emulator.write_grid(self.grid)
+        shown = self._shown()
+        self.emulator.feed(b"a\r\nb\r\nx")
+        self.assertEqual(self.emulator.write_grid(self.grid), 3)
+        self.assertEqual(self.reader.changed_rows(shown), [0, 1, 2])
+
+        shown = self._shown()
+        self.emulator.feed(b"y")
+        self.assertEqual(self.emulator.write_grid(self.grid), 1)
+        self.assertEqual(self.reader.changed_rows(shown), [2])
+        (generation, text) = self.reader.read_text(2)
+        self.assertEqual(text, "xy" + " " * 6)
+        self.assertEqual(generation, self.reader.generation(2))
+        self.assertEqual(generation % 2, 0)
+
+    def test_color_map(self):
+        self.emulator.feed(b"\x1b[1;31mab\x1b[0m c\x1b[7;38;2;1;2;3md\x1b[0m\r\n\x1b[44mx")
+        self.emulator.write_grid(self.grid, all_lines=True)
+        for line in range(3):
+            self.assertEqual(self.reader.read_color_map(line)[1],
+                             self.emulator.color_map([line]).get(line, {}))
+
+        rgb = color_scheme.RGB | 0x010203
+        self.assertEqual(self.reader.read_color_map(0)[1][4]["color"],
+                         (rgb, color_scheme.DEFAULT_BG, False))
+
+    def test_not_a_grid(self):
+        with open(self.grid.path, "wb") as grid_file:
+            grid_file.write(b"\0" * screen_grid.grid_size(3, 8))
+        try:
+            self.assertRaises(ValueError, screen_grid.open_grid, self.grid.path)
+        finally:
+            self.grid.unlink()
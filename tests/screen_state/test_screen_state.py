@@ -0,0 +1,81 @@
+import io
+import unittest
+
+from TerminalView import screen_state
+from TerminalView import terminal_emulator
+from TerminalView.pyte import charsets
+
+
+def make_screen():
+    return terminal_emulator.CustomHistoryScreen(20, 6, 1000, 0.5)
+
+
+def feed(screen, data):
+    stream = terminal_emulator.pyte.ByteStream()
+    stream.attach(screen)
+    stream.feed(data)
+
+
+def screen_state_tuple(screen):
+    history = [screen.history[i] for i in range(len(screen.history))]
+    savepoints = [(savepoint.cursor.x, savepoint.cursor.y, savepoint.cursor.attrs, savepoint[1:])
+                  for savepoint in screen.savepoints]
+    return (screen.lines, screen.columns, screen.buffer, screen.primary_buffer, history,
+            screen.cursor.x, screen.cursor.y, screen.cursor.attrs, screen.cursor.hidden,
+            screen.mode, screen.margins, screen.tabstops, screen.charset, screen.g0_charset,
+            screen.g1_charset, savepoints, screen.scroll_offset)
+
+
+class state_roundtrip(unittest.TestCase):
+    def _restored(self, screen):
+        restored = terminal_emulator.CustomHistoryScreen(80, 24, 1000, 0.5)
+        screen_state.loads(restored, screen_state.dumps(screen))
+        return restored
+
+    def test_primary_screen(self):
+        screen = make_screen()
+        feed(screen, b"".join(b"\x1b[1;38;5;200mline\x1b[0m %i\r\n" % i for i in range(40)))
+        feed(screen, b"0123456789" * 3 + b"\x1b[?25l\x1b[2;5r\x1b[3g\x1b)0\x0e\x1b[44m")
+        screen.prev_page()
+
+        restored = self._restored(screen)
+        self.assertEqual(screen_state_tuple(restored), screen_state_tuple(screen))
+        self.assertEqual(restored.g1_charset, charsets.VT100_MAP)
+
+        # Both screens handle further output the same way
+        data = b"\x1b[Hmore\x1b[5;1H\n\n\x0fabc\x1b8"
+        feed(screen, data)
+        feed(restored, data)
+        self.assertEqual(screen_state_tuple(restored), screen_state_tuple(screen))
+
+    def test_alternate_screen(self):
+        screen = make_screen()
+        feed(screen, b"$ vim\r\n\x1b7\x1b[31m\x1b[?1049h\x1b[?1h\x1b[3;3Hedit")
+
+        restored = self._restored(screen)
+        self.assertEqual(screen_state_tuple(restored), screen_state_tuple(screen))
+        self.assertTrue(restored.in_alternate_screen())
+
+        feed(restored, b"\x1b[?1049l")
+        self.assertEqual(restored.display[0].rstrip(), "$ vim")
+
+    def test_stream(self):
+        screen = make_screen()
+        feed(screen, b"abc\r\n" * 10)
+        stream = io.BytesIO()
+        screen_state.write_state(screen, stream)
+        self.assertEqual(stream.getvalue(), bytes(screen_state.dumps(screen)))
+
+        stream.seek(0)
+        restored = make_screen()
+        screen_state.read_state(restored, stream)
+        self.assertEqual(screen_state_tuple(restored), screen_state_tuple(screen))
+
+    def test_invalid_state(self):
+        data = screen_state.dumps(make_screen())
+        with self.assertRaises(ValueError):
+            screen_state.loads(make_screen(), data[:-3])
+        with self.assertRaises(ValueError):
+            screen_state.loads(make_screen(), b"TVSTATE\xff" + data[8:])
+        with self.assertRaises(ValueError):
+            screen_state.loads(make_screen(), b"something else")
@@ -0,0 +1,338 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from TerminalView import scrollback
+from TerminalView.pyte.screens import Char
+
+
+def make_line(text, fg="default", bg="default", bold=False):
+    return [Char(data, fg=fg, bg=bg, bold=bold) for data in text]
+
+
+class history_store(unittest.TestCase):
+    def _check_roundtrip(self, compress):
+        history = scrollback.ScrollbackHistory(10000, compress)
+        lines = []
+        for i in range(scrollback.BLOCK_LINES * 3 + 10):
+            line = make_line("line %i " % i) + make_line("red", fg="red", bold=True)
+            line = line + make_line("", bg="blue") + make_line(" blue", bg="blue")
+            lines.append(line)
+            history.append(line)
+
+        # Empty lines must survive as well
+        lines.append([])
+        history.append([])
+
+        self.assertEqual(len(history), len(lines))
+        for i in (0, 1, scrollback.BLOCK_LINES - 1, scrollback.BLOCK_LINES,
+                  scrollback.BLOCK_LINES * 2 + 5, len(lines) - 2, len(lines) - 1):
+            self.assertEqual(history[i], lines[i])
+        self.assertEqual(history[-1], [])
+        self.assertEqual(history.get_lines(len(lines) - 3, len(lines) + 5), lines[-3:])
+
+    def test_roundtrip_compressed(self):
+        self._check_roundtrip(True)
+
+    def test_roundtrip_uncompressed(self):
+        self._check_roundtrip(False)
+
+    def test_history_size_limit(self):
+        size = scrollback.BLOCK_LINES + 20
+        history = scrollback.ScrollbackHistory(size)
+        for i in range(scrollback.BLOCK_LINES * 4):
+            history.append(make_line("%i" % i))
+
+        self.assertEqual(len(history), size)
+        first = scrollback.BLOCK_LINES * 4 - size
+        self.assertEqual(history[0], make_line("%i" % first))
+        self.assertEqual(history[-1], make_line("%i" % (scrollback.BLOCK_LINES * 4 - 1)))
+        with self.assertRaises(IndexError):
+            history[size]
+
+    def test_small_history(self):
+        history = scrollback.ScrollbackHistory(3)
+        for i in range(10):
+            history.append(make_line("%i" % i))
+        self.assertEqual(history.get_lines(0, 3), [make_line("7"), make_line("8"),
+                                                   make_line("9")])
+
+        history = scrollback.ScrollbackHistory(0)
+        history.append(make_line("ignored"))
+        self.assertEqual(len(history), 0)
+
+    def test_memory_usage(self):
+        history = scrollback.ScrollbackHistory(100000)
+        for i in range(scrollback.BLOCK_LINES * 10):
+            history.append(make_line(("line %i" % i).ljust(80)))
+
+        # Far less than a byte per cell once compressed
+        self.assertLess(history.memory_usage(), scrollback.BLOCK_LINES * 10 * 80)
+
+        history.clear()
+        self.assertEqual(len(history), 0)
+        self.assertEqual(history.memory_usage(), 0)
+
+
+class wrapped_lines(unittest.TestCase):
+    def test_wrapped_flag_roundtrip(self):
+        history = scrollback.ScrollbackHistory(10000)
+        for i in range(scrollback.BLOCK_LINES + 10):
+            line = make_line("%i" % i)
+            if i % 3 == 0:
+                line = scrollback.WrappedLine(line)
+            history.append(line)
+
+        for i in (0, 1, 3, scrollback.BLOCK_LINES - 1, scrollback.BLOCK_LINES + 2,
+                  scrollback.BLOCK_LINES + 9):
+            self.assertEqual(isinstance(history[i], scrollback.WrappedLine), i % 3 == 0)
+            self.assertEqual(history[i], make_line("%i" % i))
+
+    def test_pop_lines(self):
+        size = scrollback.BLOCK_LINES * 2 + 20
+        history = scrollback.ScrollbackHistory(size)
+        total = scrollback.BLOCK_LINES * 3
+        for i in range(total):
+            history.append(make_line("%i" % i))
+
+        # Pop across the hot lines and the last frozen block
+        count = scrollback.BLOCK_LINES + 5
+        lines = history.pop_lines(count)
+        self.assertEqual(lines, [make_line("%i" % i) for i in range(total - count, total)])
+        self.assertEqual(len(history), size - count)
+        self.assertEqual(history[-1], make_line("%i" % (total - count - 1)))
+        self.assertEqual(history[0], make_line("%i" % (total - size)))
+
+        history.append(make_line("new"))
+        self.assertEqual(history[-1], make_line("new"))
+        self.assertEqual(history.search("new"), (len(history) - 1, 0))
+        self.assertEqual(history.nb_dropped(), total - size)
+
+        # Popping more lines than available empties the history
+        self.assertEqual(len(history.pop_lines(size)), size - count + 1)
+        self.assertEqual(len(history), 0)
+
+
+class saved_history(unittest.TestCase):
+    def _saved(self, history):
+        stream = io.BytesIO()
+        history.save(stream)
+        stream.seek(0)
+        return stream
+
+    def _check_save_load(self, compress, load_compress):
+        history = scrollback.ScrollbackHistory(10000, compress)
+        lines = []
+        for i in range(scrollback.BLOCK_LINES * 3 + 10):
+            line = make_line("line %i " % i) + make_line("red", fg="red", bold=True)
+            if i % 3 == 0:
+                line = scrollback.WrappedLine(line)
+            lines.append(line)
+            history.append(line)
+
+        loaded = scrollback.ScrollbackHistory(10000, load_compress)
+        loaded.load(self._saved(history))
+        self.assertEqual(len(loaded), len(lines))
+        self.assertEqual(loaded.get_lines(0, len(lines)), lines)
+        self.assertIsInstance(loaded[3], scrollback.WrappedLine)
+
+        # Search filters are rebuilt for the loaded blocks
+        self.assertEqual(loaded.search("LINE 17 "), (17, 0))
+        self.assertEqual(loaded.search("line 9999"), None)
+
+        # New lines use the same attribute table
+        loaded.append(make_line("new", fg="red", bold=True))
+        self.assertEqual(loaded[-1], make_line("new", fg="red", bold=True))
+
+    def test_save_load(self):
+        self._check_save_load(True, True)
+
+    def test_save_load_other_compression(self):
+        self._check_save_load(True, False)
+        self._check_save_load(False, True)
+
+    def test_load_into_smaller_history(self):
+        history = scrollback.ScrollbackHistory(10000)
+        for i in range(scrollback.BLOCK_LINES * 2 + 5):
+            history.append(make_line("%i" % i))
+        history.append(make_line("last"))
+
+        loaded = scrollback.ScrollbackHistory(100)
+        loaded.load(self._saved(history))
+        self.assertEqual(len(loaded), 100)
+        self.assertEqual(loaded[0], history[len(history) - 100])
+        self.assertEqual(loaded[-1], make_line("last"))
+
+    def test_encode_lines(self):
+        history = scrollback.ScrollbackHistory(10)
+        lines = [make_line("abc", bg="blue"), [], scrollback.WrappedLine(make_line("d"))]
+        data = history.encode_lines(lines)
+        self.assertEqual(history.decode_lines(data), lines)
+        self.assertEqual(history.decode_lines(history.encode_lines([])), [])
+
+    def test_truncated(self):
+        history = scrollback.ScrollbackHistory(10000)
+        for i in range(scrollback.BLOCK_LINES + 1):
+            history.append(make_line("%i" % i))
+        data = self._saved(history).getvalue()
+        with self.assertRaises(ValueError):
+            scrollback.ScrollbackHistory(10000).load(io.BytesIO(data[:-10]))
+
+
+class history_search(unittest.TestCase):
+    def setUp(self):
+        self.history = scrollback.ScrollbackHistory(100000)
+        self.nb_lines = scrollback.BLOCK_LINES * 4 + 10
+        for i in range(self.nb_lines):
+            self.history.append(make_line("output line %i" % i))
+
+    def test_search(self):
+        # Match in a frozen block
+        self.assertEqual(self.history.search("LINE 17"), (179, 7))
+        self.assertEqual(self.history.search("line 17", before=179), (178, 7))
+        self.assertEqual(self.history.search("line 17 ", before=100), None)
+        self.assertEqual(self.history.search("line 17"[0:5], before=3), (2, 7))
+
+        # Match in the lines that have not been frozen yet
+        last = self.nb_lines - 1
+        self.assertEqual(self.history.search("line %i" % last), (last, 7))
+
+        self.assertEqual(self.history.search("not in history"), None)
+        self.assertEqual(self.history.search(""), None)
+
+    def test_search_after_lines_dropped(self):
+        history = scrollback.ScrollbackHistory(scrollback.BLOCK_LINES + 5)
+        for i in range(scrollback.BLOCK_LINES * 3):
+            history.append(make_line("output line %i" % i))
+
+        first = scrollback.BLOCK_LINES * 3 - len(history)
+        self.assertEqual(history.search("line %i" % first), (0, 7))
+        self.assertEqual(history.search("line %i" % (first - 1)), None)
+
+    def test_blocks_pruned(self):
+        history = scrollback.ScrollbackHistory(100000)
+        for i in range(scrollback.BLOCK_LINES * 20):
+            history.append(make_line("%i: build step %i finished in %i ms, see /tmp/log_%i" %
+                                     (i, i % 97, i * 7 % 1000, i)))
+        history.append(make_line("prompt"))
+
+        # Only the blocks that contain the query are decompressed
+        searched = []
+        block_texts = history._block_texts
+
+        def count_block_texts(block_no):
+            searched.append(block_no)
+            return block_texts(block_no)
+
+        history._block_texts = count_block_texts
+        self.assertEqual(history.search("/tmp/log_1234"), (1234, 44))
+        self.assertEqual(searched, [1234 // scrollback.BLOCK_LINES])
+
+        # Short queries use the filters as well
+        del searched[:]
+        self.assertEqual(history.search("Q"), None)
+        self.assertEqual(history.search("xy"), None)
+        self.assertEqual(searched, [])
+
+    def test_filters_saved(self):
+        history = scrollback.ScrollbackHistory(100000)
+        for i in range(scrollback.BLOCK_LINES * 2):
+            history.append(make_line("output line %i" % i))
+        stream = io.BytesIO()
+        history.save(stream)
+        stream.seek(0)
+
+        loaded = scrollback.ScrollbackHistory(100000)
+        loaded.load(stream)
+        self.assertEqual(list(loaded._block_filters), list(history._block_filters))
+        self.assertEqual(loaded.search("line 17"), (179, 7))
+
+
+class history_spill(unittest.TestCase):
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spill_dir)
+
+    def test_spill_roundtrip(self):
+        history = scrollback.ScrollbackHistory(100000, spill_dir=self.spill_dir,
+                                               memory_limit=0)
+        lines = []
+        for i in range(scrollback.BLOCK_LINES * 5 + 3):
+            line = make_line("line %i" % i, fg="green")
+            lines.append(line)
+            history.append(line)
+
+        # All frozen blocks are spilled so only the unfrozen lines and the search
+        # filters are resident
+        self.assertGreater(history.disk_usage(), 0)
+        filter_bytes = sum(len(block_filter) for block_filter in history._block_filters)
+        self.assertLess(history.memory_usage(), filter_bytes + 100)
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+
+        for i in (0, scrollback.BLOCK_LINES * 2 + 7, len(lines) - 1):
+            self.assertEqual(history[i], lines[i])
+
+        # Spilling more blocks after the file was mapped still works
+        for i in range(scrollback.BLOCK_LINES):
+            history.append(make_line("more %i" % i))
+        self.assertEqual(history[-1], make_line("more %i" % (scrollback.BLOCK_LINES - 1)))
+        self.assertEqual(history[len(lines) - 1], lines[-1])
+
+        history.close()
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_remove_spill_files(self):
+        history = scrollback.ScrollbackHistory(100000, spill_dir=self.spill_dir,
+                                               memory_limit=0)
+        for i in range(scrollback.BLOCK_LINES):
+            history.append(make_line("line %i" % i))
+        other_path = os.path.join(self.spill_dir, "other.bin")
+        open(other_path, "wb").close()
+
+        scrollback.remove_spill_files(self.spill_dir)
+        self.assertEqual(os.listdir(self.spill_dir), ["other.bin"])
+        scrollback.remove_spill_files(os.path.join(self.spill_dir, "missing"))
+
+    def test_memory_limit(self):
+        history = scrollback.ScrollbackHistory(100000, compress=False,
+                                               spill_dir=self.spill_dir,
+                                               memory_limit=1000000)
+        for i in range(scrollback.BLOCK_LINES * 2):
+            history.append(make_line("line %i" % i))
+
+        # Everything fits in memory so nothing is spilled
+        self.assertEqual(history.disk_usage(), 0)
+        self.assertEqual(os.listdir(self.spill_dir), [])
+        history.close()
+
+    def test_spill_file_compacted(self):
+        history = scrollback.ScrollbackHistory(2000, spill_dir=self.spill_dir, memory_limit=0)
+        nb_lines = 0
+        while len(history) < history.size():
+            history.append(make_line("line %i" % nb_lines))
+            nb_lines = nb_lines + 1
+        full_size = history.disk_usage()
+
+        # Dropped blocks are reclaimed while the history stays full
+        spill_file = os.path.join(self.spill_dir, os.listdir(self.spill_dir)[0])
+        for i in range(50000):
+            history.append(make_line("line %i" % (nb_lines + i)))
+            self.assertLessEqual(history.disk_usage(), 2 * full_size + 1000)
+        self.assertEqual(os.path.getsize(spill_file), history.disk_usage())
+
+        nb_lines = nb_lines + 50000
+        for i in (0, 1000, len(history) - 1):
+            self.assertEqual(history[i], make_line("line %i" % (nb_lines - len(history) + i)))
+        self.assertEqual(history.search("line %i" % (nb_lines - 1500)), (len(history) - 1500, 0))
+
+        # Thawed blocks are removed from the end of the file
+        history.pop_lines(scrollback.BLOCK_LINES * 2)
+        self.assertEqual(os.path.getsize(spill_file), history.disk_usage())
+        history.append(make_line("last"))
+        self.assertEqual(history[-1], make_line("last"))
+        self.assertEqual(history[0], make_line("line %i" % (nb_lines - 2000)))
+        history.close()
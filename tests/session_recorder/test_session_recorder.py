@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+
+from TerminalView import session_recorder
+from TerminalView import terminal_emulator
+
+
+class record_and_replay(unittest.TestCase):
+    def setUp(self):
+        (handle, self.path) = tempfile.mkstemp(suffix=".tvrec")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_roundtrip(self):
+        recorder = session_recorder.SessionRecorder(self.path)
+        recorder.record_resize(3, 10)
+        recorder.record_output(b"line 1\r\n")
+        recorder.record_input(b"l")
+        recorder.record_output(b"line 2")
+        recorder.close()
+
+        events = list(session_recorder.read_session(self.path))
+        self.assertEqual([event for event, _, _ in events],
+                         [session_recorder.EVENT_RESIZE, session_recorder.EVENT_OUTPUT,
+                          session_recorder.EVENT_INPUT, session_recorder.EVENT_OUTPUT])
+        self.assertEqual(events[0][2], (3, 10))
+        self.assertEqual(events[1][2], b"line 1\r\n")
+        self.assertEqual(events[2][2], b"l")
+
+        timestamps = [timestamp for _, timestamp, _ in events]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+        emulator = terminal_emulator.PyteTerminalEmulator(80, 24, 100, 0.5)
+        frames = []
+        result = session_recorder.replay_session(self.path, emulator,
+                                                 on_output=lambda: frames.append(1))
+        self.assertEqual(result, (2, 14))
+        self.assertEqual(len(frames), 2)
+        self.assertEqual(emulator.display(), ["line 1".ljust(10), "line 2".ljust(10),
+                                              " " * 10])
+
+    def test_truncated_recording(self):
+        recorder = session_recorder.SessionRecorder(self.path)
+        recorder.record_output(b"complete")
+        recorder.record_output(b"cut off")
+        recorder.close()
+
+        with open(self.path, "r+b") as session_file:
+            session_file.truncate(os.path.getsize(self.path) - 2)
+
+        events = list(session_recorder.read_session(self.path))
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0][2], b"complete")
+
+    def test_invalid_file(self):
+        with open(self.path, "wb") as session_file:
+            session_file.write(b"not a recording")
+
+        with self.assertRaises(ValueError):
+            list(session_recorder.read_session(self.path))
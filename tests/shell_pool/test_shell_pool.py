@@ -0,0 +1,90 @@
+import os
+import tempfile
+import time
+import unittest
+
+from TerminalView import linux_pty
+from TerminalView import shell_pool
+
+
+class ShellStub():
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.running = True
+        self.cwd = None
+        self.output = [b"$ "]
+
+    def is_running(self):
+        return self.running
+
+    def receive_output(self, max_read_size, timeout=0):
+        if self.output:
+            return self.output.pop(0)
+        return None
+
+    def change_directory(self, cwd):
+        self.cwd = cwd
+
+    def stop(self):
+        self.running = False
+
+
+class pool(unittest.TestCase):
+    def setUp(self):
+        self.spawned = []
+        self.pool = shell_pool.ShellPool(2, ["bash", "zsh"], spawn=self._spawn)
+
+    def _spawn(self, cmd):
+        shell = ShellStub(cmd)
+        self.spawned.append(shell)
+        return shell
+
+    def test_fill_and_acquire(self):
+        self.pool.fill("bash")
+        self.assertEqual(self.pool.nb_available("bash"), 2)
+        self.assertEqual(len(self.spawned), 2)
+
+        shell = self.pool.acquire("bash", "/tmp")
+        self.assertIs(shell, self.spawned[0])
+        self.assertEqual(shell.cwd, "/tmp")
+        # The prompt printed before the cd was discarded
+        self.assertEqual(shell.output, [])
+
+        # Shells are only shared between views with the same command
+        self.assertIsNone(self.pool.acquire("zsh", "/tmp"))
+
+    def test_only_listed_commands_pooled(self):
+        self.pool.prewarm("htop")
+        self.pool.fill("htop")
+        self.assertIsNone(self.pool.acquire("htop", "/tmp"))
+        self.assertEqual(self.spawned, [])
+
+    def test_dead_shells_are_skipped(self):
+        self.pool.fill("bash")
+        self.spawned[0].running = False
+        self.assertIs(self.pool.acquire("bash", "/tmp"), self.spawned[1])
+
+    def test_close(self):
+        self.pool.fill("bash")
+        self.pool.close()
+        self.assertEqual(self.pool.nb_available("bash"), 0)
+        self.assertFalse(any(shell.is_running() for shell in self.spawned))
+
+
+class pooled_shell(unittest.TestCase):
+    def test_change_directory(self):
+        shell = linux_pty.LinuxPty(["sh"], os.path.expanduser("~"), shell_pool.POOL_LINES,
+                                   shell_pool.POOL_COLUMNS)
+        cwd = tempfile.mkdtemp()
+        try:
+            shell.change_directory(cwd)
+            shell.send_keypress("pwd\r")
+            expected = os.path.realpath(cwd).encode("utf8")
+            output = b""
+            deadline = time.time() + 5
+            while expected not in output and time.time() < deadline:
+                output = output + (shell.receive_output(1024, timeout=0.1) or b"")
+            self.assertIn(expected, output)
+        finally:
+            shell.stop()
+            os.rmdir(cwd)
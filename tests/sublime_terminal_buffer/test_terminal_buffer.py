@@ -8,6 +8,7 @@ import sublime
 
 # Module to test
 from TerminalView import sublime_terminal_buffer
+from TerminalView import utils
 
 
 # still some stuff todo with this testcase - lacks color tests and more edge
@@ -18,6 +19,7 @@ class line_updates(unittest.TestCase):
         self._test_view.terminal_view_scroll = None
         self._test_view.terminal_view_color_regions = {}
         self._test_view.terminal_view_buffer_contents = {}
+        self._test_view.terminal_view_trace = None
         self._sublime_cmd = sublime_terminal_buffer.TerminalViewUpdate(self._test_view)
 
         # We assume the view is 5 lines and 11 chars wide
@@ -120,3 +122,142 @@ class terminal_buffer(unittest.TestCase):
         expected_alt = False
         expected_ctrl = True
         keypress_cmd.run(None, key=expected_key, ctrl=expected_ctrl)
+
+
+class SelectionStub(list):
+    def clear(self):
+        del self[:]
+
+    def add(self, region):
+        self.append(region)
+
+
+class RenderViewStub(sublime.SublimeViewStub):
+    def __init__(self, id):
+        super().__init__(id)
+        self._selection = SelectionStub()
+
+    def sel(self):
+        return self._selection
+
+    def erase(self, edit, region):
+        pass
+
+    def insert(self, edit, pt, text):
+        pass
+
+    def add_regions(self, key, regions, scope="", icon="", flags=0):
+        pass
+
+    def erase_regions(self, key):
+        pass
+
+    def set_viewport_position(self, xy, animate=True):
+        pass
+
+    def text_point(self, row, col):
+        return row * 11 + col
+
+
+class TextViewStub(RenderViewStub):
+    # Keeps the text of the view to check which rows the lines end up on
+    def __init__(self, id):
+        super().__init__(id)
+        self.text = ""
+
+    def insert(self, edit, pt, text):
+        self.text = self.text[:pt] + text + self.text[pt:]
+
+    def replace(self, edit, region, text):
+        super().replace(edit, region, text)
+        self.text = self.text[:region.begin()] + text + self.text[region.end():]
+
+    def erase(self, edit, region):
+        self.text = self.text[:region.begin()] + self.text[region.end():]
+
+
+class offscreen_rendering(unittest.TestCase):
+    def setUp(self):
+        # The view only shows the first 4 of the 8 terminal lines, as while
+        # the screen is not resized to a smaller view yet
+        self._test_view = RenderViewStub(1)
+        self._test_view.set_viewport_extent((110, 80))
+        self._buffer = sublime_terminal_buffer.SublimeTerminalBuffer(self._test_view, "test",
+                                                                     utils.ConsoleLogger())
+        self._buffer.update_terminal_size(8, 10)
+        self._update_cmd = sublime_terminal_buffer.TerminalViewUpdate(self._test_view)
+
+    def _render(self):
+        self._test_view.clear_replace_calls()
+        self._update_cmd.run(None)
+        return [call.content for call in self._test_view.get_replace_calls()]
+
+    def test_visible_lines_first(self):
+        self.assertEqual(len(self._render()), 4)
+        self.assertEqual(len(self._render()), 4)
+        self.assertEqual(self._render(), [])
+
+        emulator = self._test_view.terminal_view_emulator
+        emulator.feed(b"top\x1b[7;1Hbottom")
+        self.assertEqual(self._render(), ["top".ljust(10) + "\n"])
+
+        # Offscreen lines changing repeatedly are rendered once when idle
+        emulator.feed(b"\x1b[1;1HTOP\x1b[7;1HBOTTOM")
+        self.assertEqual(self._render(), ["TOP".ljust(10) + "\n"])
+        self.assertEqual(self._render(), ["BOTTOM".ljust(10) + "\n"])
+        self.assertEqual(self._render(), [])
+
+
+class frame_budget(unittest.TestCase):
+    def setUp(self):
+        self._test_view = TextViewStub(1)
+        self._test_view.set_viewport_extent((110, 200))
+        self._buffer = sublime_terminal_buffer.SublimeTerminalBuffer(self._test_view, "test",
+                                                                     utils.ConsoleLogger())
+        self._buffer.update_terminal_size(10, 10)
+        self._update_cmd = sublime_terminal_buffer.TerminalViewUpdate(self._test_view)
+        self._update_cmd.run(None)
+
+    def _render(self):
+        self._test_view.clear_replace_calls()
+        self._update_cmd.run(None)
+        return [call.content.rstrip() for call in self._test_view.get_replace_calls()]
+
+    def test_lines_carried_over(self):
+        emulator = self._test_view.terminal_view_emulator
+        emulator.feed(b"\r\n".join(b"line %i" % i for i in range(10)) + b"\x1b[3;1H")
+
+        # With a budget that is always exceeded one chunk is updated per frame
+        self._test_view.terminal_view_frame_budget = 1e-9
+        chunk = sublime_terminal_buffer.FRAME_BUDGET_CHUNK_LINES
+        expected = ["line %i" % i for i in [2, 9, 8, 7, 6, 5, 4, 3, 1, 0]]
+        self.assertEqual(sorted(self._render()), sorted(expected[:chunk]))
+        self.assertEqual(sorted(self._render()), sorted(expected[chunk:]))
+        self.assertEqual(self._render(), [])
+
+    def test_lines_on_their_rows(self):
+        # A fresh view gets the cursor line and the lines at the bottom before
+        # the lines above them
+        view = TextViewStub(2)
+        view.set_viewport_extent((810, 480))
+        sublime_terminal_buffer.SublimeTerminalBuffer(view, "test", utils.ConsoleLogger())
+        data = b"\r\n".join(b"line %i" % i for i in range(24))
+        view.terminal_view_emulator.feed(data + b"\x1b[3;1H")
+        view.terminal_view_frame_budget = 1e-9
+        update_cmd = sublime_terminal_buffer.TerminalViewUpdate(view)
+
+        update_cmd.run(None)
+        rows = [line.rstrip() for line in view.text.split("\n")]
+        expected = ["line %i" % i if i == 2 or i > 16 else "" for i in range(24)]
+        self.assertEqual(rows, expected + [""])
+
+        for _ in range(2):
+            update_cmd.run(None)
+        rows = [line.rstrip() for line in view.text.split("\n")]
+        self.assertEqual(rows, ["line %i" % i for i in range(24)] + [""])
+
+    def test_no_budget(self):
+        self._test_view.terminal_view_frame_budget = 0
+        emulator = self._test_view.terminal_view_emulator
+        emulator.feed(b"\r\n".join(b"line %i" % i for i in range(10)))
+        self.assertEqual(len(self._render()), 10)
@@ -1,7 +1,24 @@
+import os
+import shutil
+import tempfile
 import unittest
 
+from TerminalView import color_scheme
+from TerminalView import scrollback
+from TerminalView import snapshot
 from TerminalView import terminal_emulator
 
+# Packed colors by name for the color map tests
+COLORS = {"default": color_scheme.DEFAULT}
+for index, name in enumerate(["black", "red", "green", "yellow", "blue", "magenta", "cyan",
+                              "white"]):
+    COLORS[name] = color_scheme.INDEXED | index
+
+
+def pair(bg, fg):
+    return (COLORS[bg], COLORS[fg], False)
+
+
 class terminal_resize(unittest.TestCase):
     def test_lines_resize(self):
         nb_cols = 20
@@ -47,6 +64,314 @@ class terminal_resize(unittest.TestCase):
             self.assertEqual(display[i], lines[i+1].ljust(nb_cols))
 
 
+class history_scrolling(unittest.TestCase):
+    def setUp(self):
+        self.nb_cols = 10
+        self.nb_lines = 4
+        self.emulator = terminal_emulator.PyteTerminalEmulator(cols=self.nb_cols,
+                                                               lines=self.nb_lines,
+                                                               history=100, ratio=0.5)
+        # Fill screen so lines "line 0" to "line 6" scroll into history
+        data = "\r\n".join("line %i" % i for i in range(10))
+        self.emulator.feed(data.encode("utf8"))
+        self.emulator.clear_dirty()
+
+    def _expected(self, first_line):
+        return [("line %i" % i).ljust(self.nb_cols)
+                for i in range(first_line, first_line + self.nb_lines)]
+
+    def test_line_scrolling(self):
+        self.assertEqual(self.emulator.display(), self._expected(6))
+
+        self.emulator.prev_line()
+        self.assertEqual(self.emulator.display(), self._expected(5))
+        self.assertEqual(len(self.emulator.dirty_lines()), self.nb_lines)
+        self.emulator.clear_dirty()
+
+        self.emulator.next_line()
+        self.assertEqual(self.emulator.display(), self._expected(6))
+
+        # Can not scroll below the live screen
+        self.emulator.clear_dirty()
+        self.emulator.next_line()
+        self.assertEqual(self.emulator.display(), self._expected(6))
+        self.assertEqual(len(self.emulator.dirty_lines()), 0)
+
+    def test_page_scrolling(self):
+        self.emulator.prev_page()
+        self.assertEqual(self.emulator.display(), self._expected(4))
+
+        # Can not scroll past the top of the history
+        for _ in range(10):
+            self.emulator.prev_page()
+        self.assertEqual(self.emulator.display(), self._expected(0))
+
+        self.emulator.next_page()
+        self.assertEqual(self.emulator.display(), self._expected(2))
+
+    def test_cursor_when_scrolled(self):
+        self.assertEqual(self.emulator.cursor(), (3, 6))
+
+        # The cursor moves down with the screen and leaves the viewport
+        self.emulator.prev_line()
+        self.assertEqual(self.emulator.cursor(), None)
+        self.emulator.next_line()
+        self.assertEqual(self.emulator.cursor(), (3, 6))
+
+        self.emulator.feed(b"\x1b[1;1H")
+        self.emulator.prev_line()
+        self.assertEqual(self.emulator.cursor(), (1, 0))
+        self.emulator.prev_page()
+        self.assertEqual(self.emulator.cursor(), (3, 0))
+        self.emulator.prev_line()
+        self.assertEqual(self.emulator.cursor(), None)
+
+    def test_feed_scrolls_to_bottom(self):
+        self.emulator.prev_page()
+        live_buffer = list(self.emulator._screen.buffer)
+        self.emulator.feed("!".encode("utf8"))
+
+        # Scrolling never touches the lines of the live screen
+        self.assertEqual(self.emulator._screen.buffer, live_buffer)
+        expected = self._expected(6)
+        expected[-1] = "line 9!".ljust(self.nb_cols)
+        self.assertEqual(self.emulator.display(), expected)
+
+    def test_history_size(self):
+        emulator = terminal_emulator.PyteTerminalEmulator(cols=self.nb_cols, lines=2,
+                                                          history=3, ratio=1.0)
+        data = "\r\n".join("line %i" % i for i in range(10))
+        emulator.feed(data.encode("utf8"))
+        for _ in range(10):
+            emulator.prev_line()
+        display = emulator.display()
+        self.assertEqual(display[0], "line 5".ljust(self.nb_cols))
+        self.assertEqual(display[1], "line 6".ljust(self.nb_cols))
+
+
+class history_search(unittest.TestCase):
+    def test_search_and_scroll(self):
+        emulator = terminal_emulator.PyteTerminalEmulator(cols=20, lines=4, history=1000,
+                                                          ratio=0.5)
+        data = "\r\n".join("line %i" % i for i in range(20))
+        emulator.feed(data.encode("utf8"))
+
+        # Lines 0-15 are in history and lines 16-19 are on the screen
+        self.assertEqual(emulator.search("line 18"), (18, 0))
+        self.assertEqual(emulator.search("ine 3"), (3, 1))
+        self.assertEqual(emulator.search("line 1", before=3), (1, 0))
+        self.assertEqual(emulator.search("line 42"), None)
+
+        # Match on the screen does not scroll
+        self.assertEqual(emulator.scroll_to_line(18), 2)
+        self.assertEqual(emulator.display()[2], "line 18".ljust(20))
+
+        # Match in history is scrolled into view
+        row = emulator.scroll_to_line(3)
+        self.assertEqual(emulator.display()[row], "line 3".ljust(20))
+        row = emulator.scroll_to_line(0)
+        self.assertEqual(row, 0)
+        self.assertEqual(emulator.display()[row], "line 0".ljust(20))
+
+    def test_numbers_stable_when_lines_dropped(self):
+        emulator = terminal_emulator.PyteTerminalEmulator(cols=20, lines=4, history=10,
+                                                          ratio=0.5)
+        data = "\r\n".join("line %i" % i for i in range(20))
+        emulator.feed(data.encode("utf8"))
+
+        # Lines 0-5 were dropped, 6-15 are in history
+        self.assertEqual(emulator.search("line 9"), (9, 0))
+        self.assertEqual(emulator.search("line 1", before=6), None)
+
+        # Scrolling more lines out keeps the number of the last match
+        emulator.feed(b"\r\nline 20\r\nline 21")
+        self.assertEqual(emulator.search("line", before=9), (8, 0))
+        row = emulator.scroll_to_line(8)
+        self.assertEqual(emulator.display()[row], "line 8".ljust(20))
+
+    def test_alternate_screen(self):
+        emulator = terminal_emulator.PyteTerminalEmulator(cols=20, lines=4, history=100,
+                                                          ratio=0.5)
+        data = "\r\n".join("line %i" % i for i in range(20))
+        emulator.feed(data.encode("utf8"))
+        emulator.feed(b"\x1b[?1049h\x1b[3;1Halt line")
+
+        self.assertEqual(emulator.search("line"), (18, 4))
+        self.assertEqual(emulator.search("line", before=18), None)
+        self.assertEqual(emulator.scroll_to_line(18), 2)
+
+
+class alternate_screen(unittest.TestCase):
+    def setUp(self):
+        self.nb_cols = 10
+        self.nb_lines = 4
+        self.emulator = terminal_emulator.PyteTerminalEmulator(cols=self.nb_cols,
+                                                               lines=self.nb_lines,
+                                                               history=100, ratio=0.5)
+        data = "\r\n".join("line %i" % i for i in range(6))
+        self.emulator.feed(data.encode("utf8"))
+        self.primary = self.emulator.display()
+        self.emulator.clear_dirty()
+
+    def test_switch_and_restore(self):
+        self.emulator.feed(b"\x1b[?1049h")
+        self.assertEqual(self.emulator.display(), [" " * self.nb_cols] * self.nb_lines)
+        self.assertEqual(set(self.emulator.dirty_lines().keys()), set(range(self.nb_lines)))
+        self.emulator.clear_dirty()
+
+        # Scrolling on the alternate screen does not go into the history
+        history_size = self.emulator.history_size()
+        self.emulator.feed(b"\r\n".join(b"alt %i" % i for i in range(10)))
+        self.assertEqual(self.emulator.history_size(), history_size)
+        self.emulator.prev_page()
+        self.assertEqual(self.emulator.display()[-1], "alt 9".ljust(self.nb_cols))
+
+        # Draw a line equal to the primary screen so it does not get dirty
+        self.emulator.feed(b"\x1b[H\x1b[2J\x1b[2;1H" + self.primary[1].rstrip().encode("utf8"))
+        self.emulator.clear_dirty()
+
+        self.emulator.feed(b"\x1b[?1049l")
+        self.assertEqual(self.emulator.display(), self.primary)
+        self.assertEqual(set(self.emulator.dirty_lines().keys()), set([0, 2, 3]))
+        # The cursor is restored
+        self.assertEqual(self.emulator.cursor(), (3, 6))
+
+    def test_resize(self):
+        self.emulator.feed(b"\x1b[?47h")
+        self.emulator.resize(self.nb_lines, 12)
+        self.emulator.feed(b"\x1b[?47l")
+        self.assertEqual(self.emulator.display(), [line + "  " for line in self.primary])
+
+    def test_reset(self):
+        self.emulator.feed(b"\x1b[?1049h")
+        self.emulator.feed(b"\x1bc")
+        self.assertEqual(self.emulator.display(), [" " * self.nb_cols] * self.nb_lines)
+        self.emulator.feed(b"\x1b[?1049l")
+        self.assertEqual(self.emulator.display(), [" " * self.nb_cols] * self.nb_lines)
+
+
+class reflow(unittest.TestCase):
+    def setUp(self):
+        self.emulator = terminal_emulator.PyteTerminalEmulator(cols=10, lines=4, history=100,
+                                                               ratio=0.5)
+
+    def _history(self, emulator):
+        history = emulator._screen.history
+        return ["".join(char.data for char in line) for line in history.get_lines(0, len(history))]
+
+    def test_wrapped_lines_marked(self):
+        self.emulator.feed(b"0123456789abc\r\nshort")
+        buffer = self.emulator._screen.buffer
+        self.assertIsInstance(buffer[0], scrollback.WrappedLine)
+        self.assertNotIsInstance(buffer[1], scrollback.WrappedLine)
+        self.assertNotIsInstance(buffer[2], scrollback.WrappedLine)
+
+        # Erasing the rest of the line ends the wrapped line
+        self.emulator.feed(b"\x1b[1;5H\x1b[K")
+        self.assertNotIsInstance(buffer[0], scrollback.WrappedLine)
+
+    def test_zero_width_at_line_end_does_not_wrap(self):
+        self.emulator.feed("0123456789\u0301".encode("utf8"))
+        self.assertNotIsInstance(self.emulator._screen.buffer[0], scrollback.WrappedLine)
+        self.assertEqual(self.emulator.cursor(), (0, 10))
+
+    def test_resize_narrower(self):
+        self.emulator.feed(b"0123456789abc\r\n$ ")
+        self.emulator.resize(4, 6)
+        self.assertEqual(self.emulator.display(), ["012345", "6789ab", "c     ", "$     "])
+        self.assertEqual(self.emulator.cursor(), (3, 2))
+
+    def test_resize_wider(self):
+        self.emulator.feed(b"\r\n".join([b"0123456789abcdefghij"] * 3) + b"\r\n$ ")
+        self.assertEqual(self.emulator.history_size(), 3)
+        self.emulator.resize(4, 20)
+        # The lines are pulled back from the history
+        self.assertEqual(self.emulator.history_size(), 0)
+        self.assertEqual(self.emulator.display(), ["0123456789abcdefghij"] * 3 + ["$".ljust(20)])
+        self.assertEqual(self.emulator.cursor(), (3, 2))
+
+    def test_resize_keeps_wide_characters(self):
+        self.emulator.feed("abcd日本語".encode("utf8"))
+        self.emulator.resize(4, 5)
+        self.assertEqual(self.emulator.display()[:3], ["abcd ", "日 本  ", "語    "])
+
+    def test_history_reflow(self):
+        data = b"".join(b"line %i " % i + b"x" * (i % 23) + b"\r\n" for i in range(300))
+        self.emulator.feed(data)
+        self.emulator.resize(4, 7)
+        while self.emulator.reflow_history(50):
+            pass
+        self.emulator.feed(b"done")
+
+        expected = terminal_emulator.PyteTerminalEmulator(cols=7, lines=4, history=100, ratio=0.5)
+        expected.feed(data + b"done")
+        self.assertEqual(self._history(self.emulator), self._history(expected))
+        self.assertEqual(self.emulator.display(), expected.display())
+
+    def test_resize_alternate_screen_does_not_reflow(self):
+        self.emulator.feed(b"\x1b[?1049h0123456789abc")
+        self.emulator.resize(4, 5)
+        self.assertEqual(self.emulator.display(), ["01234", "abc  ", "     ", "     "])
+
+
+class saved_snapshot(unittest.TestCase):
+    def setUp(self):
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.snapshot_dir, "snapshots", "view.tvsnap")
+
+    def tearDown(self):
+        shutil.rmtree(self.snapshot_dir)
+
+    def _restored(self, emulator):
+        snapshot.save_snapshot(self.path, emulator)
+        restored = terminal_emulator.PyteTerminalEmulator(cols=20, lines=3, history=1000,
+                                                          ratio=0.5)
+        self.assertTrue(snapshot.load_snapshot(self.path, restored))
+        return restored
+
+    def test_restore(self):
+        emulator = terminal_emulator.PyteTerminalEmulator(cols=8, lines=4, history=1000,
+                                                          ratio=0.5)
+        emulator.feed(b"".join(b"\x1b[31mline\x1b[0m %i\r\n" % i for i in range(600)))
+        emulator.feed(b"0123456789$ ")
+
+        restored = self._restored(emulator)
+        self.assertEqual(restored.history_size(), emulator.history_size() + 1)
+        self.assertEqual(restored.display()[:2], emulator.display()[1:3])
+        self.assertEqual(restored.color_map({0})[0], emulator.color_map({1})[1])
+        # New output starts on the line below the restored output
+        self.assertEqual(restored.cursor(), (3, 0))
+        self.assertEqual(restored.search("line 17"), emulator.search("line 17"))
+
+        # The soft wrap is kept so the restored lines can be reflowed
+        restored.resize(4, 12)
+        self.assertEqual(restored.display()[2], "0123456789$ ")
+
+    def test_restore_primary_screen(self):
+        emulator = terminal_emulator.PyteTerminalEmulator(cols=8, lines=4, history=1000,
+                                                          ratio=0.5)
+        emulator.feed(b"$ less\r\n\x1b[?1049hpage")
+
+        restored = self._restored(emulator)
+        self.assertEqual(restored.display()[0], "$ less  ")
+        self.assertEqual(restored.cursor(), (1, 0))
+
+    def test_missing_snapshot(self):
+        emulator = terminal_emulator.PyteTerminalEmulator(cols=8, lines=4, history=1000,
+                                                          ratio=0.5)
+        self.assertFalse(snapshot.load_snapshot(self.path, emulator))
+
+    def test_remove_old_snapshots(self):
+        emulator = terminal_emulator.PyteTerminalEmulator(cols=8, lines=4, history=1000,
+                                                          ratio=0.5)
+        snapshot.save_snapshot(self.path, emulator)
+        snapshot_dir = os.path.dirname(self.path)
+        snapshot.remove_old_snapshots(snapshot_dir)
+        self.assertEqual(os.listdir(snapshot_dir), ["view.tvsnap"])
+        snapshot.remove_old_snapshots(snapshot_dir, max_age=-1)
+        self.assertEqual(os.listdir(snapshot_dir), [])
+
+
 class pyte_buffer_to_color_map(unittest.TestCase):
     def test_no_colors(self):
         buffer_factory = PyteBufferStubFactory(14, 37)
@@ -67,16 +392,16 @@ class pyte_buffer_to_color_map(unittest.TestCase):
 
         expected = {
             2: {
-                5: {'color': ('magenta', 'white'), 'field_length': 1}
+                5: {'color': pair('magenta', 'white'), 'field_length': 1}
             },
             3: {
-                5: {'color': ('blue', 'white'), 'field_length': 1}
+                5: {'color': pair('blue', 'white'), 'field_length': 1}
             },
             6: {
-                5: {'color': ('green', 'white'), 'field_length': 1}
+                5: {'color': pair('green', 'white'), 'field_length': 1}
             },
             19: {
-                5: {'color': ('cyan', 'white'), 'field_length': 1}
+                5: {'color': pair('cyan', 'white'), 'field_length': 1}
             }
         }
 
@@ -114,19 +439,19 @@ class pyte_buffer_to_color_map(unittest.TestCase):
 
         expected = {
             0: {
-                0: {'color': ('yellow', 'cyan'), 'field_length': 3},
-                3: {'color': ('red', 'cyan'), 'field_length': 1}
+                0: {'color': pair('yellow', 'cyan'), 'field_length': 3},
+                3: {'color': pair('red', 'cyan'), 'field_length': 1}
             },
             8: {
-                8: {'color': ('blue', 'yellow'), 'field_length': 1},
-                1: {'color': ('blue', 'yellow'), 'field_length': 6}
+                8: {'color': pair('blue', 'yellow'), 'field_length': 1},
+                1: {'color': pair('blue', 'yellow'), 'field_length': 6}
             },
             3: {
-                11: {'color': ('red', 'green'), 'field_length': 3}
+                11: {'color': pair('red', 'green'), 'field_length': 3}
             },
             24: {
-                1: {'color': ('yellow', 'yellow'), 'field_length': 1},
-                17: {'color': ('yellow', 'yellow'), 'field_length': 3}
+                1: {'color': pair('yellow', 'yellow'), 'field_length': 1},
+                17: {'color': pair('yellow', 'yellow'), 'field_length': 3}
             }
         }
 
@@ -149,13 +474,13 @@ class pyte_buffer_to_color_map(unittest.TestCase):
         expected = {
             3: {
                 4: {
-                    'color': ('red', 'green'),
+                    'color': pair('red', 'green'),
                     'field_length': 3
                 },
             },
             0: {
                 3: {
-                    'color': ('yellow', 'cyan'),
+                    'color': pair('yellow', 'cyan'),
                     'field_length': 2
                 }
             },
@@ -188,19 +513,19 @@ class pyte_buffer_to_color_map(unittest.TestCase):
             0: {
                 0: {
                     'field_length': 3,
-                    'color': ('white', 'black')
+                    'color': pair('white', 'black')
                 },
                 9: {
                     'field_length': 3,
-                    'color': ('white', 'cyan')
+                    'color': pair('white', 'cyan')
                 },
                 3: {
                     'field_length': 3,
-                    'color': ('white', 'red')
+                    'color': pair('white', 'red')
                 },
                 6: {
                     'field_length': 3,
-                    'color': ('white', 'green')
+                    'color': pair('white', 'green')
                 }
             }
         }
@@ -208,9 +533,48 @@ class pyte_buffer_to_color_map(unittest.TestCase):
         self.assertDictEqual(color_map, expected)
 
 
+class extended_colors(unittest.TestCase):
+    def setUp(self):
+        self.emulator = terminal_emulator.PyteTerminalEmulator(cols=10, lines=2, history=100,
+                                                               ratio=0.5)
+
+    def _colors(self, data):
+        self.emulator.feed(data)
+        char = self.emulator._screen.buffer[0][0]
+        return (char.bg, char.fg)
+
+    def test_basic_colors(self):
+        self.assertEqual(self._colors(b"\x1b[31;42mx"), pair("green", "red")[:2])
+        self.assertEqual(self._colors(b"\r\x1b[97;100mx"),
+                         (color_scheme.INDEXED | 8, color_scheme.INDEXED | 15))
+        self.assertEqual(self._colors(b"\r\x1b[39;49mx"), pair("default", "default")[:2])
+        self.assertEqual(self._colors(b"\r\x1b[31m\x1b[0mx"), pair("default", "default")[:2])
+
+    def test_256_colors(self):
+        self.assertEqual(self._colors(b"\x1b[38;5;196;48;5;21mx"),
+                         (color_scheme.indexed(21), color_scheme.indexed(196)))
+
+    def test_truecolor(self):
+        self.assertEqual(self._colors(b"\x1b[38;2;255;128;0;1mx"),
+                         (color_scheme.DEFAULT, color_scheme.rgb(255, 128, 0)))
+        self.assertTrue(self.emulator._screen.buffer[0][0].bold)
+
+    def test_invalid_extended_color(self):
+        self.assertEqual(self._colors(b"\x1b[31;38;2;255mx"), pair("default", "red")[:2])
+
+    def test_color_map(self):
+        self.emulator.feed(b"\x1b[38;2;1;2;3mab\x1b[1mc\x1b[0md")
+        color_map = self.emulator.color_map([0])
+        rgb_color = color_scheme.rgb(1, 2, 3)
+        self.assertEqual(color_map, {0: {
+            0: {"color": (color_scheme.DEFAULT_BG, rgb_color, False), "field_length": 2},
+            2: {"color": (color_scheme.DEFAULT_BG, rgb_color, True), "field_length": 1},
+        }})
+
+
 class PyteBufferStubFactory():
     def __init__(self, nb_lines, nb_cols):
-        default_char = CharStub("default", "default", reverse=False)
+        default_char = CharStub(color_scheme.DEFAULT, color_scheme.DEFAULT, reverse=False)
 
         self.buffer = []
         for i in range(nb_lines):
@@ -221,7 +585,7 @@ class PyteBufferStubFactory():
             self.buffer.append(line)
 
     def set_color(self, line, col, bg, fg, reverse=False):
-        self.buffer[line][col] = CharStub(bg, fg, reverse=reverse)
+        self.buffer[line][col] = CharStub(COLORS[bg], COLORS[fg], reverse=reverse)
 
     def produce(self):
         return self.buffer
@@ -231,4 +595,5 @@ class CharStub():
     def __init__(self, bg, fg, reverse=False):
         self.bg = bg
         self.fg = fg
+        self.bold = False
         self.reverse = reverse
@@ -13,10 +13,16 @@ class ConsoleLogger():
         settings = sublime.load_settings('TerminalView.sublime-settings')
         self._enabled = settings.get("terminal_view_print_debug", False)
 
-    def log(self, string):
+    def enabled(self):
+        return self._enabled
+
+    def log(self, string, *args):
         """
-        Log string to sublime text console if debug is enabled
+        Log string to sublime text console if debug is enabled. If args are
+        given the string is only formatted with them when debug is enabled.
         """
         if self._enabled:
+            if args:
+                string = string % args
             prefix = "[terminal_view debug] [%.3f] " % (time.time())
             print(prefix + string)